@@ -0,0 +1,332 @@
+"""Benchmarks for the agent's collection, formatting and upload hot paths.
+
+Runs on synthetic data, so neither osquery, Windows nor a backend is needed:
+
+    cd agent
+    python benchmarks/bench_agent.py                   # compare against baseline.json
+    python benchmarks/bench_agent.py --quick           # 1k and 10k rows only
+    python benchmarks/bench_agent.py --update_baseline
+
+Each case is timed as the median of --repeat runs. Exits with status 1
+when a case is slower than its tolerance and the noise floor allow, or
+uses more memory than the stored baseline allows.
+"""
+import os
+import sys
+import gc
+import json
+import gzip
+import time
+import shutil
+import logging
+import argparse
+import platform
+import statistics
+import tempfile
+import threading
+import tracemalloc
+from itertools import chain
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.osquery_manager import OSQueryManager, OUTPUT_CHUNK_SIZE
+from src.osquery_session import iter_json_rows
+from src.process_snapshot import ProcessSnapshot
+from src.security_scan import run_security_scan
+from src.wire_format import serialize, serialize_gzip, iter_json, GZIP_LEVEL, encode_columns, PROCESS_COLUMNS, NETWORK_COLUMNS
+from src.spool import Spool, SpoolSender
+from src.transport import configure_transport
+from src.agent import send_osquery_data
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+ROW_COUNTS = (1000, 10000, 100000)
+QUICK_ROW_COUNTS = (1000, 10000)
+
+# Slowdowns smaller than this many seconds are scheduler and cache noise, never regressions
+TIME_NOISE_FLOOR = 0.01
+
+# Allowed slowdown per case family where it differs from --time_tolerance. The end-to-end
+# cycle goes through sockets and the filesystem, and the scan builds a dict per process row,
+# so both swing with the host and the allocator far more than the pure encoding cases
+CASE_TIME_TOLERANCES = {
+    'end_to_end_cycle': 1.0,
+    'run_security_scan': 1.0,
+    'stream_osquery_output': 0.75
+}
+
+
+def process_rows(count):
+    """Rows shaped like the processes query, with a realistic spread of names and paths"""
+    return [
+        {
+            'pid': 1000 + i,
+            'name': f'worker-{i % 50}',
+            'path': f'/tmp/app-{i % 7}/bin/worker' if i % 10 == 0 else f'/usr/lib/app-{i % 200}/bin/worker-{i % 50}',
+            'cmdline': f'/usr/lib/app-{i % 200}/bin/worker-{i % 50} --config /etc/app-{i % 200}.conf --threads {i % 8}',
+            'state': 'S',
+            'parent': 1 if i % 3 else 1000 + i - 1,
+            'uid': i % 5 * 1000,
+            'start_time': 1700000000 + i
+        }
+        for i in range(count)
+    ]
+
+
+def network_rows(count):
+    return [
+        {
+            'name': f'worker-{i % 50}',
+            'path': f'/usr/lib/app-{i % 200}/bin/worker-{i % 50}',
+            'port': 1024 + i % 64000,
+            'address': '0.0.0.0' if i % 2 else '127.0.0.1',
+            'protocol': 'tcp' if i % 4 else 'udp'
+        }
+        for i in range(count)
+    ]
+
+
+def fake_snapshot(count):
+    """A ProcessSnapshot built from synthetic psutil-shaped records instead of the live process table"""
+    processes = [
+        {
+            'pid': row['pid'],
+            'name': row['name'],
+            'exe': row['path'],
+            'cmdline': row['cmdline'].split(),
+            'ppid': row['parent'],
+            'status': 'sleeping',
+            'create_time': float(row['start_time']),
+            'uid': row['uid']
+        }
+        for row in process_rows(count)
+    ]
+    connections = [
+        {
+            'pid': 1000 + i,
+            'address': '0.0.0.0',
+            'port': 1024 + i * 7 % 64000,
+            'status': 'LISTEN',
+            'protocol': 'tcp'
+        }
+        for i in range(max(count // 20, 1))
+    ]
+    return ProcessSnapshot(processes, connections)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Accepts uploads like the backend would, without storing them"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.server.bytes_received += len(body)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.bytes_received = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(func, repeat=7):
+    """Median wall time over ``repeat`` runs, then peak traced memory of one more run.
+
+    As in timeit, the garbage collector is off while a run is timed, so a
+    full collection landing in one case does not decide its time.
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        result = None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    median = statistics.median(times)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return median, peak / (1024 * 1024), result
+
+
+def benchmark_cases(row_counts):
+    """Yield (name, rows, func) for every benchmark case"""
+    osquery = OSQueryManager(persistent=False)
+    for count in row_counts:
+        processes = process_rows(count)
+        network = network_rows(count)
+        yield f'format_process_data[{count}]', count, lambda rows=processes: osquery.format_process_data(rows)
+        yield f'format_network_data[{count}]', count, lambda rows=network: osquery.format_network_data(rows)
+        yield f'format_rows[{count}]', count, lambda rows=processes: osquery.format_rows('processes', rows)
+        yield f'encode_columns[{count}]', count, lambda rows=processes: encode_columns('process', rows, PROCESS_COLUMNS)
+
+        # osqueryi --json output parsed, formatted and encoded a row at a time; peak memory should not grow with count
+        output = json.dumps(processes, indent=2)
+        chunks = [output[i:i + OUTPUT_CHUNK_SIZE] for i in range(0, len(output), OUTPUT_CHUNK_SIZE)]
+        yield f'stream_osquery_output[{count}]', count, lambda chunks=chunks: sum(
+            len(piece) for piece in iter_json(osquery.iter_process_data(iter_json_rows(chunks))))
+
+        snapshot = fake_snapshot(count)
+        yield f'run_security_scan[{count}]', count, lambda snapshot=snapshot: run_security_scan(snapshot)
+
+        body = {
+            'processes': osquery.format_process_data(processes),
+            'network': osquery.format_network_data(network),
+            'system': None
+        }
+        columnar = {
+            'processes': encode_columns('process', processes, PROCESS_COLUMNS),
+            'network': encode_columns('network_connection', network, NETWORK_COLUMNS),
+            'system': None,
+            'format': 'columnar'
+        }
+        yield f'serialize_json[{count}]', count, lambda body=body: serialize(body, 'json')[0]
+        yield f'serialize_compact[{count}]', count, lambda body=columnar: serialize(body, 'compact')[0]
+        yield f'gzip_json[{count}]', count, lambda body=body: gzip.compress(serialize(body, 'json')[0], GZIP_LEVEL)
+        yield f'serialize_gzip[{count}]', count, lambda body=body: serialize_gzip(body, 'json')[0]
+
+
+def end_to_end_case(count):
+    """One collection cycle: format, spool, then deliver to a local stub server"""
+    server = start_stub_server()
+    api_url = f'http://127.0.0.1:{server.server_address[1]}'
+    spool_dir = tempfile.mkdtemp(prefix='siem-bench-spool-')
+    spool = Spool(spool_dir)
+    sender = SpoolSender(spool, headers={'Authorization': 'Bearer bench'})
+    osquery = OSQueryManager(persistent=False)
+    processes = process_rows(count)
+    network = network_rows(count)
+
+    def cycle():
+        data = {
+            'processes': osquery.format_process_data(processes),
+            'network': osquery.format_network_data(network),
+            'system': None
+        }
+        send_osquery_data(api_url, 'bench-agent', 'bench-user', 'bench', data, spool=spool)
+        if not sender.drain():
+            raise RuntimeError('Stub server rejected the upload')
+
+    def cleanup():
+        server.shutdown()
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    return cycle, cleanup
+
+
+def run(row_counts, repeat):
+    results = {}
+
+    def end_to_end_cases():
+        for count in row_counts:
+            cycle, cleanup = end_to_end_case(count)
+            yield f'end_to_end_cycle[{count}]', count, cycle
+            yield f'_cleanup[{count}]', count, cleanup
+
+    # Cases are built as they are run, so the data of earlier row counts is freed first
+    for name, rows, func in chain(benchmark_cases(row_counts), end_to_end_cases()):
+        if name.startswith('_cleanup'):
+            func()
+            continue
+        seconds, peak_mb, result = measure(func, repeat)
+        entry = {
+            'seconds': round(seconds, 6),
+            'rows_per_second': round(rows / seconds) if seconds else None,
+            'peak_mb': round(peak_mb, 3)
+        }
+        if isinstance(result, bytes):
+            entry['bytes'] = len(result)
+        results[name] = entry
+        size = f"  {entry['bytes'] / 1024:10.1f} KiB" if 'bytes' in entry else ''
+        print(f"{name:32s} {seconds * 1000:10.2f} ms {entry['rows_per_second'] or 0:12,d} rows/s "
+              f"{peak_mb:9.2f} MiB peak{size}")
+    return results
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    """Return a list of regressions against the baseline"""
+    regressions = []
+    for name, entry in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        tolerance = CASE_TIME_TOLERANCES.get(name.split('[')[0], time_tolerance)
+        allowed = max(base['seconds'] * (1 + tolerance), base['seconds'] + TIME_NOISE_FLOOR)
+        if entry['seconds'] > allowed:
+            regressions.append(f"{name}: {entry['seconds'] * 1000:.2f} ms vs baseline {base['seconds'] * 1000:.2f} ms")
+        if entry['peak_mb'] > base['peak_mb'] * (1 + memory_tolerance) + 0.5:
+            regressions.append(f"{name}: {entry['peak_mb']:.2f} MiB peak vs baseline {base['peak_mb']:.2f} MiB")
+        if 'bytes' in base and entry.get('bytes', 0) > base['bytes'] * 1.05:
+            regressions.append(f"{name}: {entry['bytes']} bytes vs baseline {base['bytes']} bytes")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark agent collection and upload hot paths')
+    parser.add_argument('--quick', action='store_true', help='Skip the 100k row cases')
+    parser.add_argument('--repeat', type=int, default=7, help='Timed runs per case; the median is kept')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline file to compare against')
+    parser.add_argument('--update_baseline', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--time_tolerance', type=float, default=0.75,
+                        help='Allowed slowdown before a case counts as a regression (0.75 = 75%%), '
+                             'for cases without their own tolerance')
+    parser.add_argument('--memory_tolerance', type=float, default=0.2,
+                        help='Allowed growth in peak memory before a case counts as a regression')
+    parser.add_argument('--output', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    # The agent modules log warnings (no osquery, no rules hits) that would drown the report
+    logging.disable(logging.WARNING)
+    configure_transport(connect_timeout=2, read_timeout=30, retries=0)
+
+    results = run(QUICK_ROW_COUNTS if args.quick else ROW_COUNTS, args.repeat)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update_baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+    if regressions:
+        print("\nRegressions against baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Stand-in for the PowerShell host process, for running the Windows scanner on Linux.
+
+Speaks the same line protocol as powershell_host.HOST_LOOP: each request is
+one line of base64-encoded script and each response one line of JSON.
+Scripts are answered from canned cmdlet output, so the checks exercise
+their real parsing:
+
+    cd agent
+    python benchmarks/fake_powershell.py --scan
+    python benchmarks/fake_powershell.py --scan --delay 2 --defender_off
+
+or from code:
+
+    SecurityScanner(powershell_command=[sys.executable, 'benchmarks/fake_powershell.py'])
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+
+# First matching cmdlet wins; values are what ConvertTo-Json would produce
+def canned_results(args):
+    return [
+        ('Get-MpComputerStatus', {'RealTimeProtectionEnabled': not args.defender_off, 'AntivirusEnabled': True}),
+        ('Get-NetFirewallProfile', [
+            {'Name': 'Domain', 'Enabled': True},
+            {'Name': 'Private', 'Enabled': True},
+            {'Name': 'Public', 'Enabled': not args.firewall_off}
+        ]),
+        ('Microsoft.Update.Session', {'pending': 3, 'security': 1}),
+        ('Get-Service wuauserv', {'Status': 'Running', 'StartType': 'Manual'}),
+        # Non-ASCII display names check that output survives whatever code page the host uses
+        ('Get-Service', [{'Name': 'WSearch', 'DisplayName': 'Windows-Suche für Dateien'}]),
+    ]
+
+
+def serve(args):
+    results = canned_results(args)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            script = base64.b64decode(line).decode('utf-8')
+        except ValueError as e:
+            response = {'ok': False, 'error': f'Bad request: {e}'}
+        else:
+            if args.delay:
+                time.sleep(args.delay)
+            match = next((result for cmdlet, result in results if cmdlet in script), None)
+            response = {'ok': True, 'result': match}
+        sys.stdout.write(json.dumps(response, ensure_ascii=False) + '\n')
+        sys.stdout.flush()
+
+
+def scan(args):
+    """Run every scanner check against stand-in hosts and print the findings"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from src.security_scanner import SecurityScanner
+
+    command = [sys.executable, os.path.abspath(__file__), '--delay', str(args.delay)]
+    if args.defender_off:
+        command.append('--defender_off')
+    if args.firewall_off:
+        command.append('--firewall_off')
+    scanner = SecurityScanner(powershell_command=command)
+    try:
+        start = time.monotonic()
+        results = scanner.scan_system()
+        elapsed = time.monotonic() - start
+    finally:
+        scanner.close()
+    for finding in results['vulnerabilities']:
+        print(f"{finding['severity']:8s} {finding['title']}")
+    print(f"{len(results['vulnerabilities'])} findings in {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake PowerShell host for the Windows scanner')
+    parser.add_argument('--delay', type=float, default=0, help='Seconds to spend on every script')
+    parser.add_argument('--defender_off', action='store_true', help='Report real-time protection disabled')
+    parser.add_argument('--firewall_off', action='store_true', help='Report the public firewall profile disabled')
+    parser.add_argument('--scan', action='store_true', help='Run the scanner against this stand-in instead of serving')
+    args = parser.parse_args()
+    if args.scan:
+        scan(args)
+    else:
+        serve(args)
+
+
+if __name__ == '__main__':
+    main()
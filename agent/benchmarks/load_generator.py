@@ -0,0 +1,399 @@
+"""Replay agent traffic from many simulated agents to size the backend.
+
+Payloads are built once with the agent's own collectors (get_system_info,
+OSQueryManager.collect_all_data and run_security_scan), then sent by N
+virtual agents, each with its own hostname, agent id and jittered
+schedule, over one keep-alive connection per agent:
+
+    cd agent
+    python benchmarks/load_generator.py --agents 1000 --duration 120
+    python benchmarks/load_generator.py --agents 100,1000,5000 --interval 10
+    python benchmarks/load_generator.py --api_url http://localhost:3000 -u <user id> --agents 500
+
+Without --api_url the traffic goes to an in-process stub receiver. Large
+fleets need a matching open-file limit (ulimit -n).
+"""
+import os
+import sys
+import ssl
+import json
+import gzip
+import time
+import random
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from urllib.parse import urlsplit, urlencode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.agent import get_system_info
+from src.osquery_manager import OSQueryManager
+from src.process_snapshot import SnapshotCache
+from src.security_scan import run_security_scan
+from src.wire_format import serialize, WIRE_FORMATS
+
+ENDPOINTS = ('deploy', 'status', 'osquery', 'vulnerability-scan')
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class LoadStats:
+    """Latency and volume per endpoint for one reporting window"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors = {endpoint: 0 for endpoint in ENDPOINTS}
+        self.bytes_sent = 0
+
+    def record(self, endpoint, latency, size, ok):
+        self.latencies[endpoint].append(latency)
+        self.bytes_sent += size
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        endpoints = {}
+        total = 0
+        for endpoint, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            ordered = sorted(latencies)
+            total += len(ordered)
+            endpoints[endpoint] = {
+                'requests': len(ordered),
+                'errors': self.errors[endpoint],
+                'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(ordered, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(ordered, 0.99) * 1000, 2),
+                'max_ms': round(ordered[-1] * 1000, 2)
+            }
+        return {
+            'seconds': round(elapsed, 2),
+            'requests_per_second': round(total / elapsed, 2),
+            'bytes_per_second': round(self.bytes_sent / elapsed),
+            'errors': sum(self.errors.values()),
+            'endpoints': endpoints
+        }
+
+
+def print_summary(label, summary):
+    print(f"{label}: {summary['requests_per_second']:.1f} req/s, "
+          f"{summary['bytes_per_second'] / 1024:.1f} KiB/s sent, {summary['errors']} errors")
+    for endpoint, entry in summary['endpoints'].items():
+        print(f"  {endpoint:20s} {entry['requests']:7d} req  p50 {entry['p50_ms']:8.2f} ms  "
+              f"p95 {entry['p95_ms']:8.2f} ms  p99 {entry['p99_ms']:8.2f} ms  max {entry['max_ms']:8.2f} ms  "
+              f"errors {entry['errors']}")
+
+
+class HttpConnection:
+    """A minimal keep-alive HTTP/1.1 client, so thousands of agents fit in one event loop"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.base_path = parts.path.rstrip('/')
+        self.reader = None
+        self.writer = None
+        # One request in flight per connection, like the agent's sequential sender
+        self.lock = asyncio.Lock()
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+    async def post(self, path, params, body, headers):
+        async with self.lock:
+            return await self._post(path, params, body, headers)
+
+    async def _post(self, path, params, body, headers):
+        if self.writer is None:
+            await self._connect()
+        target = f"{self.base_path}{path}?{urlencode(params)}" if params else f"{self.base_path}{path}"
+        lines = [f"POST {target} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(body)}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        try:
+            self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+            await self.writer.drain()
+            status_line = await self.reader.readline()
+            if not status_line:
+                raise ConnectionError('Connection closed by server')
+            status = int(status_line.split()[1])
+            length = 0
+            keep_alive = True
+            while True:
+                line = await self.reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                name = name.strip().lower()
+                if name == 'content-length':
+                    length = int(value)
+                elif name == 'connection' and value.strip().lower() == 'close':
+                    keep_alive = False
+            response = await self.reader.readexactly(length) if length else b''
+        except Exception:
+            self.close()
+            raise
+        if not keep_alive:
+            self.close()
+        return status, response
+
+
+class PayloadTemplates:
+    """Real agent payloads, collected once and re-labelled for each virtual agent"""
+
+    def __init__(self, wire_format='json', compress=True):
+        self.wire_format = wire_format
+        self.compress = compress
+        snapshots = SnapshotCache()
+        osquery = OSQueryManager(persistent=False, snapshots=snapshots, columnar=wire_format != 'json')
+        self.system_info = get_system_info()
+        osquery_data = osquery.collect_all_data()
+        osquery.close()
+        if wire_format != 'json':
+            osquery_data['format'] = 'columnar'
+        self.osquery_body, self.osquery_type = self._encode(osquery_data, wire_format)
+        self.scan_results = run_security_scan(snapshots.get()) or {}
+
+    def _encode(self, body, wire_format='json'):
+        data, content_type = serialize(body, wire_format)
+        if self.compress:
+            return gzip.compress(data, 6), content_type
+        return data, content_type
+
+    def status(self, hostname):
+        system_info = dict(self.system_info, hostname=hostname)
+        return self._encode({
+            'status': 'running',
+            'systemInfo': system_info,
+            'lastActive': datetime.utcnow().isoformat()
+        })[0]
+
+    def scan(self, hostname):
+        return self._encode(dict(self.scan_results, hostname=hostname, timestamp=datetime.utcnow().isoformat()))[0]
+
+
+class VirtualAgent:
+    """One simulated agent: registers, then uploads status, osquery and scan results on jittered schedules"""
+
+    def __init__(self, index, api_url, user_id, templates, stats, interval, jitter, hostname_prefix):
+        self.hostname = f"{hostname_prefix}-{index:05d}"
+        self.user_id = user_id
+        self.agent_id = None
+        self.templates = templates
+        self.stats = stats
+        self.interval = interval
+        self.jitter = jitter
+        self.connection = HttpConnection(api_url)
+        self.headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {user_id}'}
+        if templates.compress:
+            self.headers['Content-Encoding'] = 'gzip'
+
+    async def _post(self, endpoint, path, body, content_type=None, headers=None):
+        headers = headers or self.headers
+        if content_type:
+            headers = dict(headers, **{'Content-Type': content_type})
+        start = time.monotonic()
+        try:
+            status, response = await self.connection.post(path, {'userId': self.user_id}, body, headers)
+            ok = status in (200, 201)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            status, response, ok = None, b'', False
+        self.stats.record(endpoint, time.monotonic() - start, len(body), ok)
+        return ok, response
+
+    async def register(self):
+        body = json.dumps({'name': self.hostname}).encode('utf-8')
+        ok, response = await self._post('deploy', '/api/agents/deploy', body,
+                                        headers={'Content-Type': 'application/json'})
+        if ok:
+            try:
+                self.agent_id = json.loads(response).get('agentId')
+            except ValueError:
+                pass
+        return self.agent_id is not None
+
+    async def _job(self, endpoint, path, build, content_type, stop_at):
+        # Each job starts at a random point in the interval, like a fleet that came up over time
+        next_run = time.monotonic() + random.uniform(0, self.interval)
+        while True:
+            delay = next_run + random.uniform(-self.jitter, self.jitter) - time.monotonic()
+            if next_run >= stop_at:
+                return
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._post(endpoint, path, build(), content_type)
+            next_run += self.interval
+
+    async def run(self, stop_at):
+        try:
+            if not await self.register():
+                return
+            await asyncio.gather(
+                self._job('status', f'/api/agents/{self.agent_id}/status',
+                          lambda: self.templates.status(self.hostname), None, stop_at),
+                self._job('osquery', f'/api/agents/{self.agent_id}/osquery',
+                          lambda: self.templates.osquery_body, self.templates.osquery_type, stop_at),
+                self._job('vulnerability-scan', '/api/security/agent/vulnerability-scan',
+                          lambda: self.templates.scan(self.hostname), None, stop_at)
+            )
+        finally:
+            self.connection.close()
+
+
+class StubBackend:
+    """In-process receiver answering every agent endpoint with 200, counting what it is sent"""
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_received = 0
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self._handle, host, port, limit=2 ** 20, backlog=4096)
+        return f"http://{host}:{self.server.sockets[0].getsockname()[1]}"
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if name.strip().lower() == 'content-length':
+                        length = int(value)
+                if length:
+                    await reader.readexactly(length)
+                self.requests += 1
+                self.bytes_received += length
+                body = json.dumps({'agentId': f'stub-{self.requests}'}).encode('utf-8')
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self.server:
+            self.server.close()
+
+
+async def run_level(count, args, templates, api_url):
+    """Run ``count`` agents for the configured duration, printing a report every window"""
+    stats = LoadStats()
+    total = LoadStats()
+    stop_at = time.monotonic() + args.duration
+
+    agents = [
+        VirtualAgent(i, api_url, args.user_id, templates, stats, args.interval, args.jitter, args.hostname_prefix)
+        for i in range(count)
+    ]
+
+    async def start_agents():
+        tasks = []
+        for agent in agents:
+            tasks.append(asyncio.ensure_future(agent.run(stop_at)))
+            # Spread registrations over the ramp instead of a thundering herd
+            if args.ramp:
+                await asyncio.sleep(args.ramp / count)
+        await asyncio.gather(*tasks)
+
+    async def report():
+        while True:
+            await asyncio.sleep(args.report_every)
+            summary = stats.summary()
+            for endpoint, latencies in stats.latencies.items():
+                total.latencies[endpoint].extend(latencies)
+                total.errors[endpoint] += stats.errors[endpoint]
+            total.bytes_sent += stats.bytes_sent
+            print_summary(f"[{count} agents, t={time.monotonic() - total.started:.0f}s]", summary)
+            stats.reset()
+
+    reporter = asyncio.ensure_future(report())
+    try:
+        await start_agents()
+    finally:
+        reporter.cancel()
+    for endpoint, latencies in stats.latencies.items():
+        total.latencies[endpoint].extend(latencies)
+        total.errors[endpoint] += stats.errors[endpoint]
+    total.bytes_sent += stats.bytes_sent
+    return total.summary()
+
+
+async def main_async(args):
+    print("Collecting payload templates from this host...")
+    templates = PayloadTemplates(args.wire_format, compress=not args.no_compress)
+    print(f"osquery body {len(templates.osquery_body) / 1024:.1f} KiB "
+          f"({'gzip' if templates.compress else 'uncompressed'} {args.wire_format})")
+
+    stub = None
+    api_url = args.api_url
+    if not api_url:
+        stub = StubBackend()
+        api_url = await stub.start()
+        print(f"Stub backend listening on {api_url}")
+
+    results = {}
+    try:
+        for count in [int(level) for level in args.agents.split(',')]:
+            summary = await run_level(count, args, templates, api_url)
+            results[count] = summary
+            print_summary(f"== {count} agents total", summary)
+    finally:
+        if stub:
+            stub.close()
+            print(f"Stub received {stub.requests} requests, {stub.bytes_received / (1024 * 1024):.1f} MiB")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a fleet of agents against the backend')
+    parser.add_argument('--agents', default='100',
+                        help='Number of virtual agents, or a comma-separated list of levels to step through')
+    parser.add_argument('--api_url', default=None, help='Backend to load; defaults to an in-process stub')
+    parser.add_argument('-u', '--user_id', default='load-test', help='User ID the virtual agents register under')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to run each level')
+    parser.add_argument('--interval', type=float, default=60, help='Upload interval of each virtual agent')
+    parser.add_argument('--jitter', type=float, default=5, help='Random +/- seconds added to every upload')
+    parser.add_argument('--ramp', type=float, default=10, help='Seconds over which agents register')
+    parser.add_argument('--report_every', type=float, default=10, help='Seconds between progress reports')
+    parser.add_argument('--wire_format', choices=WIRE_FORMATS, default='json', help='Encoding of osquery uploads')
+    parser.add_argument('--no_compress', action='store_true', help='Send bodies without gzip')
+    parser.add_argument('--hostname_prefix', default='loadgen', help='Prefix of virtual agent hostnames')
+    parser.add_argument('--output', default=None, help='Write the per-level summaries to this JSON file')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    results = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
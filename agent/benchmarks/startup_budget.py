@@ -0,0 +1,97 @@
+"""Cold-start budget for the agent entry point.
+
+Imports src.agent in fresh interpreters under ``python -X importtime`` and
+fails when the import takes longer than the budget, or when anything that
+should only load once a collector needs it is imported up front:
+
+    cd agent
+    python benchmarks/startup_budget.py
+    python benchmarks/startup_budget.py --budget_ms 40 --runs 9
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Cumulative import time of src.agent, in milliseconds
+DEFAULT_BUDGET_MS = 60
+
+# Loaded lazily by main() or by the collectors that need them
+DEFERRED_MODULES = (
+    'psutil',
+    'requests',
+    'urllib3',
+    'http.server',
+    'winreg',
+    'src.security_scan',
+    'src.process_snapshot',
+    'src.resource_sampler',
+    'src.governor',
+    'src.process_events',
+    'src.file_integrity',
+    'src.posture',
+    'src.software_inventory',
+    'src.powershell_host'
+)
+
+
+def import_times(statement):
+    """Run ``statement`` under -X importtime and return {module: cumulative microseconds}"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=AGENT_DIR, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the agent cold-start import budget')
+    parser.add_argument('--budget_ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='Maximum median cumulative import time of src.agent')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to measure')
+    args = parser.parse_args()
+
+    samples = []
+    loaded = set()
+    for _ in range(args.runs):
+        times = import_times('import src.agent')
+        samples.append(times['src.agent'] / 1000)
+        loaded.update(times)
+
+    median = statistics.median(samples)
+    print(f"import src.agent: median {median:.1f} ms over {args.runs} runs "
+          f"(min {min(samples):.1f}, max {max(samples):.1f}), budget {args.budget_ms:.0f} ms")
+
+    failures = []
+    if median > args.budget_ms:
+        failures.append(f"src.agent took {median:.1f} ms to import, over the {args.budget_ms:.0f} ms budget")
+    for module in DEFERRED_MODULES:
+        if module in loaded:
+            failures.append(f"{module} is imported at startup but should load lazily")
+
+    # The slowest imports are where to look when the budget is exceeded
+    slowest = sorted(((t, m) for m, t in times.items() if m.startswith('src.')), reverse=True)[:5]
+    for cumulative, module in slowest:
+        print(f"  {module:28s} {cumulative / 1000:8.1f} ms")
+
+    if failures:
+        print("\nStartup budget exceeded:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("\nStartup within budget")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,26 +1,37 @@
 import os
 import sys
-import time
 import socket
 import platform
-import psutil
-import requests
 import argparse
+import threading
 import logging
 from datetime import datetime
-from src.security_scan import run_security_scan
-from src.osquery_manager import OSQueryManager
+from src.transport import get_transport, configure_transport
+from src.wire_format import serialize, WIRE_FORMATS
+from src.metrics import METRICS
+from src.vuln_matcher import DEFAULT_FEED_PATH
+from src.rules import DEFAULT_RULES_PATH
+
+# Collectors are imported in main() once the arguments say which ones this host needs,
+# so --help and one-shot modes start without loading psutil, requests or platform backends
+EVENT_SOURCES = ('auto', 'netlink', 'proc', 'osquery', 'off')
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_system_info():
+def get_system_info(sampler=None):
     """Get current system information"""
+    import psutil
+
     hostname = socket.gethostname()
     os_name = platform.system() + " " + platform.release()
     
-    # Get CPU usage
-    cpu_usage = psutil.cpu_percent(interval=1)
+    # Get CPU usage from the background sampler when there is one, so this never blocks
+    utilisation = sampler.summary() if sampler else None
+    if utilisation:
+        cpu_usage = utilisation['cpu']['avg']
+    else:
+        cpu_usage = psutil.cpu_percent(interval=1)
     
     # Get memory info
     memory = psutil.virtual_memory()
@@ -54,7 +65,8 @@ def get_system_info():
         "disk_total": disk_total,
         "disk_used": disk_used,
         "disk_percent": disk_percent,
-        "ip_addresses": network_info
+        "ip_addresses": network_info,
+        "utilisation": utilisation
     }
 
 def register_agent(api_url, user_id):
@@ -70,7 +82,7 @@ def register_agent(api_url, user_id):
     print(f"Request payload: {payload}")
     
     try:
-        response = requests.post(registration_url, json=payload)
+        response = get_transport().post(registration_url, json=payload)
         print(f"Response status: {response.status_code}")
         print(f"Response body: {response.text}")
         
@@ -89,7 +101,23 @@ def register_agent(api_url, user_id):
         print(f"Error registering agent: {str(e)}")
         return None, None
 
-def update_agent_status(api_url, agent_id, user_id, token, status="running", system_info=None):
+def spool_upload(spool, url, params, body, coalesce=None, encoding="json"):
+    """Queue an upload in the local spool for the sender to deliver"""
+    try:
+        spool.append({
+            "url": url,
+            "params": params,
+            "body": body,
+            "coalesce": coalesce,
+            "encoding": encoding,
+            "created": datetime.utcnow().isoformat()
+        })
+        return True
+    except Exception as e:
+        print(f"Error spooling upload: {str(e)}")
+        return False
+
+def update_agent_status(api_url, agent_id, user_id, token, status="running", system_info=None, spool=None):
     """Update agent status with the server"""
     if not agent_id:
         return False
@@ -99,19 +127,24 @@ def update_agent_status(api_url, agent_id, user_id, token, status="running", sys
     payload = {
         "status": status,
         "systemInfo": system_info or get_system_info(),
-        "lastActive": datetime.utcnow().isoformat()
+        "lastActive": datetime.utcnow().isoformat(),
+        "agentMetrics": METRICS.summary()
     }
     
     params = {
         "userId": user_id
     }
     
+    if spool:
+        # Only the newest status matters, so older undelivered ones are coalesced away
+        return spool_upload(spool, status_url, params, payload, coalesce="status")
+    
     headers = {
         "Authorization": f"Bearer {token}"
     }
     
     try:
-        response = requests.post(status_url, json=payload, params=params, headers=headers)
+        response = get_transport().post(status_url, json=payload, params=params, headers=headers)
         if response.status_code == 200:
             return True
         else:
@@ -122,7 +155,7 @@ def update_agent_status(api_url, agent_id, user_id, token, status="running", sys
         print(f"Error updating status: {str(e)}")
         return False
 
-def send_osquery_data(api_url, agent_id, user_id, token, data):
+def send_osquery_data(api_url, agent_id, user_id, token, data, spool=None, wire_format="json"):
     """Send OSQuery data to the server"""
     if not agent_id:
         return False
@@ -133,12 +166,19 @@ def send_osquery_data(api_url, agent_id, user_id, token, data):
         "userId": user_id
     }
     
+    if spool:
+        # Full snapshots replace each other on the backend; deltas must all be delivered
+        coalesce = None if data.get("format") == "differential" else "osquery"
+        return spool_upload(spool, osquery_url, params, data, coalesce=coalesce, encoding=wire_format)
+    
+    body, content_type = serialize(data, wire_format)
     headers = {
-        "Authorization": f"Bearer {token}"
+        "Authorization": f"Bearer {token}",
+        "Content-Type": content_type
     }
     
     try:
-        response = requests.post(osquery_url, json=data, params=params, headers=headers)
+        response = get_transport().post(osquery_url, data=body, params=params, headers=headers)
         if response.status_code == 200:
             return True
         else:
@@ -149,16 +189,137 @@ def send_osquery_data(api_url, agent_id, user_id, token, data):
         print(f"Error sending OSQuery data: {str(e)}")
         return False
 
+def send_scan_results(api_url, user_id, token, scan_results, spool=None):
+    """Send security scan results to the server"""
+    scan_url = f"{api_url}/api/security/agent/vulnerability-scan"
+    
+    if spool:
+        return spool_upload(spool, scan_url, {"userId": user_id}, scan_results)
+    
+    headers = {
+        "Authorization": f"Bearer {token}"
+    }
+    
+    try:
+        response = get_transport().post(scan_url, json=scan_results, params={"userId": user_id}, headers=headers)
+        # The scan endpoint answers 201 Created
+        if 200 <= response.status_code < 300:
+            return True
+        else:
+            print(f"Failed to send scan results: {response.status_code} - {response.text}")
+            return False
+            
+    except Exception as e:
+        print(f"Error sending scan results: {str(e)}")
+        return False
+
 def main():
     parser = argparse.ArgumentParser(description='Security Monitoring Agent')
-    parser.add_argument('-u', '--user_id', required=True, help='User ID for agent registration')
+    parser.add_argument('-u', '--user_id', help='User ID for agent registration')
     parser.add_argument('--api_url', default='http://localhost:3000', help='API URL')
+    parser.add_argument('--interval', type=int, default=60, help='Collection interval in seconds')
+    parser.add_argument('--sample_resolution', type=float, default=5,
+                        help='Seconds between background CPU, memory, disk and network samples')
+    parser.add_argument('--no_persistent_osquery', action='store_true',
+                        help='Start a new osqueryi process for every query')
+    parser.add_argument('--osquery_socket', default=None, help='Path to the osqueryd extension socket')
+    parser.add_argument('--differential', action='store_true',
+                        help='Upload process and network inventories as deltas with periodic full checkpoints')
+    parser.add_argument('--checkpoint_every', type=int, default=60,
+                        help='Number of differential uploads between full checkpoints')
+    parser.add_argument('--spool_dir', default=os.path.join(os.path.expanduser('~'), '.siem-agent', 'spool'),
+                        help='Directory for the on-disk upload spool')
+    parser.add_argument('--spool_max_mb', type=int, default=50, help='Maximum spool size in megabytes')
+    parser.add_argument('--no_spool', action='store_true', help='Upload directly instead of through the spool')
+    parser.add_argument('--connect_timeout', type=float, default=5, help='HTTP connect timeout in seconds')
+    parser.add_argument('--read_timeout', type=float, default=30, help='HTTP read timeout in seconds')
+    parser.add_argument('--http2', action='store_true', help='Use HTTP/2 when httpx is installed')
+    parser.add_argument('--osquery_processes', action='store_true',
+                        help='Collect processes and listening ports with osquery instead of the shared psutil snapshot')
+    parser.add_argument('--wire_format', choices=WIRE_FORMATS, default='json',
+                        help='Encoding of process and network uploads: row dicts (json), columnar JSON '
+                             '(compact) or columnar msgpack (msgpack); compact formats need backend support')
+    parser.add_argument('--metrics_port', type=int, default=0,
+                        help='Serve agent metrics on http://127.0.0.1:<port>/metrics (0 disables)')
+    parser.add_argument('--metrics_file', default=None,
+                        help='Also write agent metrics in Prometheus text format to this file every interval')
+    parser.add_argument('--advisory_feed', default=DEFAULT_FEED_PATH,
+                        help='OSV-format advisory file to match installed packages against')
+    parser.add_argument('--query_pack', default=None, help='Path to a JSON osquery query pack')
+    parser.add_argument('--rules', default=DEFAULT_RULES_PATH, help='Path to a JSON detection rule file')
+    parser.add_argument('--process_events', choices=EVENT_SOURCES, default='auto',
+                        help='Stream process exec/exit and socket events between polls (Linux, or osquery with events enabled)')
+    parser.add_argument('--event_buffer', type=int, default=10000,
+                        help='Events kept between uploads before the oldest are dropped')
+    parser.add_argument('--finding_window', type=int, default=3600,
+                        help='Seconds between heartbeats for a finding that stays open; repeats in between are '
+                             'suppressed (0 reports every finding on every scan)')
+    parser.add_argument('--busy_cpu', type=float, default=85,
+                        help='Host CPU/load percent at which collection is stretched and low priority collectors are shed')
+    parser.add_argument('--critical_cpu', type=float, default=95,
+                        help='Host CPU/load percent at which only status and uploads keep their schedule')
+    parser.add_argument('--cpu_budget', type=float, default=None,
+                        help='Percent of one CPU the agent and its osquery/PowerShell children may use')
+    parser.add_argument('--no_governor', action='store_true', help='Collect at full rate regardless of host load')
+    parser.add_argument('--fim_paths', default=None,
+                        help='Comma-separated files and directories to watch for changes, or "default" for the '
+                             'system binary and configuration directories (file integrity monitoring is off otherwise)')
+    parser.add_argument('--fim_workers', type=int, default=2, help='Processes used to hash changed files')
+    parser.add_argument('--fim_rescan', type=int, default=3600,
+                        help='Seconds between full rescans of the monitored paths; on Linux, inotify covers the gaps')
+    parser.add_argument('--update_check_interval', type=int, default=3600,
+                        help='Seconds between pending package update checks; firewall and antivirus state is '
+                             'checked on every scan')
+    parser.add_argument('--once', action='store_true',
+                        help='Run the selected collectors once and write NDJSON instead of reporting to the backend')
+    parser.add_argument('--collectors', default='system,osquery,scan',
+                        help='Collectors for --once: any of system, snapshot, osquery, scan')
+    parser.add_argument('--batch', nargs='+', metavar='PATH',
+                        help='Reprocess saved snapshots (NDJSON from --once, osquery_rows records or osqueryi '
+                             '--json files; directories are expanded) in parallel and write NDJSON')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes for --batch (default: all cores)')
+    parser.add_argument('--output', default='-', help='NDJSON output file for --once and --batch (default: stdout)')
     args = parser.parse_args()
+    if args.wire_format != 'json' and args.differential:
+        parser.error('--differential only works with --wire_format json')
+
+    # Offline modes need no backend and write results locally
+    if args.once or args.batch:
+        from src.offline import run_once, run_batch
+        try:
+            sys.exit(run_batch(args) if args.batch else run_once(args))
+        except ValueError as e:
+            parser.error(str(e))
+    if not args.user_id:
+        parser.error('-u/--user_id is required unless --once or --batch is given')
     
     print("Starting security monitoring agent...")
+
+    from src.osquery_manager import OSQueryManager
+    from src.process_snapshot import SnapshotCache
+    from src.resource_sampler import ResourceSampler
+    from src.scheduler import CollectionScheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+    from src.security_scan import run_security_scan
+    from src.posture import PostureChecker
+    from src.rules import RuleEngine
+    
+    configure_transport(
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        http2=args.http2
+    )
+    
+    # One process table walk per cycle, shared by the osquery inventory and the security scan
+    snapshots = SnapshotCache(max_age=args.interval / 2)
     
     # Initialize OSQuery manager
-    osquery = OSQueryManager()
+    osquery = OSQueryManager(
+        persistent=not args.no_persistent_osquery,
+        extension_socket=args.osquery_socket,
+        query_pack=args.query_pack,
+        snapshots=None if args.osquery_processes else snapshots,
+        columnar=args.wire_format != 'json'
+    )
     
     # Register agent
     agent_id, token = register_agent(args.api_url, args.user_id)
@@ -166,45 +327,183 @@ def main():
         print("Failed to register agent. Exiting.")
         sys.exit(1)
     
+    differential = None
+    if args.differential:
+        from src.differential import DifferentialEncoder
+        differential = DifferentialEncoder(args.checkpoint_every)
+
+    # Every payload goes through the spool so nothing is lost while the backend is unreachable
+    spool = None
+    sender = None
+    if not args.no_spool:
+        from src.spool import Spool, SpoolSender
+        spool = Spool(
+            args.spool_dir,
+            max_bytes=args.spool_max_mb * 1024 * 1024,
+            # Evicted deltas leave a gap, so the backend needs a fresh checkpoint
+            on_evict=lambda count: differential and differential.force_checkpoint()
+        )
+        sender = SpoolSender(spool, headers={"Authorization": f"Bearer {token}"})
+
+    # Utilisation is summarised over the window between two status uploads
+    sampler = ResourceSampler(resolution=args.sample_resolution, window=args.interval).start()
+
+    def collect_status():
+        system_info = get_system_info(sampler)
+        if not update_agent_status(args.api_url, agent_id, args.user_id, token, system_info=system_info, spool=spool):
+            print("Failed to update agent status")
+
+    def upload_osquery():
+        # Queries run on their own schedules; upload only once something new has been collected
+        osquery_data = osquery.take_results()
+        if osquery_data is None:
+            return
+        if differential:
+            osquery_data = differential.encode(osquery_data)
+        elif args.wire_format != 'json':
+            osquery_data['format'] = 'columnar'
+        if not send_osquery_data(args.api_url, agent_id, args.user_id, token, osquery_data,
+                                 spool=spool, wire_format=args.wire_format):
+            print("Failed to send OSQuery data")
+            if differential:
+                # The backend missed this delta, so resynchronise with a full checkpoint
+                differential.force_checkpoint()
+
+    # Vulnerability matching is offline: the advisory feed is synced separately and indexed once here
+    matcher = None
+    inventory = None
+    if os.path.exists(args.advisory_feed):
+        from src.vuln_matcher import VulnerabilityMatcher
+        from src.software_inventory import SoftwareInventory
+        try:
+            matcher = VulnerabilityMatcher.load(args.advisory_feed)
+            inventory = SoftwareInventory(
+                cache_path=os.path.join(os.path.dirname(args.spool_dir), 'package_vulnerabilities.json'),
+                osquery=osquery
+            )
+        except (OSError, ValueError) as e:
+            print(f"Error loading advisory feed: {str(e)}")
+    else:
+        print(f"No advisory feed at {args.advisory_feed}, skipping vulnerability matching")
+
+    try:
+        rules = RuleEngine.load(args.rules)
+    except (OSError, ValueError) as e:
+        print(f"Error loading detection rules: {str(e)}")
+        rules = RuleEngine([])
+
+    # Short-lived processes and sockets seen between polls, checked against the same rules
+    events = None
+    if args.process_events == 'osquery' or (args.process_events != 'off' and platform.system() == 'Linux'):
+        from src.process_events import ProcessEventMonitor
+        events = ProcessEventMonitor(args.process_events, max_events=args.event_buffer, osquery=osquery).start()
+    event_findings = []
+    event_findings_lock = threading.Lock()
+
+    def collect_events():
+        batch = events.drain()
+        if not batch:
+            return
+        execs = [event for event in batch if event['event'] == 'exec']
+        listeners = [
+            {'port': event['local_port'], 'address': event['local_address'], 'pid': event.get('pid')}
+            for event in batch if event['event'] == 'socket_open' and event.get('state') != 'ESTABLISHED'
+        ]
+        processes = {row['pid']: row for row in snapshots.get().process_rows()}
+        processes.update((event['pid'], event) for event in execs)
+        findings = list(rules.evaluate('process', execs, processes))
+        findings.extend(rules.evaluate('listening', listeners, processes))
+        with event_findings_lock:
+            event_findings.extend(findings)
+        osquery.store_result('process_events', osquery.format_rows('process_events', batch))
+
+    # Only opened, still-open heartbeat and closed transitions of findings are uploaded
+    aggregator = None
+    if args.finding_window:
+        from src.aggregation import FindingAggregator
+        aggregator = FindingAggregator(
+            window=args.finding_window,
+            state_path=os.path.join(os.path.dirname(args.spool_dir), 'findings_state.json')
+        )
+
+    # Changes to monitored files are checked against the baseline on every scan
+    file_integrity = None
+    if args.fim_paths:
+        from src.file_integrity import FileIntegrityMonitor, default_paths
+        fim_paths = default_paths() if args.fim_paths == 'default' else \
+            [path.strip() for path in args.fim_paths.split(',') if path.strip()]
+        file_integrity = FileIntegrityMonitor(
+            fim_paths,
+            baseline_path=os.path.join(os.path.dirname(args.spool_dir), 'fim_baseline.json'),
+            workers=args.fim_workers,
+            rescan_interval=args.fim_rescan
+        ).start()
+
+    # Firewall, antivirus and pending update state, each probe cached for its own TTL
+    posture = PostureChecker(ttl={'updates': args.update_check_interval})
+
+    def collect_scan():
+        scan_results = run_security_scan(snapshots.get(), inventory=inventory, matcher=matcher, rules=rules,
+                                         file_integrity=file_integrity, posture=posture)
+        if scan_results:
+            with event_findings_lock:
+                scan_results['findings'].extend(event_findings)
+                scan_results['suspicious_processes'].extend(
+                    finding['details'] for finding in event_findings if finding['type'] == 'suspicious_process'
+                )
+                event_findings.clear()
+            if aggregator:
+                scan_results['findings'] = aggregator.aggregate(scan_results['findings'])
+                if not scan_results['findings'] and not scan_results['vulnerabilities']:
+                    return
+            send_scan_results(args.api_url, args.user_id, token, scan_results, spool=spool)
+
+    # Back off while the host is busy: stretch intervals, shed low priority work, lower our priority
+    governor = None
+    if not args.no_governor:
+        from src.governor import LoadGovernor, set_cgroup_cpu_limit
+        governor = LoadGovernor(sampler, high=args.busy_cpu, critical=args.critical_cpu, agent_cpu_budget=args.cpu_budget)
+        if args.cpu_budget and platform.system() == 'Linux':
+            set_cgroup_cpu_limit(args.cpu_budget)
+
+    # Each collector runs independently so a slow one never holds up the others
+    scheduler = CollectionScheduler(governor=governor)
+    scheduler.add_job('status', collect_status, args.interval, priority=PRIORITY_HIGH)
+    for name, interval, jitter in osquery.scheduled_queries():
+        # The process and network inventories feed detections; the rest can wait for a quiet host
+        priority = PRIORITY_NORMAL if name in ('processes', 'network_connections') else PRIORITY_LOW
+        scheduler.add_job(f'osquery:{name}', lambda name=name: osquery.collect_query(name), interval,
+                          jitter=jitter, priority=priority)
+    if events and events.sources:
+        scheduler.add_job('events', collect_events, args.interval, delay=4)
+    scheduler.add_job('osquery', upload_osquery, args.interval, delay=5)
+    scheduler.add_job('scan', collect_scan, args.interval, priority=PRIORITY_LOW)
+    if sender:
+        scheduler.add_job('sender', sender.drain, 10, delay=10, priority=PRIORITY_HIGH)
+    if args.metrics_file:
+        from src.metrics import write_metrics_file
+        scheduler.add_job('metrics', lambda: write_metrics_file(args.metrics_file), args.interval,
+                          priority=PRIORITY_HIGH)
+    if governor:
+        scheduler.add_job('governor', governor.update, 5, priority=PRIORITY_HIGH)
+    if args.metrics_port:
+        from src.metrics import MetricsServer
+        MetricsServer(port=args.metrics_port).start()
+
     # Main monitoring loop
     try:
-        while True:
-            # Update agent status
-            system_info = get_system_info()
-            if not update_agent_status(args.api_url, agent_id, args.user_id, token, system_info=system_info):
-                print("Failed to update agent status")
-            
-            # Collect and send OSQuery data
-            osquery_data = osquery.collect_all_data()
-            if not send_osquery_data(args.api_url, agent_id, args.user_id, token, osquery_data):
-                print("Failed to send OSQuery data")
-            
-            # Run security scan
-            scan_results = run_security_scan()
-            
-            # Send scan results
-            if scan_results:
-                try:
-                    scan_url = f"{args.api_url}/api/security/agent/vulnerability-scan"
-                    headers = {
-                        "Authorization": f"Bearer {token}"
-                    }
-                    response = requests.post(
-                        scan_url,
-                        json=scan_results,
-                        params={"userId": args.user_id},
-                        headers=headers
-                    )
-                    if response.status_code != 200:
-                        print(f"Failed to send scan results: {response.status_code} - {response.text}")
-                except Exception as e:
-                    print(f"Error sending scan results: {str(e)}")
-            
-            # Wait before next update
-            time.sleep(60)  # Update every minute
-            
+        scheduler.run()
     except KeyboardInterrupt:
         print("\nStopping agent...")
+        scheduler.stop()
+        sampler.stop()
+        if events:
+            events.stop()
+        if file_integrity:
+            file_integrity.stop()
+        osquery.close()
+        if sender:
+            sender.drain()
         update_agent_status(args.api_url, agent_id, args.user_id, token, status="stopped")
         sys.exit(0)
 
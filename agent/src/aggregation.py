@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_PATH = os.path.join(os.path.expanduser('~'), '.siem-agent', 'findings_state.json')
+
+# Detail fields identifying the same issue across scans; pids change on restart so they are left out
+FINGERPRINT_FIELDS = {
+    'open_port': ('port', 'address'),
+    'suspicious_process': ('path', 'cmdline'),
+    'file_integrity': ('path', 'change', 'sha256'),
+    'posture': ('probe',)
+}
+
+
+def fingerprint(finding):
+    """Stable identity of a finding: its type, rule and key detail fields"""
+    details = finding.get('details') or {}
+    fields = FINGERPRINT_FIELDS.get(finding.get('type')) or sorted(details)
+    key = [finding.get('type'), finding.get('rule')] + [[field, details.get(field)] for field in fields]
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _isoformat(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat()
+
+
+class FindingAggregator:
+    """Collapses repeated findings into state transitions.
+
+    A finding is emitted as ``opened`` the first time it is seen, as a
+    ``still_open`` heartbeat at most once per ``window`` seconds while it
+    keeps being seen, and as ``closed`` on the first scan it is missing
+    from. Everything in between is suppressed; first_seen, last_seen and
+    count carry the history.
+    """
+
+    def __init__(self, window=3600, state_path=DEFAULT_STATE_PATH):
+        self.window = window
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self.open = self._load_state()
+
+    def _load_state(self):
+        if not self.state_path:
+            return {}
+        try:
+            with open(self.state_path) as f:
+                return json.load(f).get('open', {})
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+            tmp_path = self.state_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'open': self.open}, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.warning(f"Could not save finding state: {str(e)}")
+
+    def _emit(self, entry, state):
+        return dict(
+            entry['finding'],
+            state=state,
+            fingerprint=entry['fingerprint'],
+            first_seen=_isoformat(entry['first_seen']),
+            last_seen=_isoformat(entry['last_seen']),
+            count=entry['count']
+        )
+
+    def aggregate(self, findings, now=None):
+        """Return the transitions for one scan's findings"""
+        now = now or time.time()
+        transitions = []
+        with self._lock:
+            seen = set()
+            for finding in findings:
+                key = fingerprint(finding)
+                if key in seen:
+                    continue
+                seen.add(key)
+                entry = self.open.get(key)
+                if entry is None:
+                    entry = self.open[key] = {
+                        'fingerprint': key,
+                        'finding': finding,
+                        'first_seen': now,
+                        'last_seen': now,
+                        'last_emitted': now,
+                        'count': 1
+                    }
+                    transitions.append(self._emit(entry, 'opened'))
+                    continue
+                entry['finding'] = finding
+                entry['last_seen'] = now
+                entry['count'] += 1
+                if now - entry['last_emitted'] >= self.window:
+                    entry['last_emitted'] = now
+                    transitions.append(self._emit(entry, 'still_open'))
+
+            for key in [key for key in self.open if key not in seen]:
+                transitions.append(self._emit(self.open.pop(key), 'closed'))
+
+            self._save_state()
+        return transitions
@@ -0,0 +1,102 @@
+import uuid
+import threading
+
+
+def process_key(row):
+    """Stable identity of a process row: pid plus start time, so reused pids are not confused"""
+    data = row['data']
+    return (data.get('pid'), data.get('start_time'))
+
+
+def network_key(row):
+    """Stable identity of a listening socket row"""
+    data = row['data']
+    return (data.get('local_address'), data.get('local_port'), data.get('protocol'), data.get('process_path'))
+
+
+class DifferentialSnapshot:
+    """Tracks the previous snapshot of a table and reports only what changed.
+
+    Follows osquery's differential results model: every result carries an
+    ``epoch`` that changes when the agent restarts and a ``counter`` that
+    increases with each result. A counter of 0 marks a full checkpoint, which
+    the receiver uses to replace its copy of the table.
+    """
+
+    def __init__(self, key_func, checkpoint_every=60):
+        self.key_func = key_func
+        self.checkpoint_every = checkpoint_every
+        self.epoch = uuid.uuid4().hex
+        self.counter = 0
+        self.previous = None
+        self._force_checkpoint = True
+
+    def force_checkpoint(self):
+        """Send the whole table next time, e.g. after an upload was lost"""
+        self._force_checkpoint = True
+
+    def diff(self, rows):
+        """Return the differential result for the latest formatted rows"""
+        current = {}
+        for row in rows or []:
+            current[self.key_func(row)] = row
+
+        if self._force_checkpoint or self.previous is None or self.counter >= self.checkpoint_every:
+            self.previous = current
+            self.counter = 0
+            self._force_checkpoint = False
+            return {
+                'epoch': self.epoch,
+                'counter': 0,
+                'checkpoint': True,
+                'added': list(current.values()),
+                'removed': [],
+                'changed': []
+            }
+
+        added = []
+        changed = []
+        for key, row in current.items():
+            old = self.previous.get(key)
+            if old is None:
+                added.append(row)
+            elif old['data'] != row['data']:
+                changed.append(row)
+        removed = [row for key, row in self.previous.items() if key not in current]
+
+        self.previous = current
+        self.counter += 1
+        return {
+            'epoch': self.epoch,
+            'counter': self.counter,
+            'checkpoint': False,
+            'added': added,
+            'removed': removed,
+            'changed': changed
+        }
+
+
+class DifferentialEncoder:
+    """Replaces the process and network inventories of an osquery upload with deltas"""
+
+    def __init__(self, checkpoint_every=60):
+        self.snapshots = {
+            'processes': DifferentialSnapshot(process_key, checkpoint_every),
+            'network': DifferentialSnapshot(network_key, checkpoint_every)
+        }
+        self._lock = threading.Lock()
+
+    def encode(self, data):
+        """Return a copy of an osquery upload with differential process and network sections"""
+        with self._lock:
+            encoded = dict(data)
+            encoded['format'] = 'differential'
+            for section, snapshot in self.snapshots.items():
+                if section in data:
+                    encoded[section] = snapshot.diff(data[section])
+            return encoded
+
+    def force_checkpoint(self):
+        with self._lock:
+            for snapshot in self.snapshots.values():
+                snapshot.force_checkpoint()
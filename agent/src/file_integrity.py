@@ -0,0 +1,405 @@
+import os
+import json
+import mmap
+import time
+import errno
+import select
+import struct
+import hashlib
+import logging
+import platform
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from src.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.expanduser('~'), '.siem-agent', 'fim_baseline.json')
+
+# Monitored when --fim_paths is "default"
+DEFAULT_FIM_PATHS = {
+    'Linux': ['/etc', '/bin', '/sbin', '/usr/bin', '/usr/sbin', '/boot'],
+    'Darwin': ['/etc', '/bin', '/sbin', '/usr/bin', '/usr/sbin'],
+    'Windows': [os.path.join(os.environ.get('SystemRoot', r'C:\Windows'), 'System32', 'drivers')]
+}
+
+# Files at least this large are hashed through a memory map instead of read into a buffer
+MMAP_THRESHOLD = 1024 * 1024
+
+# Below this many files, hashing in the agent process is cheaper than starting a pool
+POOL_MIN_FILES = 32
+
+# inotify (see linux/inotify.h)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Completed writes rather than every write(), so busy files do not flood the queue
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def default_paths():
+    return DEFAULT_FIM_PATHS.get(platform.system(), [])
+
+
+def hash_file(path):
+    """SHA-256 of a file, or None if it cannot be read"""
+    try:
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256()
+            if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+                # Pages come straight from the page cache and hashlib releases the GIL over the buffer
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    digest.update(mapped)
+            else:
+                digest.update(f.read())
+            return digest.hexdigest()
+    except (OSError, ValueError):
+        return None
+
+
+def hash_pool(workers):
+    """A process pool for hash_files.
+
+    Workers come from a fork server (or are spawned where there is none)
+    rather than forked from the agent, whose other threads may hold locks
+    at the moment of the fork.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def hash_files(paths, workers=2, pool=None):
+    """Hash many files, in a process pool when there are enough of them to be worth it.
+
+    ``pool`` is reused if given; otherwise one is started for this call.
+    """
+    if workers <= 1 or len(paths) < POOL_MIN_FILES:
+        return [hash_file(path) for path in paths]
+    if pool is not None:
+        return list(pool.map(hash_file, paths, chunksize=64))
+    with hash_pool(workers) as executor:
+        return list(executor.map(hash_file, paths, chunksize=64))
+
+
+class InotifyWatcher:
+    """Directory watches through Linux inotify.
+
+    A reader thread records which files and directories changed; take()
+    hands them to the monitor. If the kernel queue overflows, or more
+    paths are pending than ``max_pending``, only ``overflowed`` is set and
+    the monitor falls back to a full rescan.
+    """
+
+    def __init__(self, max_pending=100000):
+        import ctypes
+        import ctypes.util
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.max_pending = max_pending
+        self.watches = {}
+        self.files = set()
+        self.dirs = set()
+        self.overflowed = False
+        # Set once fs.inotify.max_user_watches is reached; changes may then be missed until a rescan
+        self.exhausted = False
+        self._lock = threading.Lock()
+
+    def watch(self, directory):
+        if self.exhausted:
+            return False
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = self._ctypes.get_errno()
+            if error == errno.ENOSPC:
+                logger.warning("Out of inotify watches (raise fs.inotify.max_user_watches); "
+                               "file changes will only be found by periodic rescans")
+                self.exhausted = True
+            return False
+        with self._lock:
+            self.watches[wd] = directory
+        return True
+
+    def take(self):
+        """(changed files, changed directories, overflowed) since the previous call"""
+        with self._lock:
+            pending = (self.files, self.dirs, self.overflowed)
+            self.files, self.dirs, self.overflowed = set(), set(), False
+        return pending
+
+    def run(self, stop):
+        while not stop.is_set():
+            ready, _, _ = select.select([self.fd], [], [], 1.0)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                logger.warning(f"inotify read error: {str(e)}")
+                break
+            self._parse(data)
+        os.close(self.fd)
+
+    def _parse(self, data):
+        offset = 0
+        with self._lock:
+            while offset + INOTIFY_EVENT.size <= len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+                offset += INOTIFY_EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    self.overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                directory = self.watches.get(wd)
+                if directory is None:
+                    continue
+                if not name:
+                    # The watched directory itself was deleted or moved
+                    self.dirs.add(directory)
+                elif mask & IN_ISDIR:
+                    self.dirs.add(os.path.join(directory, os.fsdecode(name)))
+                else:
+                    self.files.add(os.path.join(directory, os.fsdecode(name)))
+
+            if len(self.files) + len(self.dirs) > self.max_pending:
+                self.files, self.dirs, self.overflowed = set(), set(), True
+
+
+class FileIntegrityMonitor:
+    """Reports files added, modified or removed under the configured paths.
+
+    A persistent baseline holds (inode, size, mtime, sha256) for every
+    file. A scan only stats files and re-hashes those whose inode, size or
+    mtime changed, so the cost of a rescan does not depend on file sizes.
+    On Linux, inotify reports changes between scans and only those paths
+    are checked; a full rescan still runs every ``rescan_interval``
+    seconds, and whenever events were lost. Elsewhere changes are found by
+    the periodic rescans alone.
+    """
+
+    def __init__(self, paths, baseline_path=DEFAULT_BASELINE_PATH, workers=2, rescan_interval=3600,
+                 use_inotify=True):
+        self.roots = [os.path.abspath(path) for path in paths]
+        self.baseline_path = baseline_path
+        self.workers = workers
+        self.rescan_interval = rescan_interval
+        self.baseline = {}
+        self.established = False
+        self.watcher = None
+        self._last_full = None
+        self._pool = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._load_baseline()
+
+        if use_inotify and platform.system() == 'Linux':
+            try:
+                self.watcher = InotifyWatcher()
+            except (OSError, AttributeError) as e:
+                logger.info(f"inotify unavailable ({str(e)}), relying on periodic rescans")
+
+    def _load_baseline(self):
+        if not self.baseline_path:
+            return
+        try:
+            with open(self.baseline_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get('roots') == self.roots:
+            self.baseline = state.get('files', {})
+            self.established = True
+        else:
+            logger.info("Monitored paths changed, building a new file integrity baseline")
+
+    def _save_baseline(self):
+        if not self.baseline_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.baseline_path) or '.', exist_ok=True)
+            tmp_path = self.baseline_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'roots': self.roots, 'files': self.baseline}, f, separators=(',', ':'))
+            os.replace(tmp_path, self.baseline_path)
+        except OSError as e:
+            logger.warning(f"Could not save file integrity baseline: {str(e)}")
+
+    def start(self):
+        if self.watcher:
+            threading.Thread(target=self.watcher.run, args=(self._stop,), name='fim-inotify', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _covered(self, path):
+        return any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in self.roots)
+
+    def _walk(self, top):
+        """Yield (path, stat) for every regular file under ``top``, watching each directory on the way"""
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            if self.watcher:
+                self.watcher.watch(directory)
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                yield entry.path, entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def _observe(self, top):
+        if os.path.isdir(top) and not os.path.islink(top):
+            yield from self._walk(top)
+            return
+        # A single monitored file; its directory is watched for events about it
+        if self.watcher:
+            self.watcher.watch(os.path.dirname(top))
+        try:
+            stat = os.lstat(top)
+        except OSError:
+            return
+        if not os.path.islink(top):
+            yield top, stat
+
+    def _reconcile(self, observed, missing):
+        """Update the baseline from observed (path, stat) pairs and vanished paths; return the changes"""
+        stale = []
+        for path, stat in observed:
+            key = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+            previous = self.baseline.get(path)
+            if previous is None or previous[:3] != key:
+                stale.append((path, key))
+
+        if self._pool is None and self.workers > 1 and len(stale) >= POOL_MIN_FILES:
+            # Started on first use and kept, so later scans do not pay for new worker processes
+            self._pool = hash_pool(self.workers)
+        try:
+            digests = hash_files([path for path, _ in stale], self.workers, self._pool)
+        except BrokenProcessPool as e:
+            logger.warning(f"File hashing pool failed ({str(e)}), hashing in the agent process")
+            self._pool = None
+            digests = [hash_file(path) for path, _ in stale]
+        METRICS.inc('fim_files_hashed_total', len(stale))
+
+        changes = []
+        for (path, key), digest in zip(stale, digests):
+            previous = self.baseline.get(path)
+            self.baseline[path] = key + [digest]
+            if previous is None:
+                changes.append(self._change(path, 'added', key, digest))
+            elif previous[3] != digest:
+                changes.append(self._change(path, 'modified', key, digest, previous[3]))
+
+        for path in missing:
+            previous = self.baseline.pop(path, None)
+            if previous is not None:
+                changes.append(self._change(path, 'removed', previous[:3], None, previous[3]))
+
+        if stale or missing:
+            self._save_baseline()
+        return changes
+
+    def _change(self, path, change, key, digest, previous_digest=None):
+        return {
+            'path': path,
+            'change': change,
+            'inode': key[0],
+            'size': key[1],
+            'mtime': datetime.utcfromtimestamp(key[2] / 1e9).isoformat(),
+            'sha256': digest,
+            'previous_sha256': previous_digest
+        }
+
+    def _full_scan(self):
+        observed = [item for root in self.roots for item in self._observe(root)]
+        seen = {path for path, _ in observed}
+        return self._reconcile(observed, [path for path in self.baseline if path not in seen])
+
+    def _incremental(self, files, dirs):
+        observed = []
+        missing = []
+        for directory in dirs:
+            if not self._covered(directory):
+                continue
+            seen = set()
+            for path, stat in self._walk(directory):
+                seen.add(path)
+                observed.append((path, stat))
+            prefix = directory.rstrip(os.sep) + os.sep
+            missing.extend(path for path in self.baseline if path.startswith(prefix) and path not in seen)
+        for path in files:
+            if not self._covered(path):
+                continue
+            try:
+                stat = os.lstat(path)
+            except OSError:
+                missing.append(path)
+                continue
+            if os.path.isfile(path) and not os.path.islink(path):
+                observed.append((path, stat))
+            else:
+                missing.append(path)
+        return self._reconcile(observed, missing)
+
+    def check(self):
+        """Files added, modified or removed since the previous check"""
+        with self._lock:
+            now = time.monotonic()
+            files, dirs, overflowed = self.watcher.take() if self.watcher else (set(), set(), False)
+            if self._last_full is None or overflowed or now - self._last_full >= self.rescan_interval:
+                with METRICS.timed('fim_scan', mode='full'):
+                    changes = self._full_scan()
+                self._last_full = now
+            elif self.watcher and not self.watcher.exhausted:
+                with METRICS.timed('fim_scan', mode='inotify'):
+                    changes = self._incremental(files, dirs)
+            else:
+                return []
+
+            METRICS.set_gauge('fim_files', len(self.baseline))
+            if not self.established:
+                logger.info(f"File integrity baseline established with {len(self.baseline)} files")
+                self.established = True
+                self._save_baseline()
+                return []
+            METRICS.inc('fim_changes_total', len(changes))
+            return changes
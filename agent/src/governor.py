@@ -0,0 +1,194 @@
+import os
+import logging
+import platform
+import psutil
+from src.metrics import METRICS
+from src.scheduler import PRIORITY_NORMAL, PRIORITY_LOW
+
+logger = logging.getLogger(__name__)
+
+LEVEL_NORMAL = 0
+LEVEL_ELEVATED = 1
+LEVEL_CRITICAL = 2
+LEVEL_NAMES = ('normal', 'elevated', 'critical')
+
+# Priorities skipped at each load level
+SHED_PRIORITIES = {
+    LEVEL_NORMAL: (),
+    LEVEL_ELEVATED: (PRIORITY_LOW,),
+    LEVEL_CRITICAL: (PRIORITY_LOW, PRIORITY_NORMAL)
+}
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+CGROUP_PERIOD = 100000
+
+
+def _priority_settings(level, base_nice):
+    """(nice, ionice) for the agent and its children at a load level"""
+    if platform.system() == 'Windows':
+        return {
+            LEVEL_NORMAL: (base_nice, (psutil.IOPRIO_NORMAL, None)),
+            LEVEL_ELEVATED: (psutil.BELOW_NORMAL_PRIORITY_CLASS, (psutil.IOPRIO_LOW, None)),
+            LEVEL_CRITICAL: (psutil.IDLE_PRIORITY_CLASS, (psutil.IOPRIO_VERYLOW, None))
+        }[level]
+    ionice = {
+        LEVEL_NORMAL: (getattr(psutil, 'IOPRIO_CLASS_BE', None), 4),
+        LEVEL_ELEVATED: (getattr(psutil, 'IOPRIO_CLASS_BE', None), 7),
+        LEVEL_CRITICAL: (getattr(psutil, 'IOPRIO_CLASS_IDLE', None), None)
+    }[level]
+    # Never run at a higher priority than the agent was started with
+    return {LEVEL_NORMAL: base_nice, LEVEL_ELEVATED: max(base_nice, 10), LEVEL_CRITICAL: 19}[level], ionice
+
+
+def set_cgroup_cpu_limit(percent):
+    """Cap the agent's cgroup (children included) at ``percent`` of one CPU; needs a delegated cgroup v2"""
+    try:
+        with open('/proc/self/cgroup') as f:
+            path = next(line.strip()[3:] for line in f if line.startswith('0::'))
+        cpu_max = os.path.join(CGROUP_ROOT, path.lstrip('/'), 'cpu.max')
+        with open(cpu_max, 'w') as f:
+            f.write(f"{int(CGROUP_PERIOD * percent / 100)} {CGROUP_PERIOD}")
+        logger.info(f"Limited agent cgroup to {percent}% of a CPU via {cpu_max}")
+        return True
+    except (OSError, StopIteration) as e:
+        logger.info(f"Could not set a cgroup CPU limit ({str(e)}), enforcing the budget by shedding collectors")
+        return False
+
+
+class LoadGovernor:
+    """Backs the agent off while the host is busy and restores it when load drops.
+
+    Host pressure is the higher of recent CPU usage and the per-core load
+    average. At ``high`` percent the agent goes to the elevated level, at
+    ``critical`` percent to the critical one, and it also counts as elevated
+    while its own CPU use (children included) exceeds ``agent_cpu_budget``
+    percent of one CPU. Levels drop again only once pressure is
+    ``hysteresis`` points below the threshold, so the agent does not flap.
+
+    Each level stretches non-critical collection intervals, sheds low
+    priority collectors and lowers the CPU and I/O priority of the agent
+    and of the osquery and PowerShell processes it runs.
+    """
+
+    def __init__(self, sampler=None, high=85, critical=95, hysteresis=10, agent_cpu_budget=None,
+                 max_stretch=4, window=15):
+        self.sampler = sampler
+        self.high = high
+        self.critical = critical
+        self.hysteresis = hysteresis
+        self.agent_cpu_budget = agent_cpu_budget
+        self.max_stretch = max_stretch
+        self.window = window
+        self.level = LEVEL_NORMAL
+        self.process = psutil.Process()
+        self._children = {}
+        self._priority_level = None
+        self._prioritised = set()
+        self.base_nice = self.process.nice()
+        self.process.cpu_percent(interval=None)
+
+    @property
+    def stretch(self):
+        """Multiplier applied to the interval of every collector that is not high priority"""
+        return {LEVEL_NORMAL: 1, LEVEL_ELEVATED: min(2, self.max_stretch), LEVEL_CRITICAL: self.max_stretch}[self.level]
+
+    def should_skip(self, priority):
+        return priority in SHED_PRIORITIES[self.level]
+
+    def host_pressure(self):
+        cpu = self.sampler.recent('cpu', self.window) if self.sampler else None
+        if cpu is None:
+            cpu = psutil.cpu_percent(interval=None)
+        try:
+            load = os.getloadavg()[0] / (psutil.cpu_count() or 1) * 100
+        except (AttributeError, OSError):
+            load = 0
+        return max(cpu, load)
+
+    def agent_cpu(self):
+        """CPU percent of one core used by the agent and its child processes since the last call"""
+        total = self.process.cpu_percent(interval=None)
+        children = {}
+        for child in self.process.children(recursive=True):
+            # Reuse Process objects so cpu_percent measures since the previous update
+            child = self._children.get(child.pid, child)
+            try:
+                usage = child.cpu_percent(interval=None)
+            except psutil.Error:
+                continue
+            children[child.pid] = child
+            total += usage
+        self._children = children
+        return total
+
+    def _target_level(self, pressure, agent_cpu):
+        level = LEVEL_NORMAL
+        if pressure >= self.critical:
+            level = LEVEL_CRITICAL
+        elif pressure >= self.high:
+            level = LEVEL_ELEVATED
+        if self.agent_cpu_budget and agent_cpu > self.agent_cpu_budget:
+            level = max(level, LEVEL_ELEVATED)
+
+        # Only step down once pressure is clearly below the threshold we crossed
+        if level < self.level:
+            threshold = self.critical if self.level == LEVEL_CRITICAL else self.high
+            if pressure >= threshold - self.hysteresis:
+                level = self.level
+        return level
+
+    def _priority_targets(self):
+        """The agent and its children; on Linux every thread of each, since nice and ionice are per thread there"""
+        processes = [self.process] + list(self._children.values())
+        if platform.system() != 'Linux':
+            return processes
+        threads = []
+        for process in processes:
+            try:
+                threads.extend(psutil.Process(thread.id) for thread in process.threads())
+            except psutil.Error:
+                continue
+        return threads
+
+    def _apply_priority(self, level):
+        if level == LEVEL_NORMAL and self._priority_level in (None, LEVEL_NORMAL):
+            # Nothing was lowered, so leave the priorities the agent was started with alone
+            self._priority_level = level
+            return
+        nice, (ioclass, iovalue) = _priority_settings(level, self.base_nice)
+        targets = self._priority_targets()
+        prioritised = {target.pid for target in targets}
+        if level == self._priority_level:
+            # Only children and threads started since the last update (a restarted osqueryi) need it
+            targets = [target for target in targets if target.pid not in self._prioritised]
+        for target in targets:
+            try:
+                target.nice(nice)
+                if ioclass is not None and hasattr(target, 'ionice'):
+                    if iovalue is None:
+                        target.ionice(ioclass)
+                    else:
+                        target.ionice(ioclass, iovalue)
+            except psutil.AccessDenied:
+                # Unprivileged processes cannot raise their priority again; stay lowered
+                logger.debug(f"Not permitted to change priority of pid {target.pid}")
+            except (psutil.Error, ValueError, TypeError):
+                continue
+        self._priority_level = level
+        self._prioritised = prioritised
+
+    def update(self):
+        """Re-evaluate host load and adjust the agent; called periodically"""
+        pressure = self.host_pressure()
+        agent_cpu = self.agent_cpu()
+        level = self._target_level(pressure, agent_cpu)
+        if level != self.level:
+            logger.warning(f"Host load {pressure:.0f}%, agent CPU {agent_cpu:.0f}%: "
+                           f"switching from {LEVEL_NAMES[self.level]} to {LEVEL_NAMES[level]} collection")
+            self.level = level
+        self._apply_priority(level)
+
+        METRICS.set_gauge('governor_level', level)
+        METRICS.set_gauge('host_pressure_percent', round(pressure, 1))
+        METRICS.set_gauge('agent_cpu_percent', round(agent_cpu, 1))
+        return level
@@ -0,0 +1,200 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a fast osquery pipe query up to a slow powershell scan
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        running = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class MetricsRegistry:
+    """In-process counters, gauges and latency histograms for the agent itself"""
+
+    def __init__(self, prefix='siem_agent'):
+        self.prefix = prefix
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.process = None
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextmanager
+    def timed(self, name, **labels):
+        """Record the duration of a block in the ``name`` histogram, counting failures"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f'{name}_failures_total', **labels)
+            raise
+        finally:
+            self.observe(f'{name}_seconds', time.perf_counter() - start, **labels)
+
+    def update_process_metrics(self):
+        """Refresh the agent's own resource usage"""
+        # psutil is only needed once metrics are rendered, so importing this module stays cheap
+        import psutil
+        if self.process is None:
+            self.process = psutil.Process(os.getpid())
+        try:
+            with self.process.oneshot():
+                self.set_gauge('process_resident_memory_bytes', self.process.memory_info().rss)
+                cpu = self.process.cpu_times()
+                self.set_gauge('process_cpu_seconds_total', cpu.user + cpu.system)
+                self.set_gauge('process_threads', self.process.num_threads())
+        except psutil.Error as e:
+            logger.warning(f"Could not read agent resource usage: {str(e)}")
+
+    def render_prometheus(self):
+        """Render every metric in the Prometheus text exposition format"""
+        self.update_process_metrics()
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f'# TYPE {self.prefix}_{name} counter')
+                for key, value in series.items():
+                    lines.append(f'{self.prefix}_{name}{_format_labels(key)} {value}')
+            for name, series in sorted(self.gauges.items()):
+                lines.append(f'# TYPE {self.prefix}_{name} gauge')
+                for key, value in series.items():
+                    lines.append(f'{self.prefix}_{name}{_format_labels(key)} {value}')
+            for name, series in sorted(self.histograms.items()):
+                full_name = f'{self.prefix}_{name}'
+                lines.append(f'# TYPE {full_name} histogram')
+                for key, histogram in series.items():
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{full_name}_bucket{_format_labels(key, [("le", bound)])} {count}')
+                    lines.append(f'{full_name}_bucket{_format_labels(key, [("le", "+Inf")])} {histogram.total}')
+                    lines.append(f'{full_name}_sum{_format_labels(key)} {histogram.sum}')
+                    lines.append(f'{full_name}_count{_format_labels(key)} {histogram.total}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Compact view of the metrics to piggy-back on the status heartbeat"""
+        self.update_process_metrics()
+
+        def label_string(key):
+            return ','.join(f'{name}={value}' for name, value in key) or 'total'
+
+        with self._lock:
+            return {
+                'counters': {
+                    name: {label_string(key): value for key, value in series.items()}
+                    for name, series in self.counters.items()
+                },
+                'gauges': {
+                    name: {label_string(key): value for key, value in series.items()}
+                    for name, series in self.gauges.items()
+                },
+                'latency': {
+                    name: {
+                        label_string(key): {
+                            'count': h.total,
+                            'avg': round(h.sum / h.total, 4) if h.total else 0
+                        }
+                        for key, h in series.items()
+                    }
+                    for name, series in self.histograms.items()
+                }
+            }
+
+
+METRICS = MetricsRegistry()
+
+
+class MetricsServer:
+    """Serves the registry on a local /metrics endpoint"""
+
+    def __init__(self, registry=METRICS, host='127.0.0.1', port=9101):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry_ref.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def write_metrics_file(path, registry=METRICS):
+    """Write the metrics atomically for a node_exporter textfile collector"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(registry.render_prometheus())
+    os.replace(tmp_path, path)
@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import socket
+import logging
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+ONCE_COLLECTORS = ('system', 'snapshot', 'osquery', 'scan')
+
+# Per-worker state for batch mode, built once by _init_worker
+_worker = {}
+
+
+def record(record_type, data, hostname=None, timestamp=None, **extra):
+    """One NDJSON output record"""
+    entry = {
+        'type': record_type,
+        'hostname': hostname or socket.gethostname(),
+        'timestamp': timestamp or datetime.utcnow().isoformat()
+    }
+    entry.update(extra)
+    entry['data'] = data
+    return entry
+
+
+def encode_record(entry):
+    return json.dumps(entry, separators=(',', ':'), default=str) + '\n'
+
+
+def write_streamed_record(output, entry):
+    """Write one NDJSON record whose data may be a generator, encoding it a row at a time"""
+    from src.wire_format import iter_json
+    output.writelines(iter_json(entry, default=str))
+    output.write('\n')
+
+
+def _rows_until_error(rows, errors):
+    """Pass rows through, ending the stream cleanly and noting the error if the query fails"""
+    from src.osquery_session import OSQueryQueryError
+    try:
+        yield from rows
+    except OSQueryQueryError as e:
+        errors.append(str(e))
+
+
+def load_rules(path):
+    """The rule set for an offline run; a missing or malformed file is a usage error, not a crash"""
+    from src.rules import RuleEngine
+    try:
+        return RuleEngine.load(path)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Cannot load detection rules from {path}: {str(e)}")
+
+
+def open_output(path):
+    if not path or path == '-':
+        return sys.stdout
+    return open(path, 'w', encoding='utf-8')
+
+
+def run_once(args):
+    """Run the selected collectors a single time and stream their results as NDJSON"""
+    from src.process_snapshot import take_snapshot
+
+    collectors = [name.strip() for name in args.collectors.split(',') if name.strip()]
+    unknown = [name for name in collectors if name not in ONCE_COLLECTORS]
+    if unknown:
+        raise ValueError(f"Unknown collectors: {', '.join(unknown)} (choose from {', '.join(ONCE_COLLECTORS)})")
+    rules = load_rules(args.rules) if 'scan' in collectors else None
+
+    output = open_output(args.output)
+    snapshot = take_snapshot() if {'snapshot', 'osquery', 'scan'} & set(collectors) else None
+    try:
+        if 'system' in collectors:
+            from src.agent import get_system_info
+            output.write(encode_record(record('system', get_system_info())))
+
+        if 'snapshot' in collectors:
+            output.write(encode_record(record('snapshot', snapshot.to_dict())))
+
+        if 'osquery' in collectors:
+            from src.osquery_manager import OSQueryManager
+            from src.process_snapshot import SnapshotCache
+            snapshots = SnapshotCache(max_age=float('inf'), snapshot=snapshot)
+            osquery = OSQueryManager(
+                persistent=not args.no_persistent_osquery,
+                extension_socket=args.osquery_socket,
+                query_pack=args.query_pack,
+                snapshots=None if args.osquery_processes else snapshots
+            )
+            try:
+                for name, _, _ in osquery.scheduled_queries():
+                    if name == 'system_info':
+                        output.write(encode_record(record('osquery', osquery.collect_query(name), query=name)))
+                    else:
+                        # Rows go from osquery's output to ours one at a time, however large the table
+                        errors = []
+                        _, rows = osquery.stream_query(name)
+                        write_streamed_record(output, record('osquery', _rows_until_error(rows, errors), query=name))
+                        if errors:
+                            output.write(encode_record(record('error', errors[0], query=name)))
+                    output.flush()
+            finally:
+                osquery.close()
+
+        if 'scan' in collectors:
+            from src.security_scan import run_security_scan
+            from src.posture import PostureChecker
+            scan_results = run_security_scan(snapshot, rules=rules, posture=PostureChecker())
+            if scan_results and os.path.exists(args.advisory_feed):
+                # Report every match, not just ones that are new since a previous run
+                from src.vuln_matcher import VulnerabilityMatcher
+                from src.software_inventory import SoftwareInventory
+                matcher = VulnerabilityMatcher.load(args.advisory_feed)
+                scan_results['vulnerabilities'] = matcher.match(
+                    SoftwareInventory(cache_path=None).collect(), scan_results['hostname'], scan_results['timestamp']
+                )
+            output.write(encode_record(record('scan', scan_results)))
+    finally:
+        output.flush()
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+def _batch_inputs(paths):
+    """Yield work items: one per NDJSON line, one per whole JSON file, or an error for an unreadable path"""
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                names = sorted(name for name in os.listdir(path) if name.endswith(('.json', '.jsonl', '.ndjson')))
+                yield from _batch_inputs([os.path.join(path, name) for name in names])
+            elif path.endswith('.json'):
+                # osqueryi --json output or a single record; parsed in the worker
+                yield ('file', path, None)
+            else:
+                with open(path, encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            yield ('line', path, line)
+        except (OSError, ValueError) as e:
+            yield ('error', path, str(e))
+
+
+def _init_worker(rules_path, query_pack):
+    from src.rules import RuleEngine
+    from src.osquery_manager import OSQueryManager
+    logging.disable(logging.WARNING)
+    _worker['rules'] = RuleEngine.load(rules_path)
+    _worker['osquery'] = OSQueryManager(persistent=False, query_pack=query_pack)
+
+
+def _process_snapshot(entry):
+    from src.process_snapshot import ProcessSnapshot
+    from src.security_scan import run_security_scan
+    osquery = _worker['osquery']
+    hostname = entry.get('hostname')
+    snapshot = ProcessSnapshot.from_dict(entry.get('data') or {})
+    scan_results = run_security_scan(snapshot, rules=_worker['rules']) or {}
+    scan_results['hostname'] = hostname or scan_results.get('hostname')
+    scan_results['snapshot_time'] = entry.get('timestamp')
+    return [
+        record('scan', scan_results, hostname),
+        record('osquery', osquery.format_query('processes', snapshot.process_rows())[1], hostname,
+               entry.get('timestamp'), query='processes'),
+        record('osquery', osquery.format_query('network_connections', snapshot.listening_rows())[1], hostname,
+               entry.get('timestamp'), query='network_connections')
+    ]
+
+
+def _process_rows(name, rows, hostname=None, timestamp=None):
+    osquery = _worker['osquery']
+    results = [record('osquery', osquery.format_query(name, rows)[1], hostname, timestamp, query=name)]
+    sources = [name, 'process'] if name == 'processes' else [name]
+    # A saved process table is its own pid map, so parent.* conditions resolve as in the live agent
+    processes = {row.get('pid'): row for row in rows} if name == 'processes' else None
+    findings = [finding for source in sources for finding in _worker['rules'].evaluate(source, rows, processes)]
+    if findings:
+        results.append(record('findings', findings, hostname, timestamp, query=name))
+    return results
+
+
+def _process_item(item):
+    """Turn one saved snapshot into encoded NDJSON output lines"""
+    kind, path, text = item
+    if kind == 'error':
+        return [encode_record(record('error', text, source=path))]
+    try:
+        if kind == 'file':
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+            if isinstance(entry, list):
+                # Raw osqueryi --json output, named after the query that produced it
+                name = os.path.splitext(os.path.basename(path))[0]
+                return [encode_record(r) for r in _process_rows(name, entry)]
+        else:
+            entry = json.loads(text)
+        if not isinstance(entry, dict):
+            raise ValueError(f"Expected a JSON object, got {type(entry).__name__}")
+
+        if entry.get('type') == 'snapshot':
+            results = _process_snapshot(entry)
+        elif entry.get('type') == 'osquery_rows':
+            results = _process_rows(entry['query'], entry.get('rows') or [], entry.get('hostname'), entry.get('timestamp'))
+        else:
+            return []
+        return [encode_record(r) for r in results]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        return [encode_record(record('error', str(e), source=path))]
+
+
+def run_batch(args):
+    """Reprocess saved snapshots in parallel, streaming results as NDJSON in input order"""
+    workers = args.workers or os.cpu_count() or 1
+    # Checked here so a bad rules file is reported once instead of breaking every worker
+    load_rules(args.rules)
+    output = open_output(args.output)
+    # Bounded number of items in flight so memory stays flat however many snapshots there are
+    pending = deque()
+    processed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(args.rules, args.query_pack)) as executor:
+            for item in _batch_inputs(args.batch):
+                pending.append(executor.submit(_process_item, item))
+                if len(pending) >= workers * 4:
+                    output.writelines(pending.popleft().result())
+                    processed += 1
+            while pending:
+                output.writelines(pending.popleft().result())
+                processed += 1
+    finally:
+        output.flush()
+        if output is not sys.stdout:
+            output.close()
+    logger.info(f"Processed {processed} snapshots with {workers} workers")
+    return 0
@@ -4,35 +4,121 @@ import subprocess
 import platform
 import logging
 import shutil
+import time
+import tempfile
+import threading
 from datetime import datetime
+from src.osquery_session import (
+    OSQueryPipeSession,
+    OSQueryExtensionSession,
+    OSQuerySessionError,
+    OSQueryQueryError,
+    DEFAULT_EXTENSION_SOCKETS,
+    iter_json_rows
+)
+from src.metrics import METRICS
+from src.wire_format import encode_columns, PROCESS_COLUMNS, NETWORK_COLUMNS
+
+DEFAULT_QUERY_PACK = os.path.join(os.path.dirname(__file__), 'query_pack.json')
+
+# Pack queries that can be answered from the shared process snapshot without osquery
+SNAPSHOT_QUERIES = ('processes', 'network_connections')
+
+# Upload sections holding events since the previous upload rather than current state
+EVENT_SECTIONS = ('process_events',)
+
+# Characters read from osqueryi's stdout at a time when streaming a result
+OUTPUT_CHUNK_SIZE = 64 * 1024
+
+def _platform_matches(pack_platform, current_platform):
+    """Check an osquery-style platform filter ('windows', 'linux', 'darwin', 'posix', 'all')"""
+    if not pack_platform or pack_platform == 'all':
+        return True
+    platforms = [p.strip() for p in pack_platform.split(',')]
+    if 'posix' in platforms and current_platform in ('linux', 'darwin'):
+        return True
+    return current_platform in platforms
 
 class OSQueryManager:
-    def __init__(self):
+    # Seconds to wait before retrying a session that failed to start
+    SESSION_RETRY_DELAY = 60
+
+    def __init__(self, persistent=True, extension_socket=None, query_timeout=30, query_pack=None, snapshots=None, columnar=False):
         self.osqueryi_path = self._find_osquery()
         if not self.osqueryi_path:
             logging.warning("OSQuery not found. Some functionality will be limited.")
+
+        self.persistent = persistent
+        self.extension_socket = extension_socket or DEFAULT_EXTENSION_SOCKETS.get(platform.system())
+        self.query_timeout = query_timeout
+        self.session = None
+        self._session_retry_at = 0
+        # Scheduler jobs query concurrently; only one of them may start or stop the session
+        self._session_lock = threading.Lock()
+
+        # When set, process and listening port rows come from the shared psutil snapshot
+        # instead of another walk of the process table by osquery
+        self.snapshots = snapshots
+
+        # Encode process and network inventories as columnar batches (see wire_format)
+        self.columnar = columnar
             
-        self.queries = {
-            'processes': 'SELECT pid, name, path, cmdline, state, parent, uid FROM processes;',
-            'users': 'SELECT uid, username, directory, shell FROM users;',
-            'network_connections': '''
-                SELECT DISTINCT processes.name, processes.path,
-                    listening.port, listening.address, listening.protocol
-                FROM processes
-                JOIN listening_ports AS listening
-                ON processes.pid = listening.pid;
-            ''',
-            'startup_items': '''
-                SELECT name, path, source, status 
-                FROM startup_items WHERE status != 'disabled';
-            ''',
-            'scheduled_tasks': 'SELECT name, action, path, enabled FROM scheduled_tasks;',
-            'system_info': '''
-                SELECT hostname, cpu_brand, physical_memory, hardware_vendor,
-                    hardware_model, hardware_serial
-                FROM system_info;
-            '''
+        self.queries = {}
+        self.schedule = {}
+        self.load_query_pack(query_pack or DEFAULT_QUERY_PACK)
+
+        # Latest formatted result of each query, keyed by upload section
+        self.results = {
+            'processes': [],
+            'network': [],
+            'system': None
         }
+        self.results_changed = False
+        self._results_lock = threading.Lock()
+
+    def load_query_pack(self, path):
+        """Load query definitions and their schedules from a JSON query pack"""
+        try:
+            with open(path) as f:
+                pack = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error loading query pack {path}: {str(e)}")
+            if path == DEFAULT_QUERY_PACK:
+                return
+            logging.warning("Falling back to the bundled query pack")
+            return self.load_query_pack(DEFAULT_QUERY_PACK)
+
+        current_platform = platform.system().lower()
+        for name, entry in pack.get('queries', {}).items():
+            query = entry.get('query')
+            if not query:
+                logging.warning(f"Query pack entry {name} has no query, skipping")
+                continue
+            self.queries[name] = query
+            self.schedule[name] = {
+                'interval': int(entry.get('interval', 60)),
+                'jitter': int(entry.get('jitter', 0)),
+                'enabled': bool(entry.get('enabled', True)) and _platform_matches(entry.get('platform'), current_platform)
+            }
+
+    def available(self):
+        """Whether queries can reach osquery, through osqueryi or a session"""
+        return bool(self.osqueryi_path or self._get_session())
+
+    def _servable(self, name):
+        return self.snapshots is not None and name in SNAPSHOT_QUERIES
+
+    def scheduled_queries(self):
+        """Return (name, interval, jitter) for every enabled query that can be answered.
+
+        Without osquery only the queries served from the process snapshot are left.
+        """
+        available = self.available()
+        return [
+            (name, entry['interval'], entry['jitter'])
+            for name, entry in self.schedule.items()
+            if entry['enabled'] and (available or self._servable(name))
+        ]
 
     def _find_osquery(self):
         """Find OSQuery executable in common locations"""
@@ -62,33 +148,122 @@ class OSQueryManager:
                 return path
         return None
 
+    def _open_session(self):
+        """Open a long-lived session, preferring osqueryd's extension socket over an osqueryi pipe"""
+        candidates = []
+        if self.extension_socket and os.path.exists(self.extension_socket):
+            candidates.append(OSQueryExtensionSession(self.extension_socket, timeout=self.query_timeout))
+        if self.osqueryi_path:
+            candidates.append(OSQueryPipeSession(self.osqueryi_path, timeout=self.query_timeout))
+
+        for session in candidates:
+            try:
+                session.start()
+                logging.info(f"Using persistent osquery session: {type(session).__name__}")
+                return session
+            except (OSQuerySessionError, OSError) as e:
+                logging.warning(f"Could not start {type(session).__name__}: {str(e)}")
+        return None
+
+    def _get_session(self):
+        if not self.persistent:
+            return None
+        with self._session_lock:
+            if self.session and self.session.alive():
+                return self.session
+            if time.monotonic() < self._session_retry_at:
+                return None
+
+            if self.session:
+                self.session.close()
+            self.session = self._open_session()
+            if not self.session:
+                self._session_retry_at = time.monotonic() + self.SESSION_RETRY_DELAY
+            return self.session
+
+    def _discard_session(self, session):
+        """Close a session that failed, unless another job has already replaced it"""
+        with self._session_lock:
+            if self.session is session:
+                self.session = None
+        session.close()
+
+    def close(self):
+        """Shut down the persistent osquery session, if any"""
+        with self._session_lock:
+            session, self.session = self.session, None
+        if session:
+            session.close()
+
     def run_query(self, query):
         """Run an OSQuery query and return the results as JSON"""
-        if not self.osqueryi_path:
-            logging.error("OSQuery not installed or not found")
-            return None
-            
         try:
-            cmd = [self.osqueryi_path, '--json', query]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                logging.error(f"OSQuery error: {result.stderr}")
-                return None
-                
-            return json.loads(result.stdout)
-        except Exception as e:
-            logging.error(f"Error running OSQuery: {str(e)}")
+            return list(self.iter_query(query))
+        except OSQueryQueryError as e:
+            logging.error(f"OSQuery error: {str(e)}")
             return None
 
+    def iter_query(self, query):
+        """Yield the rows of an OSQuery query as they are parsed, without holding the whole result.
+
+        Raises OSQueryQueryError if the query fails.
+        """
+        session = self._get_session()
+        if session:
+            streamed = False
+            try:
+                for row in session.query_iter(query):
+                    streamed = True
+                    yield row
+                return
+            except OSQuerySessionError as e:
+                # The session is out of sync or dead; restart it on the next query
+                self._discard_session(session)
+                if streamed:
+                    raise OSQueryQueryError(f"OSQuery session failed part way through the result: {str(e)}")
+                logging.warning(f"OSQuery session failed, falling back to osqueryi: {str(e)}")
+
+        yield from self._iter_query_subprocess(query)
+
+    def _iter_query_subprocess(self, query):
+        """Run a query in a fresh osqueryi process, parsing its output as it is written"""
+        if not self.osqueryi_path:
+            raise OSQueryQueryError("OSQuery not installed or not found")
+
+        # stderr goes to a file so a chatty osqueryi cannot block on a full pipe while we read stdout
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                process = subprocess.Popen([self.osqueryi_path, '--json', query], stdout=subprocess.PIPE,
+                                           stderr=stderr, text=True)
+            except OSError as e:
+                raise OSQueryQueryError(f"Error running OSQuery: {str(e)}")
+            timer = threading.Timer(self.query_timeout, process.kill)
+            timer.start()
+            try:
+                yield from iter_json_rows(iter(lambda: process.stdout.read(OUTPUT_CHUNK_SIZE), ''))
+                process.wait()
+            except ValueError as e:
+                raise OSQueryQueryError(str(e))
+            finally:
+                timer.cancel()
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+                process.stdout.close()
+
+            if process.returncode != 0:
+                stderr.seek(0)
+                message = stderr.read().decode('utf-8', 'replace').strip()
+                raise OSQueryQueryError(message or f"osqueryi exited with status {process.returncode}")
+
     def format_process_data(self, data):
         """Format process data for SIEM dashboard"""
-        if not data:
-            return []
-            
-        formatted = []
-        for process in data:
-            formatted.append({
+        return list(self.iter_process_data(data or []))
+
+    def iter_process_data(self, rows):
+        """Format process rows one at a time"""
+        for process in rows:
+            yield {
                 'type': 'process',
                 'timestamp': datetime.utcnow().isoformat(),
                 'data': {
@@ -98,19 +273,19 @@ class OSQueryManager:
                     'command': process.get('cmdline'),
                     'state': process.get('state'),
                     'parent_pid': process.get('parent'),
-                    'user_id': process.get('uid')
+                    'user_id': process.get('uid'),
+                    'start_time': process.get('start_time')
                 }
-            })
-        return formatted
+            }
 
     def format_network_data(self, data):
         """Format network connection data for SIEM dashboard"""
-        if not data:
-            return []
-            
-        formatted = []
-        for conn in data:
-            formatted.append({
+        return list(self.iter_network_data(data or []))
+
+    def iter_network_data(self, rows):
+        """Format network connection rows one at a time"""
+        for conn in rows:
+            yield {
                 'type': 'network_connection',
                 'timestamp': datetime.utcnow().isoformat(),
                 'data': {
@@ -120,8 +295,7 @@ class OSQueryManager:
                     'local_address': conn.get('address'),
                     'protocol': conn.get('protocol')
                 }
-            })
-        return formatted
+            }
 
     def format_system_info(self, data):
         """Format system information for SIEM dashboard"""
@@ -142,24 +316,109 @@ class OSQueryManager:
             }
         }
 
+    def format_rows(self, name, data):
+        """Format rows of any other pack query for SIEM dashboard"""
+        return list(self.iter_rows(name, data or []))
+
+    def iter_rows(self, name, rows):
+        """Format rows of any other pack query one at a time"""
+        timestamp = datetime.utcnow().isoformat()
+        for row in rows:
+            yield {'type': name, 'timestamp': timestamp, 'data': row}
+
+    def _query_rows(self, name):
+        """Return raw rows for a pack query, served from the process snapshot when possible.
+
+        osquery rows are a generator that is parsed while it is consumed.
+        """
+        if self.snapshots and name == 'processes':
+            return self.snapshots.get().process_rows()
+        if self.snapshots and name == 'network_connections':
+            return self.snapshots.get().listening_rows()
+        return self.iter_query(self.queries[name])
+
+    def _count_rows(self, rows, counts):
+        for row in rows:
+            counts['rows'] += 1
+            yield row
+
+    def collect_query(self, name):
+        """Run one pack query and store its formatted result"""
+        counts = {'rows': 0}
+        with METRICS.timed('osquery_query', table=name):
+            try:
+                # Rows are formatted as osquery emits them, so the raw result is never held in full
+                key, value = self.format_query(name, self._count_rows(self._query_rows(name), counts))
+            except OSQueryQueryError as e:
+                logging.error(f"OSQuery error: {str(e)}")
+                METRICS.inc('osquery_query_errors_total', table=name)
+                key, value = self.format_query(name, None)
+        METRICS.set_gauge('osquery_rows', counts['rows'], table=name)
+        self.store_result(key, value)
+        return value
+
+    def stream_query(self, name):
+        """Run one pack query and return (upload section, generator of formatted rows).
+
+        Nothing is stored and nothing is held beyond the current row, for
+        callers that write the rows straight out. Table sections only; the
+        generator raises OSQueryQueryError if the query fails.
+        """
+        rows = self._query_rows(name)
+        if name == 'processes':
+            return 'processes', self.iter_process_data(rows)
+        if name == 'network_connections':
+            return 'network', self.iter_network_data(rows)
+        return name, self.iter_rows(name, rows)
+
+    def format_query(self, name, rows):
+        """Format the rows of one pack query, returning (upload section, value)"""
+        if name == 'processes':
+            if self.columnar:
+                key, value = 'processes', encode_columns('process', rows, PROCESS_COLUMNS)
+            else:
+                key, value = 'processes', self.format_process_data(rows)
+        elif name == 'network_connections':
+            if self.columnar:
+                key, value = 'network', encode_columns('network_connection', rows, NETWORK_COLUMNS)
+            else:
+                key, value = 'network', self.format_network_data(rows)
+        elif name == 'system_info':
+            key, value = 'system', self.format_system_info(None if rows is None else list(rows))
+        else:
+            key, value = name, self.format_rows(name, rows)
+        return key, value
+
+    def store_result(self, key, value):
+        """Put a section into the next upload"""
+        with self._results_lock:
+            self.results[key] = value
+            self.results_changed = True
+
+    def take_results(self):
+        """Return the latest results if any query has run since the last call, else None"""
+        with self._results_lock:
+            if not self.results_changed:
+                return None
+            self.results_changed = False
+            results = dict(self.results)
+            # Event batches are uploaded once; inventories stay as the latest state
+            for key in EVENT_SECTIONS:
+                self.results.pop(key, None)
+            return results
+
     def collect_all_data(self):
         """Collect all OSQuery data and format it for the SIEM"""
-        if not self.osqueryi_path:
+        queries = self.scheduled_queries()
+        if not queries:
             return {
                 'processes': [],
                 'network': [],
                 'system': None
             }
-            
-        data = {
-            'processes': self.format_process_data(
-                self.run_query(self.queries['processes'])
-            ),
-            'network': self.format_network_data(
-                self.run_query(self.queries['network_connections'])
-            ),
-            'system': self.format_system_info(
-                self.run_query(self.queries['system_info'])
-            )
-        }
-        return data 
\ No newline at end of file
+
+        for name, _, _ in queries:
+            self.collect_query(name)
+        with self._results_lock:
+            self.results_changed = False
+            return dict(self.results)
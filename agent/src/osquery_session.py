@@ -0,0 +1,254 @@
+import re
+import json
+import time
+import queue
+import logging
+import threading
+import subprocess
+import uuid
+
+# Default locations of the osqueryd extension socket
+DEFAULT_EXTENSION_SOCKETS = {
+    'Windows': r'\\.\pipe\osquery.em',
+    'Linux': '/var/osquery/osquery.em',
+    'Darwin': '/var/osquery/osquery.em'
+}
+
+
+# Whitespace and separators between the rows of osqueryi's JSON array
+_ROW_SEPARATOR = re.compile(r'[\s,]*')
+_decoder = json.JSONDecoder()
+
+
+class OSQuerySessionError(Exception):
+    """Raised when a long-lived osquery session is unusable and must be restarted"""
+
+
+class OSQueryQueryError(Exception):
+    """Raised when osquery rejects a query or its output cannot be parsed"""
+
+
+def iter_json_rows(chunks):
+    """Yield the rows of osqueryi's JSON array output as they arrive.
+
+    ``chunks`` is any iterable of text (lines or fixed-size reads). Only the
+    text of the row being decoded is buffered, so memory stays flat however
+    many rows the query returns.
+    """
+    buffer = ''
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        pos = _ROW_SEPARATOR.match(buffer).end()
+        if not started and pos < len(buffer):
+            if buffer[pos] != '[':
+                raise ValueError(f"Unexpected osquery output: {buffer[pos:pos + 200].strip()}")
+            started = True
+            pos = _ROW_SEPARATOR.match(buffer, pos + 1).end()
+        while started and pos < len(buffer):
+            if buffer[pos] == ']':
+                return
+            try:
+                row, pos = _decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # The row is split across chunks; wait for the rest of it
+                break
+            yield row
+            pos = _ROW_SEPARATOR.match(buffer, pos).end()
+        buffer = buffer[pos:]
+    if started or buffer.strip():
+        raise ValueError("Truncated osquery output")
+
+
+class OSQueryPipeSession:
+    """Long-lived osqueryi process that receives queries over stdin.
+
+    Each query is followed by a marker query so the end of its JSON output can
+    be found in the stream without restarting the interpreter.
+    """
+
+    def __init__(self, osqueryi_path, timeout=30):
+        self.osqueryi_path = osqueryi_path
+        self.timeout = timeout
+        self.marker = uuid.uuid4().hex
+        self.process = None
+        self._lines = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the osqueryi process and its output reader"""
+        self.process = subprocess.Popen(
+            [self.osqueryi_path, '--json'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1
+        )
+        self._lines = queue.Queue()
+        reader = threading.Thread(target=self._read_output, args=(self.process.stdout, self._lines), daemon=True)
+        reader.start()
+
+    def _read_output(self, stream, lines):
+        for line in stream:
+            lines.put(line)
+        lines.put(None)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _next_line(self, deadline_timer):
+        try:
+            line = self._lines.get(timeout=max(deadline_timer(), 0.01))
+        except queue.Empty:
+            raise OSQuerySessionError("Timed out waiting for osqueryi output")
+        if line is None:
+            raise OSQuerySessionError("osqueryi exited")
+        return line
+
+    def _result_lines(self, remaining):
+        """Lines of one query's output, ending before the marker query's result"""
+        held = []
+        while True:
+            line = self._next_line(remaining)
+            if self.marker in line:
+                break
+            if line.strip() in ('', '['):
+                # Possibly the opening of the marker's result; only known once the next line arrives
+                held.append(line)
+                continue
+            yield from held
+            held = []
+            yield line
+        # Drop the opening bracket of the marker's result and consume its closing one
+        while held and not held[-1].strip():
+            held.pop()
+        if held:
+            held.pop()
+        yield from held
+        while self._next_line(remaining).strip() != ']':
+            pass
+
+    def query_iter(self, sql):
+        """Yield the rows of a query as osqueryi prints them.
+
+        Raises OSQueryQueryError if osquery rejected the query. The session
+        stays locked until the generator is exhausted or closed.
+        """
+        with self._lock:
+            if not self.alive():
+                raise OSQuerySessionError("osqueryi session is not running")
+
+            statement = sql.strip().replace('\n', ' ')
+            if not statement.endswith(';'):
+                statement += ';'
+            try:
+                self.process.stdin.write(statement + '\n')
+                self.process.stdin.write(f"SELECT '{self.marker}' AS osquery_session_marker;\n")
+                self.process.stdin.flush()
+            except (OSError, ValueError) as e:
+                raise OSQuerySessionError(f"Could not write to osqueryi: {e}")
+
+            deadline = time.monotonic() + self.timeout
+            lines = self._result_lines(lambda: deadline - time.monotonic())
+            try:
+                yield from iter_json_rows(lines)
+            except ValueError as e:
+                raise OSQueryQueryError(str(e))
+            finally:
+                # Read up to the marker so the next query starts in sync, even if the caller stopped early
+                for _ in lines:
+                    pass
+
+    def query(self, sql):
+        """Run a query and return the parsed rows, or None if osquery rejected it"""
+        try:
+            return list(self.query_iter(sql))
+        except OSQueryQueryError as e:
+            logging.error(f"OSQuery error: {str(e)}")
+            return None
+
+    def close(self):
+        """Stop the osqueryi process, after any query still streaming from it"""
+        # A query that outlives its timeout is cut off by killing the process under it
+        locked = self._lock.acquire(timeout=self.timeout)
+        try:
+            process = self.process
+            if not process:
+                return
+            try:
+                if locked and process.poll() is None:
+                    process.stdin.write('.exit\n')
+                    process.stdin.flush()
+                    process.wait(timeout=5)
+                else:
+                    process.kill()
+            except Exception:
+                process.kill()
+            finally:
+                self.process = None
+        finally:
+            if locked:
+                self._lock.release()
+
+
+class OSQueryExtensionSession:
+    """Query a running osqueryd through its extension (Thrift) socket.
+
+    Requires the optional ``osquery`` Python package.
+    """
+
+    def __init__(self, socket_path, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.client = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Connect to the extension socket"""
+        try:
+            import osquery
+        except ImportError:
+            raise OSQuerySessionError("osquery Python package is not installed")
+
+        try:
+            self.client = osquery.ExtensionClient(path=self.socket_path)
+            self.client.open(timeout=self.timeout)
+        except Exception as e:
+            self.client = None
+            raise OSQuerySessionError(f"Could not connect to {self.socket_path}: {e}")
+
+    def alive(self):
+        return self.client is not None
+
+    def query(self, sql):
+        """Run a query and return the parsed rows, or None if osquery rejected it"""
+        with self._lock:
+            if not self.client:
+                raise OSQuerySessionError("Extension socket is not connected")
+            try:
+                result = self.client.extension_client().query(sql)
+            except Exception as e:
+                raise OSQuerySessionError(f"Extension query failed: {e}")
+
+            if result.status.code != 0:
+                logging.error(f"OSQuery error: {result.status.message}")
+                return None
+            return result.response
+
+    def query_iter(self, sql):
+        """Yield the rows of a query; the Thrift response already holds them all"""
+        rows = self.query(sql)
+        if rows is None:
+            raise OSQueryQueryError("osqueryd rejected the query")
+        yield from rows
+
+    def close(self):
+        """Close the extension socket once no query is using it"""
+        with self._lock:
+            if self.client:
+                try:
+                    self.client.close()
+                except Exception:
+                    pass
+                self.client = None
@@ -0,0 +1,305 @@
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import platform
+import threading
+import subprocess
+from src.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Registry of posture probes: name -> PostureProbe
+PROBES = {}
+
+# Directories holding admin tools that are often missing from an unprivileged PATH
+SBIN_DIRS = ['/usr/sbin', '/sbin', '/usr/local/sbin']
+
+# Process names of antivirus and EDR agents, lower-cased, mapped to the product
+AV_PROCESSES = {
+    'clamd': 'ClamAV',
+    'falcon-sensor': 'CrowdStrike Falcon',
+    'falcond': 'CrowdStrike Falcon',
+    'csfalconservice.exe': 'CrowdStrike Falcon',
+    'wdavdaemon': 'Microsoft Defender for Endpoint',
+    'mssense.exe': 'Microsoft Defender for Endpoint',
+    'msmpeng.exe': 'Microsoft Defender Antivirus',
+    'savd': 'Sophos',
+    'sophos_threat_detector': 'Sophos',
+    'savservice.exe': 'Sophos',
+    'esets_daemon': 'ESET',
+    'ekrn.exe': 'ESET',
+    'ds_agent': 'Trend Micro Deep Security',
+    'cbagentd': 'Carbon Black',
+    'repmgr.exe': 'Carbon Black',
+    's1-agent': 'SentinelOne',
+    'sentinelagent.exe': 'SentinelOne',
+    'elastic-endpoint': 'Elastic Endpoint',
+    'elastic-endpoint.exe': 'Elastic Endpoint',
+    'mfetpd': 'Trellix Endpoint Security',
+    'mcshield.exe': 'Trellix Endpoint Security',
+    'avp.exe': 'Kaspersky',
+    'xprotectservice': 'Apple XProtect'
+}
+
+
+# Pending updates and how many are in the Security Updates category, matched by its
+# locale-independent category ID rather than its display name
+WINDOWS_UPDATE_SEARCH = (
+    "$updates = @((New-Object -ComObject Microsoft.Update.Session).CreateUpdateSearcher()"
+    ".Search('IsInstalled=0 and IsHidden=0').Updates); "
+    "@{ pending = $updates.Count; security = @($updates | Where-Object { "
+    "$_.Categories | Where-Object { $_.CategoryID -eq '0fa1201d-4330-4fa8-8ae9-b877473b6441' } }).Count }"
+)
+
+
+class PostureProbe:
+    def __init__(self, name, func, ttl):
+        self.name = name
+        self.func = func
+        self.ttl = ttl
+
+
+def register_probe(name, ttl=0):
+    """Decorator registering ``func(processes)`` as a posture probe whose result is reused for ``ttl`` seconds"""
+    def decorator(func):
+        PROBES[name] = PostureProbe(name, func, ttl)
+        return func
+    return decorator
+
+
+_powershell = None
+_powershell_lock = threading.Lock()
+
+
+def _powershell_run(script, timeout):
+    """Run a script in the shared PowerShell host and return its JSON result, or None on failure"""
+    global _powershell
+    from src.powershell_host import PowerShellPool, PowerShellError, PowerShellHostError
+    with _powershell_lock:
+        if _powershell is None:
+            # Posture probes run one at a time, so a single warm process is enough
+            _powershell = PowerShellPool(size=1)
+    try:
+        return _powershell.run(script, timeout=timeout)
+    except (PowerShellError, PowerShellHostError) as e:
+        logger.warning(f"PowerShell posture query failed: {str(e)}")
+        return None
+
+
+def _which(name):
+    return shutil.which(name) or shutil.which(name, path=os.pathsep.join(SBIN_DIRS))
+
+
+def _run(cmd, timeout=10):
+    """Run a command and return the CompletedProcess, or None if it is missing or hangs"""
+    try:
+        return subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def _nftables_state():
+    nft = _which('nft')
+    result = _run([nft, '-j', 'list', 'ruleset']) if nft else None
+    if not result or result.returncode != 0:
+        return None
+    try:
+        items = json.loads(result.stdout).get('nftables', [])
+    except ValueError:
+        return None
+    # Only base chains on the input hook decide whether inbound traffic is filtered
+    input_chains = set()
+    drop_policy = False
+    for item in items:
+        chain = item.get('chain')
+        if chain and chain.get('hook') == 'input' and chain.get('type', 'filter') == 'filter':
+            input_chains.add((chain['family'], chain['table'], chain['name']))
+            drop_policy = drop_policy or chain.get('policy') == 'drop'
+    rules = sum(
+        1 for item in items
+        if 'rule' in item and (item['rule']['family'], item['rule']['table'], item['rule']['chain']) in input_chains
+    )
+    return {'enabled': drop_policy or rules > 0, 'backend': 'nftables', 'input_rules': rules}
+
+
+def _iptables_state():
+    for tool in ('iptables-save', 'iptables-legacy-save'):
+        path = _which(tool)
+        result = _run([path]) if path else None
+        if not result or result.returncode != 0 or not result.stdout.strip():
+            continue
+        table = None
+        rules = 0
+        drop_policy = False
+        for line in result.stdout.splitlines():
+            if line.startswith('*'):
+                table = line[1:].strip()
+            elif table == 'filter' and line.startswith(':INPUT '):
+                drop_policy = line.split()[1] in ('DROP', 'REJECT')
+            elif table == 'filter' and line.startswith('-A INPUT '):
+                rules += 1
+        return {'enabled': drop_policy or rules > 0, 'backend': 'iptables', 'input_rules': rules}
+    return None
+
+
+def _frontend_state():
+    """ufw or firewalld state, which can be read without root when the rulesets cannot"""
+    try:
+        with open('/etc/ufw/ufw.conf') as f:
+            if re.search(r'^\s*ENABLED\s*=\s*yes', f.read(), re.MULTILINE | re.IGNORECASE):
+                return {'enabled': True, 'backend': 'ufw'}
+    except OSError:
+        pass
+    firewall_cmd = _which('firewall-cmd')
+    result = _run([firewall_cmd, '--state']) if firewall_cmd else None
+    if result and result.stdout.strip() == 'running':
+        return {'enabled': True, 'backend': 'firewalld'}
+    return None
+
+
+@register_probe('firewall', ttl=0)
+def probe_firewall(processes):
+    """Whether inbound traffic is filtered by a host firewall"""
+    system = platform.system()
+    if system == 'Linux':
+        state = _nftables_state()
+        if not state or not state['enabled']:
+            # iptables-legacy rules live outside nftables
+            state = _iptables_state() or state
+        # Reading rulesets needs root; unprivileged agents fall back to the frontends
+        return state or _frontend_state() or {'enabled': None, 'backend': None}
+    if system == 'Darwin':
+        result = _run(['/usr/libexec/ApplicationFirewall/socketfilterfw', '--getglobalstate'])
+        if not result or result.returncode != 0:
+            return {'enabled': None, 'backend': None}
+        return {'enabled': 'enabled' in result.stdout.lower(), 'backend': 'application_firewall'}
+    if system == 'Windows':
+        from src.powershell_host import as_list
+        profiles = as_list(_powershell_run(
+            "Get-NetFirewallProfile | Select-Object Name, @{Name='Enabled'; Expression={[bool]$_.Enabled}}", 60
+        ))
+        if not profiles:
+            return {'enabled': None, 'backend': None}
+        return {
+            'enabled': all(profile.get('Enabled') for profile in profiles),
+            'backend': 'windows_firewall',
+            'disabled_profiles': [profile.get('Name') for profile in profiles if not profile.get('Enabled')]
+        }
+    return {'enabled': None, 'backend': None}
+
+
+@register_probe('antivirus', ttl=0)
+def probe_antivirus(processes):
+    """Antivirus and EDR agents running, found in the shared process snapshot"""
+    products = {AV_PROCESSES[name] for name in ((row.get('name') or '').lower() for row in processes)
+                if name in AV_PROCESSES}
+    return {'enabled': bool(products), 'products': sorted(products)}
+
+
+def _apt_updates():
+    # apt-check prints "<updates>;<security updates>" on stderr
+    result = _run(['/usr/lib/update-notifier/apt-check'], 120) \
+        if os.path.exists('/usr/lib/update-notifier/apt-check') else None
+    match = re.match(r'(\d+);(\d+)', result.stderr.strip()) if result and result.returncode == 0 else None
+    if match:
+        return {'manager': 'apt', 'pending': int(match.group(1)), 'security': int(match.group(2))}
+
+    apt_get = _which('apt-get')
+    # Simulated against the local package lists; refreshing them is left to the system's apt timers
+    result = _run([apt_get, '-s', '-o', 'Debug::NoLocking=1', 'dist-upgrade'], 120) if apt_get else None
+    if not result or result.returncode != 0:
+        return None
+    installs = [line for line in result.stdout.splitlines() if line.startswith('Inst ')]
+    return {
+        'manager': 'apt',
+        'pending': len(installs),
+        'security': sum(1 for line in installs if '-security' in line)
+    }
+
+
+def _rpm_updates():
+    for tool in ('dnf', 'yum'):
+        path = _which(tool)
+        # -C stays on the cached metadata instead of refreshing repositories over the network
+        result = _run([path, '-q', '-C', 'check-update'], 120) if path else None
+        if not result or result.returncode not in (0, 100):
+            continue
+        packages = []
+        for line in result.stdout.splitlines():
+            if line.startswith('Obsoleting'):
+                break
+            if len(line.split()) == 3 and not line.startswith(' '):
+                packages.append(line.split()[0])
+        security = _run([path, '-q', '-C', 'updateinfo', 'list', '--security'], 120)
+        return {
+            'manager': tool,
+            'pending': len(packages),
+            'security': len({line.split()[-1] for line in security.stdout.splitlines() if line.strip()})
+            if security and security.returncode == 0 else None
+        }
+    return None
+
+
+@register_probe('updates', ttl=3600)
+def probe_updates(processes):
+    """Pending package updates, and how many of them are security fixes"""
+    system = platform.system()
+    state = None
+    if system == 'Linux':
+        state = _apt_updates() or _rpm_updates()
+        if state:
+            state['reboot_required'] = os.path.exists('/var/run/reboot-required')
+    elif system == 'Darwin':
+        result = _run(['softwareupdate', '-l'], 300)
+        if result and result.returncode == 0:
+            labels = [line for line in result.stdout.splitlines() if line.strip().startswith('* Label:')]
+            state = {
+                'manager': 'softwareupdate',
+                'pending': len(labels),
+                'security': sum(1 for label in labels if 'security' in label.lower())
+            }
+    elif system == 'Windows':
+        result = _powershell_run(WINDOWS_UPDATE_SEARCH, 300)
+        if isinstance(result, dict) and isinstance(result.get('pending'), int):
+            state = {'manager': 'windows_update', 'pending': result['pending'], 'security': result.get('security')}
+    return state or {'manager': None, 'pending': None, 'security': None}
+
+
+class PostureChecker:
+    """Runs the registered posture probes, reusing each result until its TTL expires.
+
+    Cheap probes (TTL 0) run on every scan; expensive ones such as the
+    pending update check run at most once per TTL. ``ttl`` overrides the
+    registered TTL of individual probes by name.
+    """
+
+    def __init__(self, probes=None, ttl=None):
+        self.probes = probes if probes is not None else list(PROBES.values())
+        self.ttl = ttl or {}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def collect(self, processes=()):
+        """Return {probe name: result} for every probe"""
+        processes = list(processes)
+        results = {}
+        with self._lock:
+            now = time.monotonic()
+            for probe in self.probes:
+                cached = self._cache.get(probe.name)
+                if cached and now < cached[0]:
+                    results[probe.name] = cached[1]
+                    continue
+                try:
+                    with METRICS.timed('posture_probe', probe=probe.name):
+                        result = probe.func(processes)
+                except Exception as e:
+                    logger.warning(f"Posture probe {probe.name} failed: {str(e)}")
+                    result = {'enabled': None, 'error': str(e)}
+                self._cache[probe.name] = (now + self.ttl.get(probe.name, probe.ttl), result)
+                results[probe.name] = result
+        return results
+
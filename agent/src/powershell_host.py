@@ -0,0 +1,203 @@
+import json
+import time
+import queue
+import base64
+import threading
+import subprocess
+
+# Runs inside the long-lived PowerShell process. Each request is one line of
+# base64-encoded script; each response is one line of compressed JSON.
+HOST_LOOP = r'''
+# Redirected console streams default to the OEM code page; UTF-8 keeps non-ASCII names intact
+[Console]::InputEncoding = [Text.Encoding]::UTF8
+[Console]::OutputEncoding = [Text.Encoding]::UTF8
+$ErrorActionPreference = 'Stop'
+$ProgressPreference = 'SilentlyContinue'
+while ($true) {
+    $line = [Console]::In.ReadLine()
+    if ($line -eq $null) { break }
+    try {
+        $script = [Text.Encoding]::UTF8.GetString([Convert]::FromBase64String($line))
+        $result = Invoke-Expression $script
+        $response = @{ ok = $true; result = $result }
+    } catch {
+        $response = @{ ok = $false; error = $_.Exception.Message }
+    }
+    [Console]::Out.WriteLine(($response | ConvertTo-Json -Depth 6 -Compress))
+    [Console]::Out.Flush()
+}
+'''
+
+
+def default_command():
+    """powershell.exe running the request loop, passed as -EncodedCommand to avoid quoting issues"""
+    encoded = base64.b64encode(HOST_LOOP.encode('utf-16-le')).decode('ascii')
+    return ['powershell', '-NoLogo', '-NoProfile', '-NonInteractive', '-ExecutionPolicy', 'Bypass',
+            '-EncodedCommand', encoded]
+
+
+class PowerShellHostError(Exception):
+    """The PowerShell process died or stopped responding; it is restarted on the next call"""
+
+
+class PowerShellError(Exception):
+    """A script raised an error inside PowerShell"""
+
+
+class PowerShellHost:
+    """One long-lived PowerShell process shared by every scanner check.
+
+    Scripts are sent over stdin and their output comes back as JSON, so
+    checks parse structured values instead of locale-dependent formatted
+    text. ``command`` can point at any program speaking the same line
+    protocol, such as a stand-in shell for testing on Linux.
+    """
+
+    def __init__(self, command=None, timeout=60):
+        self.command = command or default_command()
+        self.timeout = timeout
+        self.process = None
+        self._responses = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            bufsize=1
+        )
+        self._responses = queue.Queue()
+        threading.Thread(target=self._read_output, args=(self.process.stdout, self._responses), daemon=True).start()
+
+    def _read_output(self, stream, responses):
+        try:
+            for line in stream:
+                if line.strip():
+                    responses.put(line)
+        except (OSError, ValueError):
+            pass
+        finally:
+            # Always wake a waiting run() so it restarts the process instead of hitting its timeout
+            responses.put(None)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def run(self, script, timeout=None, deadline=None, cancelled=None):
+        """Run a script and return its output converted from JSON.
+
+        ``deadline`` (a time.monotonic() value) bounds the wait for the host
+        as well as for the answer; ``cancelled`` is an Event that abandons
+        the request. Either way the process is killed, since a late answer
+        would be read as the reply to the next script.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + (timeout or self.timeout)
+        if not self._lock.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            raise PowerShellHostError("PowerShell host stayed busy until the deadline")
+        try:
+            if not self.alive():
+                self.close()
+                try:
+                    self._start()
+                except OSError as e:
+                    raise PowerShellHostError(f"Could not start PowerShell: {e}")
+
+            request = base64.b64encode(script.encode('utf-8')).decode('ascii')
+            try:
+                self.process.stdin.write(request + '\n')
+                self.process.stdin.flush()
+            except (OSError, ValueError) as e:
+                self.close()
+                raise PowerShellHostError(f"Could not write to PowerShell: {e}")
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (cancelled is not None and cancelled.is_set()):
+                    self.process.kill()
+                    self.process = None
+                    raise PowerShellHostError("PowerShell did not answer before the deadline"
+                                              if remaining <= 0 else "PowerShell request cancelled")
+                try:
+                    line = self._responses.get(timeout=min(remaining, 0.5))
+                    break
+                except queue.Empty:
+                    continue
+            if line is None:
+                self.close()
+                raise PowerShellHostError("PowerShell exited")
+        finally:
+            self._lock.release()
+
+        try:
+            response = json.loads(line)
+        except ValueError:
+            raise PowerShellError(f"Unreadable PowerShell output: {line.strip()}")
+        if not response.get('ok'):
+            raise PowerShellError(response.get('error') or 'Unknown PowerShell error')
+        return response.get('result')
+
+    def close(self):
+        """Stop the PowerShell process"""
+        if not self.process:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+        finally:
+            self.process = None
+
+
+class PowerShellPool:
+    """A fixed set of PowerShell hosts so concurrent checks do not queue behind each other.
+
+    Size it to the scanner's worker count. Hosts start on first use, so
+    unused ones cost nothing.
+    """
+
+    def __init__(self, size=4, command=None, timeout=60):
+        self.timeout = timeout
+        self.hosts = [PowerShellHost(command=command, timeout=timeout) for _ in range(max(size, 1))]
+        self._idle = queue.Queue()
+        for host in self.hosts:
+            self._idle.put(host)
+
+    def run(self, script, timeout=None, deadline=None, cancelled=None):
+        """Run a script on an idle host; see PowerShellHost.run"""
+        if deadline is None:
+            deadline = time.monotonic() + (timeout or self.timeout)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (cancelled is not None and cancelled.is_set()):
+                raise PowerShellHostError("No PowerShell host became free before the deadline"
+                                          if remaining <= 0 else "PowerShell request cancelled")
+            try:
+                host = self._idle.get(timeout=min(remaining, 0.5))
+                break
+            except queue.Empty:
+                continue
+        try:
+            return host.run(script, deadline=deadline, cancelled=cancelled)
+        finally:
+            self._idle.put(host)
+
+    def close(self):
+        """Stop every PowerShell process"""
+        for host in self.hosts:
+            host.close()
+
+
+def as_list(result):
+    """ConvertTo-Json collapses a single object to a dict and no output to null"""
+    if result is None:
+        return []
+    if isinstance(result, list):
+        return result
+    return [result]
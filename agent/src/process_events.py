@@ -0,0 +1,377 @@
+import os
+import time
+import socket
+import struct
+import logging
+import platform
+import threading
+from collections import deque
+from src.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Linux process connector (see linux/connector.h and linux/cn_proc.h)
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+PROC_CN_MCAST_LISTEN = 1
+NLMSG_DONE = 3
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSG_HEADER = struct.Struct('=IHHII')
+CN_MSG_HEADER = struct.Struct('=IIIIHH')
+PROC_EVENT_HEADER = struct.Struct('=IIQ')
+EXEC_EVENT = struct.Struct('=II')
+EXIT_EVENT = struct.Struct('=IIII')
+
+# /proc/net tables and the TCP states worth reporting (listening and established)
+SOCKET_TABLES = {
+    'tcp': ('/proc/net/tcp', socket.AF_INET),
+    'tcp6': ('/proc/net/tcp6', socket.AF_INET6),
+    'udp': ('/proc/net/udp', socket.AF_INET),
+    'udp6': ('/proc/net/udp6', socket.AF_INET6)
+}
+TCP_STATES = {'01': 'ESTABLISHED', '0A': 'LISTEN'}
+
+# osquery socket_events actions that open a local port, and the /proc state they correspond to
+OSQUERY_SOCKET_STATES = {'bind': 'BOUND', 'listen': 'LISTEN'}
+IP_PROTOCOLS = {'6': 'tcp', '17': 'udp'}
+
+
+def read_proc_process(pid):
+    """A process row shaped like ProcessSnapshot.process_rows(), read straight from /proc"""
+    base = f'/proc/{pid}'
+    row = {'pid': pid, 'name': None, 'path': None, 'cmdline': '', 'parent': None, 'uid': None}
+    try:
+        with open(f'{base}/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key == 'Name':
+                    row['name'] = value.strip()
+                elif key == 'PPid':
+                    row['parent'] = int(value)
+                elif key == 'Uid':
+                    row['uid'] = int(value.split()[0])
+                    break
+        with open(f'{base}/cmdline', 'rb') as f:
+            row['cmdline'] = f.read().replace(b'\0', b' ').decode('utf-8', 'replace').strip()
+        row['path'] = os.readlink(f'{base}/exe')
+    except (OSError, ValueError):
+        # The process may already have exited, or belong to another user
+        pass
+    return row
+
+
+def _decode_address(hex_address, family):
+    if family == socket.AF_INET:
+        packed = struct.pack('<I', int(hex_address, 16))
+    else:
+        packed = b''.join(struct.pack('<I', int(hex_address[i:i + 8], 16)) for i in range(0, 32, 8))
+    return socket.inet_ntop(family, packed)
+
+
+def read_socket_table():
+    """Listening, established and bound sockets from /proc/net, keyed by inode"""
+    sockets = {}
+    for protocol, (path, family) in SOCKET_TABLES.items():
+        try:
+            with open(path) as f:
+                next(f, None)
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 10 or fields[9] == '0':
+                        continue
+                    state = fields[3]
+                    if protocol.startswith('tcp') and state not in TCP_STATES:
+                        continue
+                    local, _, local_port = fields[1].partition(':')
+                    remote, _, remote_port = fields[2].partition(':')
+                    sockets[fields[9]] = {
+                        'protocol': protocol,
+                        'local_address': _decode_address(local, family),
+                        'local_port': int(local_port, 16),
+                        'remote_address': _decode_address(remote, family),
+                        'remote_port': int(remote_port, 16),
+                        'state': TCP_STATES.get(state, 'BOUND'),
+                        'uid': int(fields[7]),
+                        'inode': int(fields[9])
+                    }
+        except OSError:
+            continue
+    return sockets
+
+
+def socket_owners(inodes):
+    """Map socket inodes to the pid holding them by walking /proc/*/fd once"""
+    wanted = {f'socket:[{inode}]' for inode in inodes}
+    owners = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            fds = os.listdir(f'/proc/{entry}/fd')
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(f'/proc/{entry}/fd/{fd}')
+            except OSError:
+                continue
+            if target in wanted:
+                owners[int(target[8:-1])] = int(entry)
+                wanted.discard(target)
+        if not wanted:
+            break
+    return owners
+
+
+class EventBuffer:
+    """Bounded FIFO between event sources and the upload pipeline; the oldest events are dropped when full"""
+
+    def __init__(self, max_events=10000):
+        self.events = deque(maxlen=max_events)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def put(self, event):
+        with self._lock:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+                METRICS.inc('process_events_dropped_total')
+            self.events.append(event)
+        METRICS.inc('process_events_total', event=event['event'])
+
+    def drain(self):
+        with self._lock:
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+    def __len__(self):
+        return len(self.events)
+
+
+class NetlinkProcessSource:
+    """Exec and exit events pushed by the kernel through the netlink process connector (needs root)"""
+
+    name = 'netlink'
+
+    def __init__(self, emit):
+        self.emit = emit
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+        try:
+            self.sock.bind((0, CN_IDX_PROC))
+            op = struct.pack('=I', PROC_CN_MCAST_LISTEN)
+            cn_msg = CN_MSG_HEADER.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(op), 0) + op
+            self.sock.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(cn_msg), NLMSG_DONE, 0, 0, os.getpid()) + cn_msg)
+        except OSError:
+            self.sock.close()
+            raise
+        self.sock.settimeout(1.0)
+
+    def run(self, stop):
+        while not stop.is_set():
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                # ENOBUFS means the kernel dropped events because we fell behind
+                METRICS.inc('process_events_dropped_total')
+                logger.warning(f"Process connector receive error: {str(e)}")
+                continue
+            self._parse(data)
+        self.sock.close()
+
+    def _parse(self, data):
+        offset = 0
+        while offset + NLMSG_HEADER.size <= len(data):
+            length = NLMSG_HEADER.unpack_from(data, offset)[0]
+            if length < NLMSG_HEADER.size:
+                break
+            event_offset = offset + NLMSG_HEADER.size + CN_MSG_HEADER.size
+            what, _, _ = PROC_EVENT_HEADER.unpack_from(data, event_offset)
+            payload = event_offset + PROC_EVENT_HEADER.size
+            if what == PROC_EVENT_EXEC:
+                pid, tgid = EXEC_EVENT.unpack_from(data, payload)
+                if pid == tgid:
+                    event = read_proc_process(pid)
+                    event.update(event='exec', time=time.time())
+                    self.emit(event)
+            elif what == PROC_EVENT_EXIT:
+                pid, tgid, exit_code, _ = EXIT_EVENT.unpack_from(data, payload)
+                if pid == tgid:
+                    self.emit({'event': 'exit', 'time': time.time(), 'pid': pid, 'exit_code': exit_code >> 8})
+            offset += (length + 3) & ~3
+
+
+class ProcPollSource:
+    """Fallback that diffs the /proc pid list; only sees processes living longer than ``interval``"""
+
+    name = 'proc'
+
+    def __init__(self, emit, interval=1.0):
+        self.emit = emit
+        self.interval = interval
+        self.known = {}
+
+    def _pids(self):
+        return {int(entry) for entry in os.listdir('/proc') if entry.isdigit()}
+
+    def poll(self):
+        pids = self._pids()
+        now = time.time()
+        for pid in pids - self.known.keys():
+            event = read_proc_process(pid)
+            self.known[pid] = event['name']
+            event.update(event='exec', time=now)
+            self.emit(event)
+        for pid in self.known.keys() - pids:
+            self.emit({'event': 'exit', 'time': now, 'pid': pid, 'name': self.known.pop(pid)})
+
+    def run(self, stop):
+        # Processes already running at start-up are covered by the regular inventory
+        self.known = {pid: None for pid in self._pids()}
+        while not stop.wait(self.interval):
+            self.poll()
+
+
+class SocketPollSource:
+    """Socket open/close events from diffing /proc/net; owners are resolved for new listeners only"""
+
+    name = 'socket'
+
+    def __init__(self, emit, interval=5.0):
+        self.emit = emit
+        self.interval = interval
+        self.known = {}
+
+    def poll(self):
+        current = read_socket_table()
+        now = time.time()
+        opened = [current[inode] for inode in current.keys() - self.known.keys()]
+        listeners = [sock['inode'] for sock in opened if sock['state'] != 'ESTABLISHED']
+        owners = socket_owners(listeners) if listeners else {}
+        for sock in opened:
+            self.emit(dict(sock, event='socket_open', time=now, pid=owners.get(sock['inode'])))
+        for inode in self.known.keys() - current.keys():
+            self.emit(dict(self.known[inode], event='socket_close', time=now))
+        self.known = current
+
+    def run(self, stop):
+        self.known = read_socket_table()
+        while not stop.wait(self.interval):
+            self.poll()
+
+
+class OSQueryEventSource:
+    """Reads osquery's evented process_events and socket_events tables.
+
+    Needs an osqueryd with events enabled (--disable_events=false and the
+    audit subsystem on Linux), normally reached through its extension socket.
+    """
+
+    name = 'osquery'
+
+    QUERIES = {
+        'exec': 'SELECT pid, parent, path, cmdline, uid, time FROM process_events WHERE time > {since};',
+        'socket': ('SELECT pid, path, action, protocol, local_address, local_port, remote_address, remote_port, time '
+                   'FROM socket_events WHERE time > {since};')
+    }
+
+    def __init__(self, emit, osquery, interval=5.0):
+        self.emit = emit
+        self.osquery = osquery
+        self.interval = interval
+        self.since = {kind: int(time.time()) for kind in self.QUERIES}
+
+    def poll(self):
+        for kind, query in self.QUERIES.items():
+            rows = self.osquery.run_query(query.format(since=self.since[kind]))
+            for row in rows or []:
+                event_time = int(row.get('time') or 0)
+                self.since[kind] = max(self.since[kind], event_time)
+                if kind == 'exec':
+                    self.emit({
+                        'event': 'exec',
+                        'time': event_time,
+                        'pid': int(row.get('pid') or 0),
+                        'name': os.path.basename(row.get('path') or ''),
+                        'path': row.get('path'),
+                        'cmdline': row.get('cmdline', ''),
+                        'parent': int(row.get('parent') or 0),
+                        'uid': int(row.get('uid') or 0)
+                    })
+                elif row.get('action') in OSQUERY_SOCKET_STATES and str(row.get('local_port') or '0') != '0':
+                    # Shaped like the /proc socket_open events, so the listening rules see them too
+                    self.emit(dict(
+                        row,
+                        event='socket_open',
+                        time=event_time,
+                        pid=int(row.get('pid') or 0),
+                        protocol=IP_PROTOCOLS.get(str(row.get('protocol')), row.get('protocol')),
+                        local_port=int(row['local_port']),
+                        remote_port=int(row.get('remote_port') or 0),
+                        state=OSQUERY_SOCKET_STATES[row['action']]
+                    ))
+                else:
+                    self.emit(dict(row, event='socket_' + (row.get('action') or 'event'), time=event_time))
+
+    def run(self, stop):
+        while not stop.wait(self.interval):
+            self.poll()
+
+
+class ProcessEventMonitor:
+    """Streams process exec/exit and socket events into a bounded buffer.
+
+    ``source`` picks how processes are observed: the netlink process
+    connector, a /proc poll, osquery's evented tables, or ``auto`` to use
+    netlink when permitted and fall back to polling /proc. Socket events
+    come from /proc/net except in osquery mode.
+    """
+
+    def __init__(self, source='auto', max_events=10000, poll_interval=1.0, socket_interval=5.0, osquery=None):
+        self.source = source
+        self.poll_interval = poll_interval
+        self.socket_interval = socket_interval
+        self.osquery = osquery
+        self.buffer = EventBuffer(max_events)
+        self.sources = []
+        self._stop = threading.Event()
+
+    def _process_source(self):
+        emit = self.buffer.put
+        if self.source == 'osquery':
+            return OSQueryEventSource(emit, self.osquery, self.socket_interval)
+        if self.source in ('auto', 'netlink'):
+            try:
+                return NetlinkProcessSource(emit)
+            except OSError as e:
+                if self.source == 'netlink':
+                    raise
+                logger.info(f"Process connector unavailable ({str(e)}), polling /proc instead")
+        return ProcPollSource(emit, self.poll_interval)
+
+    def start(self):
+        if self.source == 'off':
+            return self
+        if platform.system() != 'Linux' and self.source != 'osquery':
+            logger.info("Event-driven process monitoring is only available on Linux")
+            return self
+
+        self.sources = [self._process_source()]
+        if self.source != 'osquery':
+            self.sources.append(SocketPollSource(self.buffer.put, self.socket_interval))
+        for source in self.sources:
+            threading.Thread(target=source.run, args=(self._stop,), name=f'events-{source.name}', daemon=True).start()
+        logger.info(f"Process events from: {', '.join(source.name for source in self.sources)}")
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def drain(self):
+        """Every event buffered since the previous call"""
+        return self.buffer.drain()
@@ -0,0 +1,128 @@
+import time
+import socket
+import logging
+import threading
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# Only the attributes some collector actually reads; psutil fetches them under oneshot()
+PROCESS_ATTRS = ['pid', 'name', 'exe', 'cmdline', 'ppid', 'status', 'create_time']
+if hasattr(psutil.Process, 'uids'):
+    PROCESS_ATTRS.append('uids')
+
+PROTOCOLS = {
+    socket.SOCK_STREAM: 'tcp',
+    socket.SOCK_DGRAM: 'udp'
+}
+
+
+class ProcessSnapshot:
+    """One walk of the process and socket tables, indexed for every collector"""
+
+    def __init__(self, processes, connections, taken_at=None):
+        self.processes = processes
+        self.connections = connections
+        self.taken_at = taken_at or time.time()
+
+        self.by_pid = {}
+        self.by_exe = {}
+        for proc in processes:
+            self.by_pid[proc['pid']] = proc
+            if proc['exe']:
+                self.by_exe.setdefault(proc['exe'], []).append(proc)
+
+        self.by_port = {}
+        for conn in connections:
+            if conn['status'] == psutil.CONN_LISTEN or conn['protocol'] == 'udp':
+                self.by_port.setdefault(conn['port'], []).append(conn)
+
+    def to_dict(self):
+        """JSON-serializable form, for saving a snapshot to reprocess later"""
+        return {'taken_at': self.taken_at, 'processes': self.processes, 'connections': self.connections}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('processes', []), data.get('connections', []), taken_at=data.get('taken_at'))
+
+    def listening(self):
+        """Listening TCP sockets and bound UDP sockets"""
+        return [conn for conns in self.by_port.values() for conn in conns]
+
+    def process_rows(self):
+        """Process rows shaped like osquery's processes table"""
+        return [
+            {
+                'pid': proc['pid'],
+                'name': proc['name'],
+                'path': proc['exe'],
+                'cmdline': ' '.join(proc['cmdline'] or []),
+                'state': proc['status'],
+                'parent': proc['ppid'],
+                'uid': proc['uid'],
+                'start_time': int(proc['create_time']) if proc['create_time'] else None
+            }
+            for proc in self.processes
+        ]
+
+    def listening_rows(self):
+        """Rows shaped like the processes/listening_ports join in the query pack"""
+        rows = []
+        for conn in self.listening():
+            proc = self.by_pid.get(conn['pid'])
+            if not proc:
+                continue
+            rows.append({
+                'name': proc['name'],
+                'path': proc['exe'],
+                'port': conn['port'],
+                'address': conn['address'],
+                'protocol': conn['protocol']
+            })
+        return rows
+
+
+def take_snapshot():
+    """Walk the process and socket tables once"""
+    processes = []
+    for proc in psutil.process_iter(PROCESS_ATTRS):
+        try:
+            info = proc.info
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            continue
+        uids = info.pop('uids', None)
+        info['uid'] = uids.real if uids else None
+        processes.append(info)
+
+    connections = []
+    try:
+        for conn in psutil.net_connections(kind='inet'):
+            if not conn.laddr:
+                continue
+            connections.append({
+                'pid': conn.pid,
+                'address': conn.laddr.ip,
+                'port': conn.laddr.port,
+                'status': conn.status,
+                'protocol': PROTOCOLS.get(conn.type, str(conn.type))
+            })
+    except psutil.AccessDenied:
+        logger.warning("Not permitted to list network connections")
+
+    return ProcessSnapshot(processes, connections)
+
+
+class SnapshotCache:
+    """Shares one snapshot between collectors that run close together"""
+
+    def __init__(self, max_age=30, snapshot=None):
+        self.max_age = max_age
+        self._snapshot = snapshot
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the cached snapshot, taking a new one if it is older than max_age"""
+        with self._lock:
+            if self._snapshot is None or time.time() - self._snapshot.taken_at > self.max_age:
+                self._snapshot = take_snapshot()
+            return self._snapshot
@@ -0,0 +1,116 @@
+import math
+import time
+import threading
+from collections import deque
+import psutil
+
+
+def summarize(values):
+    """min/avg/max/p95 of a series of samples"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    p95_index = max(math.ceil(0.95 * len(ordered)) - 1, 0)
+    return {
+        'min': round(ordered[0], 2),
+        'avg': round(sum(ordered) / len(ordered), 2),
+        'max': round(ordered[-1], 2),
+        'p95': round(ordered[p95_index], 2)
+    }
+
+
+class ResourceSampler:
+    """Samples host utilisation in the background so readers never block.
+
+    CPU (aggregate and per core), memory, disk I/O and network I/O are
+    recorded every ``resolution`` seconds and kept for ``window`` seconds.
+    """
+
+    def __init__(self, resolution=5, window=60):
+        self.resolution = resolution
+        self.window = window
+        self.samples = deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_disk = None
+        self._last_net = None
+        self._last_time = None
+
+    def start(self):
+        # Prime the counters; psutil reports CPU usage since the previous call
+        psutil.cpu_percent(interval=None, percpu=True)
+        self._last_disk = psutil.disk_io_counters()
+        self._last_net = psutil.net_io_counters()
+        self._last_time = time.monotonic()
+
+        self._thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.resolution):
+            self.sample()
+
+    def _rate(self, current, previous, field, elapsed):
+        if current is None or previous is None or elapsed <= 0:
+            return 0.0
+        return max(getattr(current, field) - getattr(previous, field), 0) / elapsed
+
+    def sample(self):
+        """Record one sample of every counter"""
+        now = time.monotonic()
+        per_core = psutil.cpu_percent(interval=None, percpu=True)
+        disk = psutil.disk_io_counters()
+        net = psutil.net_io_counters()
+        elapsed = now - self._last_time
+
+        sample = {
+            'time': now,
+            'cpu': sum(per_core) / len(per_core) if per_core else 0.0,
+            'cpu_per_core': per_core,
+            'memory_percent': psutil.virtual_memory().percent,
+            'disk_read_bps': self._rate(disk, self._last_disk, 'read_bytes', elapsed),
+            'disk_write_bps': self._rate(disk, self._last_disk, 'write_bytes', elapsed),
+            'net_sent_bps': self._rate(net, self._last_net, 'bytes_sent', elapsed),
+            'net_recv_bps': self._rate(net, self._last_net, 'bytes_recv', elapsed)
+        }
+        self._last_disk = disk
+        self._last_net = net
+        self._last_time = now
+
+        with self._lock:
+            self.samples.append(sample)
+            while self.samples and now - self.samples[0]['time'] > self.window:
+                self.samples.popleft()
+
+    def recent(self, field, seconds):
+        """Average of one field over the last ``seconds``, or None before the first sample"""
+        cutoff = time.monotonic() - seconds
+        with self._lock:
+            values = [s[field] for s in self.samples if s['time'] >= cutoff]
+        if not values:
+            return None
+        return sum(values) / len(values)
+
+    def summary(self):
+        """Statistics over the samples in the current window"""
+        with self._lock:
+            samples = list(self.samples)
+        if not samples:
+            return None
+
+        cores = len(samples[-1]['cpu_per_core'])
+        result = {
+            'samples': len(samples),
+            'cpu_per_core': [
+                summarize([s['cpu_per_core'][core] for s in samples if len(s['cpu_per_core']) > core])
+                for core in range(cores)
+            ]
+        }
+        for field in ('cpu', 'memory_percent', 'disk_read_bps', 'disk_write_bps', 'net_sent_bps', 'net_recv_bps'):
+            result[field] = summarize([s[field] for s in samples])
+        return result
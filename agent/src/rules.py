@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import fnmatch
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), 'detection_rules.json')
+
+STRING_OPS = ('contains', 'glob', 'regex')
+SET_OPS = ('in', 'equals')
+
+
+def _string_pattern(op, values):
+    if op == 'contains':
+        parts = [re.escape(str(v)) for v in values]
+    else:
+        # fnmatch.translate anchors at the end; the combined matcher uses search(), so anchor the start too
+        parts = ['^' + fnmatch.translate(str(v)) for v in values]
+    return '|'.join(f'(?:{part})' for part in parts)
+
+
+class Condition:
+    """One compiled test of a row field"""
+
+    def __init__(self, spec):
+        self.field = spec['field']
+        self.op = spec['op']
+        self.negate = spec.get('not', False)
+        value = spec.get('value')
+
+        if self.op in STRING_OPS:
+            flags = 0 if spec.get('case_sensitive') else re.IGNORECASE
+            values = value if isinstance(value, list) else [value]
+            if self.op == 'regex':
+                # User patterns may carry inline flags or group references, so they are never joined
+                self.pattern = None
+                self.regexes = [re.compile(str(v), flags) for v in values]
+            else:
+                self.pattern = _string_pattern(self.op, values)
+                self.regexes = [re.compile(self.pattern, flags)]
+        elif self.op in SET_OPS:
+            values = value if isinstance(value, list) else [value]
+            self.values = {str(v) for v in values}
+        elif self.op == 'range':
+            self.low, self.high = value
+        else:
+            raise ValueError(f"Unknown condition operator: {self.op}")
+
+    def test(self, value):
+        if value is None:
+            result = False
+        elif self.op in STRING_OPS:
+            value = str(value)
+            result = any(regex.search(value) for regex in self.regexes)
+        elif self.op in SET_OPS:
+            result = str(value) in self.values
+        else:
+            try:
+                result = self.low <= float(value) <= self.high
+            except (TypeError, ValueError):
+                result = False
+        return not result if self.negate else result
+
+
+class Rule:
+    def __init__(self, spec):
+        self.id = spec['id']
+        self.source = spec['source']
+        self.type = spec.get('type', spec['id'])
+        self.severity = spec.get('severity', 'medium')
+        self.description = spec.get('description', self.id)
+        self.details = spec.get('details')
+        self.conditions = [Condition(condition) for condition in spec.get('conditions', [])]
+
+    def finding(self, row):
+        details = {field: row.get(field) for field in self.details} if self.details else dict(row)
+        try:
+            description = self.description.format(**row)
+        except (KeyError, IndexError, ValueError):
+            description = self.description
+        return {
+            'type': self.type,
+            'severity': self.severity,
+            'description': description,
+            'details': details,
+            'rule': self.id
+        }
+
+
+class _SourceMatcher:
+    """Every rule for one row source, indexed so a row only pays for rules that might match.
+
+    Each rule is anchored on one condition:
+    - ``in``/``equals`` conditions go into a hash index from value to rules;
+    - ``contains``/``glob`` conditions are merged into one regex per field,
+      and that field's rules are only evaluated when the merged regex hits;
+    - ``regex`` conditions are user patterns whose inline flags and group
+      references do not survive being joined, so each is tested on its own;
+    - rules with only range conditions are always evaluated.
+    """
+
+    def __init__(self, rules):
+        self.set_index = {}
+        # [(field, compiled pattern, rules evaluated when it matches)]
+        self.prefilters = []
+        self.unindexed = []
+
+        literals = {}
+        for rule in rules:
+            anchor = next((c for c in rule.conditions if c.op in SET_OPS and not c.negate), None)
+            if anchor:
+                index = self.set_index.setdefault(anchor.field, {})
+                for value in anchor.values:
+                    index.setdefault(value, []).append(rule)
+                continue
+            anchor = next((c for c in rule.conditions if c.op in STRING_OPS and not c.negate), None)
+            if anchor and anchor.op == 'regex':
+                self.prefilters.extend((anchor.field, regex, [rule]) for regex in anchor.regexes)
+            elif anchor:
+                literals.setdefault(anchor.field, []).append((anchor, rule))
+            else:
+                self.unindexed.append(rule)
+
+        # Case-insensitive superset of every literal pattern on the field; a miss rules them all out
+        for field, anchored in literals.items():
+            try:
+                prefilter = re.compile('|'.join(f'(?:{anchor.pattern})' for anchor, _ in anchored), re.IGNORECASE)
+            except re.error:
+                # Older fnmatch translations use named groups that clash when joined
+                self.prefilters.extend((field, anchor.regexes[0], [rule]) for anchor, rule in anchored)
+                continue
+            self.prefilters.append((field, prefilter, [rule for _, rule in anchored]))
+
+    def candidates(self, row, resolve):
+        candidates = list(self.unindexed)
+        for field, index in self.set_index.items():
+            value = resolve(row, field)
+            if value is not None:
+                candidates.extend(index.get(str(value), ()))
+        values = {}
+        for field, prefilter, rules in self.prefilters:
+            if field not in values:
+                value = resolve(row, field)
+                values[field] = None if value is None else str(value)
+            if values[field] is not None and prefilter.search(values[field]):
+                candidates.extend(rules)
+        return candidates
+
+
+class RuleEngine:
+    """Declarative detections evaluated over rows as they are collected.
+
+    Rules are grouped by source ("process", "listening" or an osquery pack
+    query name). Condition fields are row keys; "parent.<key>" and
+    "process.<key>" look up the parent process or owning process through
+    the ``processes`` mapping passed to evaluate().
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        by_source = {}
+        for rule in rules:
+            by_source.setdefault(rule.source, []).append(rule)
+        self.matchers = {source: _SourceMatcher(source_rules) for source, source_rules in by_source.items()}
+
+    @classmethod
+    def load(cls, path=DEFAULT_RULES_PATH):
+        with open(path) as f:
+            specs = json.load(f).get('rules', [])
+        rules = []
+        for spec in specs:
+            if not spec.get('enabled', True):
+                continue
+            try:
+                rules.append(Rule(spec))
+            except (KeyError, ValueError, re.error) as e:
+                logger.error(f"Skipping invalid rule {spec.get('id')}: {str(e)}")
+        return cls(rules)
+
+    def evaluate(self, source, rows, processes=None):
+        """Yield findings for a stream of rows from one source"""
+        matcher = self.matchers.get(source)
+        if not matcher:
+            return
+        processes = processes or {}
+
+        def resolve(row, field):
+            if field.startswith('parent.'):
+                parent = processes.get(row.get('parent'))
+                return parent.get(field[7:]) if parent else None
+            if field.startswith('process.'):
+                owner = processes.get(row.get('pid'))
+                return owner.get(field[8:]) if owner else None
+            return row.get(field)
+
+        for row in rows:
+            seen = set()
+            for rule in matcher.candidates(row, resolve):
+                if rule.id in seen:
+                    continue
+                seen.add(rule.id)
+                if all(condition.test(resolve(row, condition.field)) for condition in rule.conditions):
+                    yield rule.finding(row)
+
+
+_default_engine = None
+
+
+def default_engine():
+    """The bundled rule set, loaded on first use"""
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = RuleEngine.load()
+    return _default_engine
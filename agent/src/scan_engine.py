@@ -0,0 +1,110 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Registry of scanner checks: name -> ScanCheck
+CHECKS = {}
+
+
+class CheckCancelled(Exception):
+    """Raised inside a check once its timeout has passed or the scan was cancelled"""
+
+
+class ScanCheck:
+    def __init__(self, name, func, timeout):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+
+
+def register_check(name, timeout=60):
+    """Decorator registering ``func(scanner, context)`` as an independent scan check"""
+    def decorator(func):
+        CHECKS[name] = ScanCheck(name, func, timeout)
+        return func
+    return decorator
+
+
+class CheckContext:
+    """Per-check state handed to a check: scan metadata, its deadline and cancellation"""
+
+    def __init__(self, hostname, scan_time, timeout):
+        self.hostname = hostname
+        self.scan_time = scan_time
+        self.timeout = timeout
+        self.deadline = None
+        self.cancelled = threading.Event()
+
+    def start(self):
+        # The timeout counts from when a worker picks the check up, not from when it was queued
+        self.deadline = time.monotonic() + self.timeout
+
+    def expired(self, now=None):
+        return self.deadline is not None and (now or time.monotonic()) >= self.deadline
+
+    def remaining(self):
+        if self.deadline is None:
+            return self.timeout
+        return max(self.deadline - time.monotonic(), 0)
+
+    def check_cancelled(self):
+        if self.cancelled.is_set() or self.remaining() <= 0:
+            raise CheckCancelled()
+
+
+def run_checks(scanner, hostname, scan_time, checks=None, max_workers=4):
+    """Run checks concurrently on a bounded pool and collect their vulnerabilities.
+
+    Each check gets its own timeout. A check that overruns is cancelled and
+    reported in ``errors``; the scan does not wait for it.
+    """
+    checks = checks if checks is not None else list(CHECKS.values())
+    vulnerabilities = []
+    errors = {}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scan-check')
+    pending = {}
+    for check in checks:
+        context = CheckContext(hostname, scan_time, check.timeout)
+        future = executor.submit(_run_check, check, scanner, context)
+        pending[future] = (check, context)
+
+    try:
+        while pending:
+            # Wake for the nearest deadline, or shortly to notice checks leaving the queue
+            wait_time = min([context.remaining() for _, context in pending.values() if context.deadline] + [0.5])
+            done, _ = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                check, _ = pending.pop(future)
+                try:
+                    vulnerabilities.extend(future.result() or [])
+                except CheckCancelled:
+                    errors[check.name] = f"timed out after {check.timeout}s"
+                except Exception as e:
+                    errors[check.name] = str(e)
+
+            now = time.monotonic()
+            for future, (check, context) in list(pending.items()):
+                if context.expired(now):
+                    context.cancelled.set()
+                    future.cancel()
+                    pending.pop(future)
+                    errors[check.name] = f"timed out after {check.timeout}s"
+                    METRICS.inc('scan_check_timeouts_total', check=check.name)
+                    logger.warning(f"Scan check {check.name} timed out after {check.timeout}s")
+    finally:
+        # Do not block on cancelled checks that are still unwinding
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return vulnerabilities, errors
+
+
+def _run_check(check, scanner, context):
+    context.start()
+    with METRICS.timed('scan_check', check=check.name):
+        return check.func(scanner, context)
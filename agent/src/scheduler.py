@@ -0,0 +1,123 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Collector priorities; under load the lowest are shed first (see governor)
+PRIORITY_HIGH = 'high'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_LOW = 'low'
+
+
+class ScheduledJob:
+    """A collector that runs on a fixed-rate clock"""
+
+    def __init__(self, name, func, interval, deadline=None, jitter=0, priority=PRIORITY_NORMAL):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.priority = priority
+        self.deadline = deadline or interval
+        self.jitter = jitter
+        self.next_run = time.monotonic()
+        self.future = None
+        self.started_at = None
+        self.overrun_reported = False
+
+    def advance(self, now, stretch=1):
+        """Move to the next tick of the fixed-rate clock, skipping ticks that were missed"""
+        interval = self.interval * stretch
+        self.next_run += interval
+        if self.next_run <= now:
+            missed = int((now - self.next_run) // interval) + 1
+            self.next_run += missed * interval
+            logger.warning(f"Collector {self.name} missed {missed} tick(s)")
+
+    def due_at(self):
+        if self.jitter:
+            return self.next_run + random.uniform(0, self.jitter)
+        return self.next_run
+
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+
+class CollectionScheduler:
+    """Runs collectors concurrently on independent fixed-rate clocks.
+
+    Each job runs in its own worker so a slow collector or upload never delays
+    the others. Ticks are computed from the original start time, so the period
+    does not drift with how long a run takes. With a ``governor``, intervals
+    of all but high priority jobs stretch and low priority jobs are shed
+    while the host is busy.
+    """
+
+    def __init__(self, max_workers=None, governor=None):
+        self.jobs = []
+        self.max_workers = max_workers
+        self.governor = governor
+        self.executor = None
+        self._stop = threading.Event()
+
+    def add_job(self, name, func, interval, deadline=None, jitter=0, delay=0, priority=PRIORITY_NORMAL):
+        """Register a collector to run every ``interval`` seconds"""
+        job = ScheduledJob(name, func, interval, deadline=deadline, jitter=jitter, priority=priority)
+        job.next_run += delay
+        self.jobs.append(job)
+        return job
+
+    def _run_job(self, job):
+        try:
+            with METRICS.timed('collector', collector=job.name):
+                job.func()
+        except Exception as e:
+            logger.error(f"Collector {job.name} failed: {str(e)}")
+
+    def _check_deadline(self, job, now):
+        if job.running() and not job.overrun_reported and now - job.started_at > job.deadline:
+            logger.warning(f"Collector {job.name} exceeded its {job.deadline}s deadline")
+            METRICS.inc('collector_deadline_exceeded_total', collector=job.name)
+            job.overrun_reported = True
+
+    def _dispatch(self, job, now):
+        governor = self.governor
+        if governor and governor.should_skip(job.priority):
+            logger.debug(f"Host is busy, shedding collector {job.name} this tick")
+            METRICS.inc('collector_shed_total', collector=job.name)
+        elif job.running():
+            logger.warning(f"Collector {job.name} is still running, skipping this tick")
+            METRICS.inc('collector_skipped_total', collector=job.name)
+        else:
+            job.started_at = now
+            job.overrun_reported = False
+            job.future = self.executor.submit(self._run_job, job)
+        stretch = governor.stretch if governor and job.priority != PRIORITY_HIGH else 1
+        job.advance(now, stretch)
+
+    def run(self):
+        """Run the scheduler until stop() is called"""
+        # By default every job gets its own worker so none waits for a free thread
+        workers = self.max_workers or max(len(self.jobs), 1)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='collector')
+        due = {id(job): job.due_at() for job in self.jobs}
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                for job in self.jobs:
+                    self._check_deadline(job, now)
+                    if due[id(job)] <= now:
+                        self._dispatch(job, now)
+                        due[id(job)] = job.due_at()
+
+                next_due = min(due.values(), default=now + 1)
+                # Wake at least once a second to check deadlines
+                self._stop.wait(min(max(next_due - time.monotonic(), 0), 1))
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stop(self):
+        self._stop.set()
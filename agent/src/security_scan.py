@@ -4,81 +4,78 @@ import psutil
 import socket
 import logging
 from datetime import datetime
+from src.process_snapshot import take_snapshot
+from src.rules import default_engine
 
-def check_open_ports():
+def check_open_ports(snapshot):
     """Check for open network ports"""
     open_ports = []
-    for conn in psutil.net_connections(kind='inet'):
-        if conn.status == 'LISTEN':
+    for conn in snapshot.listening():
+        if conn['status'] == psutil.CONN_LISTEN:
             open_ports.append({
-                'port': conn.laddr.port,
-                'address': conn.laddr.ip,
-                'pid': conn.pid
+                'port': conn['port'],
+                'address': conn['address'],
+                'pid': conn['pid']
             })
     return open_ports
 
-def check_running_processes():
-    """Check for potentially suspicious processes"""
-    suspicious = []
-    for proc in psutil.process_iter(['pid', 'name', 'exe', 'cmdline']):
-        try:
-            pinfo = proc.info
-            # Check if process is running from temp directory
-            if pinfo['exe'] and ('temp' in pinfo['exe'].lower() or 'tmp' in pinfo['exe'].lower()):
-                suspicious.append({
-                    'pid': pinfo['pid'],
-                    'name': pinfo['name'],
-                    'path': pinfo['exe'],
-                    'cmdline': ' '.join(pinfo['cmdline'] or [])
-                })
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass
-    return suspicious
+def check_running_processes(engine, processes):
+    """Check for potentially suspicious processes with the process detection rules"""
+    return list(engine.evaluate('process', processes.values(), processes))
 
-def check_system_integrity():
-    """Check system integrity and security settings"""
+def check_system_integrity(file_changes=None, posture=None):
+    """Check system integrity and security settings; None means the state could not be determined"""
+    posture = posture or {}
+    pending = (posture.get('updates') or {}).get('pending')
     integrity_checks = {
-        'firewall_enabled': True,  # Placeholder - implement actual check
-        'antivirus_running': True,  # Placeholder - implement actual check
-        'updates_pending': False,   # Placeholder - implement actual check
-        'system_modified': False    # Placeholder - implement actual check
+        'firewall_enabled': (posture.get('firewall') or {}).get('enabled'),
+        'antivirus_running': (posture.get('antivirus') or {}).get('enabled'),
+        'updates_pending': pending > 0 if pending is not None else None,
+        'system_modified': bool(file_changes)
     }
     return integrity_checks
 
-def run_security_scan():
-    """Run a complete security scan"""
+def check_vulnerabilities(inventory, matcher, hostname, timestamp):
+    """Match installed packages against the local advisory index"""
+    if not inventory or not matcher:
+        return []
+    # The inventory cache means only new or changed packages are matched
+    _, _, _, findings = inventory.refresh(
+        lambda item: matcher.match_package(item, hostname, timestamp)
+    )
+    return findings
+
+def run_security_scan(snapshot=None, inventory=None, matcher=None, rules=None, file_integrity=None, posture=None):
+    """Run a complete security scan.
+
+    Host posture probes (firewall, antivirus, pending updates) only run when a
+    PostureChecker is passed, since they describe the machine the agent runs on.
+    """
     try:
+        snapshot = snapshot or take_snapshot()
+        engine = rules or default_engine()
+        processes = {row['pid']: row for row in snapshot.process_rows()}
+        process_findings = check_running_processes(engine, processes)
+        file_changes = file_integrity.check() if file_integrity else None
+        posture_results = posture.collect(processes.values()) if posture else {}
+        timestamp = datetime.utcnow().isoformat()
+        hostname = socket.gethostname()
         scan_results = {
-            'timestamp': datetime.utcnow().isoformat(),
-            'hostname': socket.gethostname(),
+            'timestamp': timestamp,
+            'hostname': hostname,
             'os': platform.system() + ' ' + platform.release(),
-            'open_ports': check_open_ports(),
-            'suspicious_processes': check_running_processes(),
-            'system_integrity': check_system_integrity(),
-            'vulnerabilities': []  # Placeholder for actual vulnerability scan
+            'open_ports': check_open_ports(snapshot),
+            'suspicious_processes': [f['details'] for f in process_findings if f['type'] == 'suspicious_process'],
+            'system_integrity': check_system_integrity(file_changes, posture_results),
+            'posture': posture_results,
+            'vulnerabilities': check_vulnerabilities(inventory, matcher, hostname, timestamp)
         }
 
-        # Generate findings based on scan results
-        findings = []
-        
-        # Check open ports
-        for port in scan_results['open_ports']:
-            if port['port'] > 49152:  # Check for high ports
-                findings.append({
-                    'type': 'open_port',
-                    'severity': 'medium',
-                    'description': f"High port {port['port']} open on {port['address']}",
-                    'details': port
-                })
-
-        # Check suspicious processes
-        for proc in scan_results['suspicious_processes']:
-            findings.append({
-                'type': 'suspicious_process',
-                'severity': 'high',
-                'description': f"Suspicious process running from {proc['path']}",
-                'details': proc
-            })
+        # Generate findings by running the detection rules over each row source
+        findings = list(engine.evaluate('listening', scan_results['open_ports'], processes))
+        findings.extend(process_findings)
+        findings.extend(engine.evaluate('file', file_changes or []))
+        findings.extend(engine.evaluate('posture', [dict(result, probe=name) for name, result in posture_results.items()]))
 
         # Add findings to scan results
         scan_results['findings'] = findings
@@ -1,23 +1,32 @@
-import subprocess
 import json
 import platform
 import socket
 import os
-import requests
 from datetime import datetime
-import wmi
 from dotenv import load_dotenv
 import jwt
+from src.transport import get_transport
+from src.scan_engine import register_check, run_checks, CHECKS
+from src.powershell_host import PowerShellPool, as_list
+from src.software_inventory import SoftwareInventory
+from src.vuln_matcher import VulnerabilityMatcher, DEFAULT_FEED_PATH
 
 # Load environment variables
 load_dotenv()
 
 class SecurityScanner:
-    def __init__(self, api_url: str = None):
+    def __init__(self, api_url: str = None, powershell_command: list = None, advisory_feed: str = None,
+                 powershell_workers: int = 4):
         self.api_url = api_url or os.getenv('API_URL', 'http://localhost:3000')
+        # Long-lived PowerShell processes instead of a cold start per check; one per scan
+        # worker so concurrent checks never wait on each other
+        self.powershell = PowerShellPool(size=powershell_workers, command=powershell_command)
+        # Read from the uninstall registry keys; Win32_Product is slow and triggers MSI repairs
+        self.software = SoftwareInventory()
+        feed = advisory_feed or DEFAULT_FEED_PATH
+        self.matcher = VulnerabilityMatcher.load(feed) if os.path.exists(feed) else None
         self.agent_id = os.getenv('AGENT_ID', 'windows-agent-1')
         self.agent_secret = os.getenv('AGENT_SECRET', 'default-secret')
-        self.wmi = wmi.WMI()
         
     def get_auth_token(self) -> str:
         """Generate JWT token for API authentication."""
@@ -31,157 +40,27 @@ class SecurityScanner:
             algorithm='HS256'
         )
         
-    def scan_system(self) -> dict:
+    def scan_system(self, checks=None, max_workers=4) -> dict:
         """Perform a comprehensive system scan"""
-        vulnerabilities = []
         hostname = socket.gethostname()
         scan_time = datetime.now().isoformat()
         
-        # Check Windows Defender status
-        try:
-            defender_status = subprocess.run(
-                ["powershell", "Get-MpComputerStatus"],
-                capture_output=True,
-                text=True
-            )
-            if "RealTimeProtectionEnabled : False" in defender_status.stdout:
-                vulnerabilities.append({
-                    "title": "Windows Defender Disabled",
-                    "description": "Real-time protection is disabled in Windows Defender",
-                    "severity": "critical",
-                    "cvss_score": 9.0,
-                    "status": "open",
-                    "asset_id": hostname,
-                    "asset_type": "windows_host",
-                    "detection_time": scan_time,
-                    "last_seen": scan_time,
-                    "remediation": "Enable Windows Defender real-time protection",
-                    "references": [],
-                    "scan_source": "windows_security_scan",
-                    "affected_component": "Windows Defender",
-                    "affected_versions": ["current"],
-                    "tags": ["antivirus", "windows_defender"]
-                })
-        except Exception as e:
-            print(f"Error checking Windows Defender: {e}")
-
-        # Check Windows Firewall
-        try:
-            firewall_status = subprocess.run(
-                ["powershell", "Get-NetFirewallProfile"],
-                capture_output=True,
-                text=True
-            )
-            if "Enabled : False" in firewall_status.stdout:
-                vulnerabilities.append({
-                    "title": "Windows Firewall Disabled",
-                    "description": "Windows Firewall is disabled on one or more profiles",
-                    "severity": "high",
-                    "cvss_score": 8.0,
-                    "status": "open",
-                    "asset_id": hostname,
-                    "asset_type": "windows_host",
-                    "detection_time": scan_time,
-                    "last_seen": scan_time,
-                    "remediation": "Enable Windows Firewall for all profiles",
-                    "references": [],
-                    "scan_source": "windows_security_scan",
-                    "affected_component": "Windows Firewall",
-                    "affected_versions": ["current"],
-                    "tags": ["firewall", "network_security"]
-                })
-        except Exception as e:
-            print(f"Error checking firewall: {e}")
-
-        # Check Windows Update status
-        try:
-            update_status = subprocess.run(
-                ["powershell", "Get-WindowsUpdateLog"],
-                capture_output=True,
-                text=True
-            )
-            if "Failed" in update_status.stdout or "Error" in update_status.stdout:
-                vulnerabilities.append({
-                    "title": "Windows Update Issues",
-                    "description": "Windows Update service is not functioning properly",
-                    "severity": "high",
-                    "cvss_score": 7.5,
-                    "status": "open",
-                    "asset_id": hostname,
-                    "asset_type": "windows_host",
-                    "detection_time": scan_time,
-                    "last_seen": scan_time,
-                    "remediation": "Check Windows Update service and ensure it is running",
-                    "references": [],
-                    "scan_source": "windows_security_scan",
-                    "affected_component": "Windows Update",
-                    "affected_versions": ["current"],
-                    "tags": ["windows_update", "patching"]
-                })
-        except Exception as e:
-            print(f"Error checking Windows Update: {e}")
-
-        # Check installed software
-        try:
-            for product in self.wmi.Win32_Product():
-                # Check if software is outdated (example criteria)
-                if product.InstallDate:
-                    install_date = datetime.strptime(product.InstallDate, "%Y%m%d")
-                    if (datetime.now() - install_date).days > 365:  # Older than 1 year
-                        vulnerabilities.append({
-                            "title": f"Outdated Software: {product.Name}",
-                            "description": f"Software version {product.Version} is over 1 year old",
-                            "severity": "medium",
-                            "cvss_score": 5.0,
-                            "status": "open",
-                            "asset_id": hostname,
-                            "asset_type": "windows_host",
-                            "detection_time": scan_time,
-                            "last_seen": scan_time,
-                            "remediation": f"Update {product.Name} to the latest version",
-                            "references": [],
-                            "scan_source": "software_audit",
-                            "affected_component": product.Name,
-                            "affected_versions": [product.Version],
-                            "tags": ["outdated_software", "version_control"]
-                        })
-        except Exception as e:
-            print(f"Error checking installed software: {e}")
-
-        # Check running services
-        try:
-            services = subprocess.run(
-                ["powershell", "Get-Service | Where-Object {$_.StartType -eq 'Automatic' -and $_.Status -eq 'Stopped'}"],
-                capture_output=True,
-                text=True
-            )
-            if services.stdout.strip():
-                vulnerabilities.append({
-                    "title": "Critical Services Not Running",
-                    "description": "One or more automatic services are not running",
-                    "severity": "medium",
-                    "cvss_score": 6.0,
-                    "status": "open",
-                    "asset_id": hostname,
-                    "asset_type": "windows_host",
-                    "detection_time": scan_time,
-                    "last_seen": scan_time,
-                    "remediation": "Review and start required services",
-                    "references": [],
-                    "scan_source": "service_audit",
-                    "affected_component": "Windows Services",
-                    "affected_versions": ["current"],
-                    "tags": ["services", "availability"]
-                })
-        except Exception as e:
-            print(f"Error checking services: {e}")
+        # Checks run concurrently, so the scan takes about as long as the slowest one
+        selected = [CHECKS[name] for name in checks] if checks else None
+        vulnerabilities, errors = run_checks(self, hostname, scan_time, checks=selected, max_workers=max_workers)
+        for name, error in errors.items():
+            print(f"Error in check {name}: {error}")
 
         return {"vulnerabilities": vulnerabilities}
 
+    def close(self):
+        """Stop the PowerShell processes"""
+        self.powershell.close()
+
     def send_results(self, results: dict):
         """Send scan results to the API"""
         try:
-            response = requests.post(
+            response = get_transport().post(
                 f"{self.api_url}/api/security/agent/vulnerability-scan",
                 json=results,
                 headers={
@@ -194,10 +73,164 @@ class SecurityScanner:
         except Exception as e:
             print(f"Error sending results to API: {e}")
 
+@register_check('windows_defender', timeout=60)
+def check_windows_defender(scanner, context):
+    """Check Windows Defender status"""
+    status = scanner.powershell.run(
+        "Get-MpComputerStatus | Select-Object RealTimeProtectionEnabled, AntivirusEnabled",
+        deadline=context.deadline, cancelled=context.cancelled
+    )
+    if not status or status.get("RealTimeProtectionEnabled") is not False:
+        return []
+    return [{
+        "title": "Windows Defender Disabled",
+        "description": "Real-time protection is disabled in Windows Defender",
+        "severity": "critical",
+        "cvss_score": 9.0,
+        "status": "open",
+        "asset_id": context.hostname,
+        "asset_type": "windows_host",
+        "detection_time": context.scan_time,
+        "last_seen": context.scan_time,
+        "remediation": "Enable Windows Defender real-time protection",
+        "references": [],
+        "scan_source": "windows_security_scan",
+        "affected_component": "Windows Defender",
+        "affected_versions": ["current"],
+        "tags": ["antivirus", "windows_defender"]
+    }]
+
+@register_check('windows_firewall', timeout=60)
+def check_windows_firewall(scanner, context):
+    """Check Windows Firewall"""
+    profiles = as_list(scanner.powershell.run(
+        "Get-NetFirewallProfile | Select-Object Name, @{Name='Enabled'; Expression={[bool]$_.Enabled}}",
+        deadline=context.deadline, cancelled=context.cancelled
+    ))
+    if all(profile.get("Enabled") for profile in profiles):
+        return []
+    return [{
+        "title": "Windows Firewall Disabled",
+        "description": "Windows Firewall is disabled on one or more profiles",
+        "severity": "high",
+        "cvss_score": 8.0,
+        "status": "open",
+        "asset_id": context.hostname,
+        "asset_type": "windows_host",
+        "detection_time": context.scan_time,
+        "last_seen": context.scan_time,
+        "remediation": "Enable Windows Firewall for all profiles",
+        "references": [],
+        "scan_source": "windows_security_scan",
+        "affected_component": "Windows Firewall",
+        "affected_versions": ["current"],
+        "tags": ["firewall", "network_security"]
+    }]
+
+@register_check('windows_update', timeout=120)
+def check_windows_update(scanner, context):
+    """Check Windows Update status"""
+    # Get-WindowsUpdateLog only writes a log file, so ask the service itself
+    service = scanner.powershell.run(
+        "Get-Service wuauserv | Select-Object @{Name='Status'; Expression={[string]$_.Status}}, "
+        "@{Name='StartType'; Expression={[string]$_.StartType}}",
+        deadline=context.deadline, cancelled=context.cancelled
+    )
+    if service and service.get("StartType") != "Disabled":
+        return []
+    return [{
+        "title": "Windows Update Issues",
+        "description": "Windows Update service is not functioning properly",
+        "severity": "high",
+        "cvss_score": 7.5,
+        "status": "open",
+        "asset_id": context.hostname,
+        "asset_type": "windows_host",
+        "detection_time": context.scan_time,
+        "last_seen": context.scan_time,
+        "remediation": "Check Windows Update service and ensure it is running",
+        "references": [],
+        "scan_source": "windows_security_scan",
+        "affected_component": "Windows Update",
+        "affected_versions": ["current"],
+        "tags": ["windows_update", "patching"]
+    }]
+
+def outdated_software_findings(item, hostname, scan_time):
+    """Flag software installed more than a year ago"""
+    if not item['install_date']:
+        return []
+    try:
+        install_date = datetime.strptime(item['install_date'], "%Y%m%d")
+    except ValueError:
+        return []
+    if (datetime.now() - install_date).days <= 365:  # Older than 1 year
+        return []
+    return [{
+        "title": f"Outdated Software: {item['name']}",
+        "description": f"Software version {item['version']} is over 1 year old",
+        "severity": "medium",
+        "cvss_score": 5.0,
+        "status": "open",
+        "asset_id": hostname,
+        "asset_type": "windows_host",
+        "detection_time": scan_time,
+        "last_seen": scan_time,
+        "remediation": f"Update {item['name']} to the latest version",
+        "references": [],
+        "scan_source": "software_audit",
+        "affected_component": item['name'],
+        "affected_versions": [item['version']],
+        "tags": ["outdated_software", "version_control"]
+    }]
+
+@register_check('installed_software', timeout=300)
+def check_installed_software(scanner, context):
+    """Check installed software"""
+    # Only packages that changed since the last scan are evaluated, and only new findings are reported
+    def evaluate(item):
+        findings = outdated_software_findings(item, context.hostname, context.scan_time)
+        if scanner.matcher:
+            findings.extend(scanner.matcher.match_package(item, context.hostname, context.scan_time))
+        return findings
+
+    _, _, _, findings = scanner.software.refresh(evaluate)
+    return findings
+
+@register_check('services', timeout=60)
+def check_services(scanner, context):
+    """Check running services"""
+    stopped = as_list(scanner.powershell.run(
+        "Get-Service | Where-Object {$_.StartType -eq 'Automatic' -and $_.Status -eq 'Stopped'} "
+        "| Select-Object Name, DisplayName",
+        deadline=context.deadline, cancelled=context.cancelled
+    ))
+    if not stopped:
+        return []
+    return [{
+        "title": "Critical Services Not Running",
+        "description": "One or more automatic services are not running",
+        "severity": "medium",
+        "cvss_score": 6.0,
+        "status": "open",
+        "asset_id": context.hostname,
+        "asset_type": "windows_host",
+        "detection_time": context.scan_time,
+        "last_seen": context.scan_time,
+        "remediation": "Review and start required services",
+        "references": [],
+        "scan_source": "service_audit",
+        "affected_component": "Windows Services",
+        "affected_versions": ["current"],
+        "tags": ["services", "availability"],
+        "details": {"stopped_services": [service.get("Name") for service in stopped]}
+    }]
+
 if __name__ == "__main__":
     try:
         scanner = SecurityScanner()
         results = scanner.scan_system()
+        scanner.close()
         scanner.send_results(results)
         print(f"Found {len(results['vulnerabilities'])} vulnerabilities")
     except Exception as e:
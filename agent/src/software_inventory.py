@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import shutil
+import logging
+import platform
+import subprocess
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.siem-agent', 'software_inventory.json')
+
+UNINSTALL_KEYS = [
+    ('HKEY_LOCAL_MACHINE', r'SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall'),
+    ('HKEY_LOCAL_MACHINE', r'SOFTWARE\WOW6432Node\Microsoft\Windows\CurrentVersion\Uninstall'),
+    ('HKEY_CURRENT_USER', r'SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall')
+]
+
+# osquery tables that list installed software, tried in order
+OSQUERY_SOURCES = {
+    'Windows': [('programs', 'SELECT name, version, publisher, install_date FROM programs;')],
+    'Linux': [
+        ('deb_packages', 'SELECT name, version, maintainer AS publisher, source AS source_package FROM deb_packages;'),
+        ('rpm_packages', 'SELECT name, version, release, epoch, vendor AS publisher FROM rpm_packages;')
+    ],
+    'Darwin': [('apps', "SELECT name, bundle_short_version AS version, '' AS publisher FROM apps;")]
+}
+
+DPKG_STATUS = '/var/lib/dpkg/status'
+OS_RELEASE = '/etc/os-release'
+
+# os-release IDs mapped to the OSV ecosystem their packages are published under
+OSV_ECOSYSTEMS = {
+    'debian': 'Debian',
+    'ubuntu': 'Ubuntu',
+    'alpine': 'Alpine',
+    'rhel': 'Red Hat',
+    'rocky': 'Rocky Linux',
+    'almalinux': 'AlmaLinux',
+    'opensuse-leap': 'openSUSE',
+    'opensuse-tumbleweed': 'openSUSE',
+    'sles': 'SUSE'
+}
+
+
+def package_key(item):
+    return f"{item['name']}@{item['version']}"
+
+
+def os_ecosystem(path=OS_RELEASE):
+    """OSV ecosystem of the distribution's packages, falling back to the distribution it derives from"""
+    fields = {}
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                name, _, value = line.strip().partition('=')
+                fields[name] = value.strip('"\'')
+    except OSError:
+        return None
+    for distro in [fields.get('ID', '')] + fields.get('ID_LIKE', '').split():
+        if distro in OSV_ECOSYSTEMS:
+            return OSV_ECOSYSTEMS[distro]
+    return None
+
+
+def _source_package(source, version):
+    """Source package (name, version) from a dpkg Source field, e.g. bash (5.2.15-2)"""
+    if not source:
+        return None, None
+    name, _, rest = source.partition(' ')
+    source_version = rest.strip().strip('()')
+    return name, source_version or version
+
+
+def _rpm_version(row):
+    """[epoch:]version-release from an osquery rpm_packages row"""
+    version = row.get('version') or ''
+    if row.get('release'):
+        version = f"{version}-{row['release']}"
+    epoch = str(row.get('epoch') or '')
+    # osquery reports packages without an epoch as empty or -1
+    if epoch.isdigit():
+        version = f"{epoch}:{version}"
+    return version
+
+
+def _registry_value(key, name):
+    import winreg
+    try:
+        return winreg.QueryValueEx(key, name)[0]
+    except OSError:
+        return None
+
+
+def read_uninstall_registry():
+    """Installed programs from the Windows uninstall registry keys; cheap and free of MSI side effects"""
+    import winreg
+    items = []
+    for hive_name, path in UNINSTALL_KEYS:
+        try:
+            root = winreg.OpenKey(getattr(winreg, hive_name), path)
+        except OSError:
+            continue
+        with root:
+            for index in range(winreg.QueryInfoKey(root)[0]):
+                try:
+                    with winreg.OpenKey(root, winreg.EnumKey(root, index)) as entry:
+                        name = _registry_value(entry, 'DisplayName')
+                        if not name:
+                            continue
+                        items.append({
+                            'name': name,
+                            'version': _registry_value(entry, 'DisplayVersion') or '',
+                            'publisher': _registry_value(entry, 'Publisher') or '',
+                            'install_date': _registry_value(entry, 'InstallDate') or '',
+                            'source': 'registry'
+                        })
+                except OSError:
+                    continue
+    return items
+
+
+def read_dpkg_status(path=DPKG_STATUS):
+    """Installed Debian packages parsed straight from the dpkg database"""
+    items = []
+    fields = {}
+    ecosystem = os_ecosystem() or 'Debian'
+
+    def add_package():
+        if fields.get('Status', '').endswith(' installed') and fields.get('Package'):
+            version = fields.get('Version', '')
+            # Debian advisories are published per source package, which may build many binaries
+            source_name, source_version = _source_package(fields.get('Source'), version)
+            items.append({
+                'name': fields['Package'],
+                'version': version,
+                'publisher': fields.get('Maintainer', ''),
+                'install_date': '',
+                'source': 'dpkg',
+                'ecosystem': ecosystem,
+                'source_package': source_name or fields['Package'],
+                'source_version': source_version or version
+            })
+
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line:
+                add_package()
+                fields = {}
+            elif not line.startswith(' ') and ':' in line:
+                name, _, value = line.partition(':')
+                fields[name] = value.strip()
+    add_package()
+    return items
+
+
+def read_rpm_database():
+    """Installed RPM packages"""
+    result = subprocess.run(
+        # The epoch ("N:") is part of the version advisories compare against; most packages have none
+        ['rpm', '-qa', '--queryformat',
+         '%{NAME}\t%|EPOCH?{%{EPOCH}:}|%{VERSION}-%{RELEASE}\t%{VENDOR}\t%{INSTALLTIME}\n'],
+        capture_output=True, text=True, timeout=120
+    )
+    items = []
+    ecosystem = os_ecosystem()
+    for line in result.stdout.splitlines():
+        parts = line.split('\t')
+        if len(parts) == 4:
+            items.append({
+                'name': parts[0],
+                'version': parts[1],
+                'publisher': parts[2],
+                'install_date': time.strftime('%Y%m%d', time.gmtime(int(parts[3]))) if parts[3].isdigit() else '',
+                'source': 'rpm',
+                'ecosystem': ecosystem
+            })
+    return items
+
+
+class SoftwareInventory:
+    """Installed software with an on-disk cache of what has already been evaluated.
+
+    Entries are keyed by product and version. Only packages that are new (or
+    whose evaluation is older than ``reevaluate_after``) are passed to the
+    evaluator, and only findings that were not reported before are returned.
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, osquery=None, reevaluate_after=24 * 3600):
+        self.cache_path = cache_path
+        self.osquery = osquery
+        self.reevaluate_after = reevaluate_after
+        self._lock = threading.Lock()
+        self.cache = self._load_cache()
+
+    def _load_cache(self):
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f).get('entries', {})
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'entries': self.cache}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _read_osquery(self):
+        for table, query in OSQUERY_SOURCES.get(platform.system(), []):
+            rows = self.osquery.run_query(query)
+            if rows:
+                ecosystem = os_ecosystem() if table in ('deb_packages', 'rpm_packages') else None
+                items = []
+                for row in rows:
+                    if not row.get('name'):
+                        continue
+                    item = {
+                        'name': row.get('name'),
+                        'version': row.get('version') or '',
+                        'publisher': row.get('publisher') or '',
+                        'install_date': row.get('install_date') or '',
+                        'source': table,
+                        'ecosystem': ecosystem
+                    }
+                    if table == 'rpm_packages':
+                        item['version'] = _rpm_version(row)
+                    if table == 'deb_packages':
+                        source_name, source_version = _source_package(row.get('source_package'), item['version'])
+                        item['source_package'] = source_name or item['name']
+                        item['source_version'] = source_version or item['version']
+                    items.append(item)
+                return items
+        return None
+
+    def collect(self):
+        """Read the current list of installed software from the cheapest available source"""
+        system = platform.system()
+        if system == 'Windows':
+            return read_uninstall_registry()
+        if system == 'Linux' and os.path.exists(DPKG_STATUS):
+            return read_dpkg_status()
+        if self.osquery and (self.osquery.osqueryi_path or self.osquery.session):
+            items = self._read_osquery()
+            if items is not None:
+                return items
+        if system == 'Linux' and shutil.which('rpm'):
+            return read_rpm_database()
+        return []
+
+    def refresh(self, evaluator=None):
+        """Sync the cache with the installed software.
+
+        Returns (items, added, removed, new_findings); ``evaluator(item)``
+        returns a list of findings and is only called for changed entries.
+        """
+        items = self.collect()
+        now = time.time()
+        with self._lock:
+            current = {package_key(item): item for item in items}
+            added = [item for key, item in current.items() if key not in self.cache]
+            removed = [entry['item'] for key, entry in self.cache.items() if key not in current]
+            for key in list(self.cache):
+                if key not in current:
+                    del self.cache[key]
+
+            new_findings = []
+            for key, item in current.items():
+                entry = self.cache.get(key)
+                if entry and now - entry['evaluated_at'] < self.reevaluate_after:
+                    continue
+                reported = set(entry['reported']) if entry else set()
+                findings = evaluator(item) if evaluator else []
+                for finding in findings:
+                    if finding['title'] not in reported:
+                        new_findings.append(finding)
+                self.cache[key] = {
+                    'item': item,
+                    'evaluated_at': now,
+                    'reported': sorted(reported | {finding['title'] for finding in findings})
+                }
+
+            try:
+                self._save_cache()
+            except OSError as e:
+                logger.warning(f"Could not save software inventory cache: {str(e)}")
+
+        return items, added, removed, new_findings
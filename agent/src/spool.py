@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from src.transport import get_transport
+from src.wire_format import serialize, serialize_gzip, iter_json
+from src.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = 'spool-'
+SEGMENT_SUFFIX = '.jsonl'
+CURSOR_FILE = 'cursor.json'
+
+
+class Spool:
+    """Durable append-only queue of pending uploads stored as segmented JSONL files.
+
+    New records go to the newest segment. The sender reads from the oldest
+    segment and acknowledges what it delivered through a cursor file, and
+    fully delivered segments are deleted. When the spool grows past
+    ``max_bytes`` the oldest segments are evicted.
+    """
+
+    def __init__(self, directory, max_bytes=50 * 1024 * 1024, segment_bytes=1024 * 1024, on_evict=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        segments = self._segments()
+        self._next_seq = (segments[-1] + 1) if segments else 1
+        self._active = None
+        self._cursor = self._load_cursor()
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}")
+
+    def _segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(segments)
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                cursor = json.load(f)
+            return cursor['segment'], cursor['line']
+        except (OSError, ValueError, KeyError):
+            return 0, 0
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'segment': self._cursor[0], 'line': self._cursor[1]}, f)
+        os.replace(tmp_path, path)
+
+    def size(self):
+        """Total bytes currently held in the spool"""
+        total = 0
+        for seq in self._segments():
+            try:
+                total += os.path.getsize(self._segment_path(seq))
+            except OSError:
+                pass
+        return total
+
+    def append(self, record):
+        """Durably add a record to the spool"""
+        with self._lock:
+            if self._active is None or os.path.getsize(self._segment_path(self._active)) >= self.segment_bytes:
+                self._active = self._next_seq
+                self._next_seq += 1
+
+            with open(self._segment_path(self._active), 'a') as f:
+                # Written piecewise so a large body is never encoded as one string; a record that
+                # fails part way is still terminated and skipped as corrupt when read back
+                try:
+                    f.writelines(iter_json(record))
+                finally:
+                    f.write('\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._enforce_cap()
+
+    def _enforce_cap(self):
+        segments = self._segments()
+        total = sum(os.path.getsize(self._segment_path(seq)) for seq in segments)
+        evicted = 0
+        while total > self.max_bytes and len(segments) > 1:
+            seq = segments.pop(0)
+            path = self._segment_path(seq)
+            total -= os.path.getsize(path)
+            if seq >= self._cursor[0]:
+                # Only records the sender has not acknowledged are lost
+                with open(path) as f:
+                    lines = sum(1 for _ in f)
+                evicted += lines - (self._cursor[1] if seq == self._cursor[0] else 0)
+            os.remove(path)
+            if self._cursor[0] <= seq:
+                self._cursor = (segments[0], 0)
+                self._save_cursor()
+
+        if evicted:
+            logger.warning(f"Spool over {self.max_bytes} bytes, evicted {evicted} oldest record(s)")
+            METRICS.inc('spool_evicted_records_total', evicted)
+            if self.on_evict:
+                self.on_evict(evicted)
+
+    def read_batch(self, max_records=100):
+        """Return up to ``max_records`` undelivered records, oldest first, with their positions"""
+        with self._lock:
+            # The active segment is read too: appends hold the same lock and only add whole lines,
+            # so it keeps filling until it reaches segment_bytes instead of rolling on every drain
+            batch = []
+            for seq in self._segments():
+                if seq < self._cursor[0]:
+                    continue
+                start = self._cursor[1] if seq == self._cursor[0] else 0
+                with open(self._segment_path(seq)) as f:
+                    for index, line in enumerate(f):
+                        if index < start:
+                            continue
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # A torn write from a crash; skip it
+                            logger.warning(f"Skipping corrupt spool record in segment {seq}")
+                            continue
+                        batch.append(((seq, index + 1), record))
+                        if len(batch) >= max_records:
+                            return batch
+            return batch
+
+    def ack(self, position):
+        """Mark every record up to and including ``position`` as delivered"""
+        with self._lock:
+            self._cursor = position
+            for seq in self._segments():
+                if seq >= position[0]:
+                    break
+                os.remove(self._segment_path(seq))
+            self._save_cursor()
+
+    def empty(self):
+        return not self.read_batch(1)
+
+
+class SpoolSender:
+    """Drains the spool with compressed uploads and exponential backoff.
+
+    The backend takes one payload per request, so every record is its own
+    POST; records are read in batches so that ones superseded later in the
+    batch (a status update after an outage) are coalesced and never sent.
+    """
+
+    def __init__(self, spool, headers=None, batch_size=100, compress=True,
+                 initial_backoff=2, max_backoff=300):
+        self.spool = spool
+        self.headers = headers or {}
+        self.batch_size = batch_size
+        self.compress = compress
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.backoff = 0
+        self.retry_at = 0
+        self._lock = threading.Lock()
+
+    def _coalesce(self, batch):
+        """Drop records superseded by a later record with the same coalesce key"""
+        latest = {}
+        for index, (_, record) in enumerate(batch):
+            if record.get('coalesce'):
+                latest[record['coalesce']] = index
+        return [
+            (position, record) for index, (position, record) in enumerate(batch)
+            if not record.get('coalesce') or latest[record['coalesce']] == index
+        ]
+
+    def _post(self, record):
+        headers = dict(self.headers)
+        if self.compress:
+            body, content_type = serialize_gzip(record['body'], record.get('encoding', 'json'))
+            headers['Content-Encoding'] = 'gzip'
+        else:
+            body, content_type = serialize(record['body'], record.get('encoding', 'json'))
+        headers['Content-Type'] = content_type
+        return get_transport().post(record['url'], data=body, params=record.get('params'), headers=headers)
+
+    def _failed(self, reason):
+        self.backoff = min(self.backoff * 2, self.max_backoff) if self.backoff else self.initial_backoff
+        # Jitter spreads out retries from many agents after a shared outage
+        self.retry_at = time.monotonic() + self.backoff * random.uniform(0.5, 1.0)
+        logger.warning(f"Upload failed ({reason}), retrying in up to {self.backoff}s")
+
+    def drain(self):
+        """Send pending records until the spool is empty or an upload fails"""
+        with self._lock:
+            if time.monotonic() < self.retry_at:
+                return False
+
+            while True:
+                batch = self.spool.read_batch(self.batch_size)
+                METRICS.set_gauge('spool_bytes', self.spool.size())
+                if not batch:
+                    self.backoff = 0
+                    return True
+
+                last_position = batch[-1][0]
+                for position, record in self._coalesce(batch):
+                    try:
+                        response = self._post(record)
+                    except Exception as e:
+                        self._failed(str(e))
+                        return False
+
+                    if response.status_code >= 500 or response.status_code in (408, 429):
+                        self._failed(f"{response.status_code} from {record['url']}")
+                        return False
+                    if not 200 <= response.status_code < 300:
+                        # Retrying will not help; drop the record rather than block the spool
+                        logger.warning(f"Dropping spooled upload: {response.status_code} - {response.text}")
+                    self.spool.ack(position)
+
+                self.spool.ack(last_position)
@@ -0,0 +1,113 @@
+import json as jsonlib
+import logging
+import threading
+from urllib.parse import urlsplit
+from src.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class Transport:
+    """Shared HTTP client for every agent upload.
+
+    Wraps a single pooled keep-alive session with connect/read timeouts and
+    retries with backoff. HTTP/2 is used when requested and the optional
+    ``httpx`` package (with ``h2``) is installed.
+    """
+
+    def __init__(self, connect_timeout=5, read_timeout=30, retries=3, backoff_factor=0.5,
+                 pool_size=10, http2=False):
+        self.timeout = (connect_timeout, read_timeout)
+        self.http2 = False
+
+        if http2:
+            try:
+                import httpx
+                self.client = httpx.Client(
+                    http2=True,
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                    transport=httpx.HTTPTransport(http2=True, retries=retries)
+                )
+                self.http2 = True
+            except ImportError:
+                logger.warning("HTTP/2 requested but httpx is not installed, using HTTP/1.1")
+
+        if not self.http2:
+            # Imported with the first client so the agent can parse arguments and run offline without it
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            # Connection failures are always safe to retry because nothing reached the server.
+            # Read errors and 5xx responses are only retried for idempotent methods, so a
+            # POST of scan results is never stored twice.
+            retry = Retry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            self.session = requests.Session()
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+    def post(self, url, json=None, data=None, params=None, headers=None, timeout=None):
+        """POST through the shared connection pool"""
+        headers = dict(headers or {})
+        if json is not None:
+            # Serialize here so the payload size can be recorded
+            data = jsonlib.dumps(json).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json')
+
+        # Labelled by the last path segment only; the query string can carry the user id
+        endpoint = urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+        METRICS.inc('upload_bytes_total', len(data or b''), endpoint=endpoint)
+        with METRICS.timed('upload', endpoint=endpoint):
+            if self.http2:
+                # Without an override the client's httpx.Timeout keeps its separate connect timeout;
+                # passing None to httpx would disable timeouts altogether
+                kwargs = {}
+                if isinstance(timeout, tuple):
+                    import httpx
+                    kwargs['timeout'] = httpx.Timeout(timeout[1], connect=timeout[0])
+                elif timeout:
+                    kwargs['timeout'] = timeout
+                response = self.client.post(url, content=data, params=params, headers=headers, **kwargs)
+            else:
+                response = self.session.post(url, data=data, params=params, headers=headers,
+                                             timeout=timeout or self.timeout)
+        if response.status_code >= 400:
+            METRICS.inc('upload_errors_total', endpoint=endpoint, status=response.status_code)
+        return response
+
+    def close(self):
+        if self.http2:
+            self.client.close()
+        else:
+            self.session.close()
+
+
+_default_transport = None
+_default_lock = threading.Lock()
+
+
+def get_transport():
+    """Return the process-wide transport, creating it with defaults on first use"""
+    global _default_transport
+    with _default_lock:
+        if _default_transport is None:
+            _default_transport = Transport()
+        return _default_transport
+
+
+def configure_transport(**kwargs):
+    """Replace the process-wide transport with one built from ``kwargs``"""
+    global _default_transport
+    with _default_lock:
+        if _default_transport is not None:
+            _default_transport.close()
+        _default_transport = Transport(**kwargs)
+        return _default_transport
@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import logging
+from bisect import bisect_right
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FEED_PATH = os.path.join(os.path.expanduser('~'), '.siem-agent', 'advisories.json')
+
+_VERSION_TOKEN = re.compile(r'\d+|[a-zA-Z]+|~')
+
+SEVERITY_SCORES = {
+    'critical': 9.5,
+    'high': 8.0,
+    'medium': 5.5,
+    'low': 3.0
+}
+
+
+def version_key(version):
+    """Sortable key for dpkg/rpm/semver-style version strings.
+
+    An epoch prefix ("1:") is honoured, numbers compare numerically,
+    and "~" sorts before the end of the string so 1.0~rc1 < 1.0.
+    """
+    version = str(version or '')
+    epoch = 0
+    if ':' in version:
+        head, _, rest = version.partition(':')
+        if head.isdigit():
+            epoch, version = int(head), rest
+
+    key = [epoch]
+    for token in _VERSION_TOKEN.findall(version):
+        if token == '~':
+            key.append((0,))
+        elif token.isdigit():
+            key.append((3, int(token)))
+        else:
+            key.append((2, token.lower()))
+    key.append((1,))
+    return tuple(key)
+
+
+def _severity(advisory):
+    specific = advisory.get('database_specific') or {}
+    severity = str(specific.get('severity') or '').lower()
+    if severity == 'moderate':
+        severity = 'medium'
+    return severity if severity in SEVERITY_SCORES else 'medium'
+
+
+def ecosystem_family(ecosystem):
+    """Lower-cased ecosystem without its release, so "Debian:12" and "Debian" index together"""
+    return str(ecosystem or '').split(':')[0].strip().lower()
+
+
+def _ranges(affected):
+    """Turn OSV range events into (start, end, end_inclusive) intervals of version keys"""
+    intervals = []
+    for version_range in affected.get('ranges', []):
+        if version_range.get('type') == 'GIT':
+            continue
+        start = None
+        open_range = False
+        for event in version_range.get('events', []):
+            if 'introduced' in event:
+                start = None if event['introduced'] == '0' else version_key(event['introduced'])
+                open_range = True
+            elif 'fixed' in event and open_range:
+                intervals.append((start, version_key(event['fixed']), False))
+                open_range = False
+            elif 'last_affected' in event and open_range:
+                intervals.append((start, version_key(event['last_affected']), True))
+                open_range = False
+        if open_range:
+            intervals.append((start, None, False))
+    return intervals
+
+
+class VulnerabilityMatcher:
+    """Offline index of OSV advisories keyed by (ecosystem, package name).
+
+    Each package maps to its affected version ranges sorted by start
+    version, so matching one installed package is a dict lookup plus a
+    bisect instead of a scan over every advisory. Inventory items are
+    matched within their own ecosystem only, and Debian-style items by
+    their source package, which is what distribution advisories name.
+    """
+
+    def __init__(self, advisories=None):
+        self.advisories = []
+        self.ranges = {}
+        self.range_starts = {}
+        self.exact_versions = {}
+        # (package key, advisory index) pairs that have no fixed version yet
+        self.unfixed = set()
+        for advisory in advisories or []:
+            self.add(advisory)
+        self._sort()
+
+    @classmethod
+    def load(cls, path=DEFAULT_FEED_PATH):
+        """Load an OSV feed: a JSON list, an object with an "advisories" list, or JSON lines"""
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        try:
+            data = json.loads(text)
+            advisories = data.get('advisories', []) if isinstance(data, dict) else data
+        except ValueError:
+            advisories = [json.loads(line) for line in text.splitlines() if line.strip()]
+        matcher = cls(advisories)
+        logger.info(f"Loaded {len(matcher.advisories)} advisories for {len(matcher.ranges)} packages")
+        return matcher
+
+    def add(self, advisory):
+        index = len(self.advisories)
+        self.advisories.append({
+            'id': advisory.get('id'),
+            'aliases': advisory.get('aliases', []),
+            'summary': advisory.get('summary') or advisory.get('details', '')[:200],
+            'severity': _severity(advisory),
+            'references': [ref.get('url') for ref in advisory.get('references', []) if ref.get('url')]
+        })
+        for affected in advisory.get('affected', []):
+            package = affected.get('package') or {}
+            if not package.get('name'):
+                continue
+            key = (ecosystem_family(package.get('ecosystem')), package['name'].lower())
+            intervals = _ranges(affected)
+            for start, end, inclusive in intervals:
+                self.ranges.setdefault(key, []).append((start or (), end, inclusive, index))
+            if intervals and all(end is None for _, end, _ in intervals):
+                self.unfixed.add((key, index))
+            for version in affected.get('versions', []):
+                self.exact_versions.setdefault((key, version), []).append(index)
+
+    def _sort(self):
+        for key, ranges in self.ranges.items():
+            ranges.sort(key=lambda r: r[0])
+            self.range_starts[key] = [r[0] for r in ranges]
+
+    def match_version(self, name, version, ecosystem=None):
+        """Indexes of advisories affecting one package version in an ecosystem"""
+        key = (ecosystem_family(ecosystem), name.lower())
+        matched = set(self.exact_versions.get((key, version), []))
+        ranges = self.ranges.get(key)
+        if ranges:
+            version = version_key(version)
+            # Only ranges starting at or below the version can contain it
+            for _, end, inclusive, index in ranges[:bisect_right(self.range_starts[key], version)]:
+                if end is None or version < end or (inclusive and version == end):
+                    matched.add(index)
+        return matched
+
+    def match_package(self, item, hostname=None, scan_time=None):
+        """Vulnerability findings for one inventory item"""
+        ecosystem = item.get('ecosystem')
+        packages = [(item['name'], item['version'])]
+        if item.get('source_package'):
+            packages.insert(0, (item['source_package'], item.get('source_version') or item['version']))
+        matches = {}
+        for name, version in packages:
+            for index in self.match_version(name, version, ecosystem):
+                matches.setdefault(index, (ecosystem_family(ecosystem), name.lower()))
+
+        findings = []
+        for index in sorted(matches):
+            advisory = self.advisories[index]
+            if (matches[index], index) in self.unfixed:
+                remediation = f"No fixed version of {item['name']} has been published for {advisory['id']} yet"
+            else:
+                remediation = f"Upgrade {item['name']} to a version not affected by {advisory['id']}"
+            findings.append({
+                "title": f"{advisory['id']}: {item['name']} {item['version']}",
+                "description": advisory['summary'],
+                "severity": advisory['severity'],
+                "cvss_score": SEVERITY_SCORES[advisory['severity']],
+                "status": "open",
+                "asset_id": hostname,
+                "asset_type": "host",
+                "detection_time": scan_time,
+                "last_seen": scan_time,
+                "remediation": remediation,
+                "references": advisory['references'],
+                "scan_source": "advisory_match",
+                "affected_component": item['name'],
+                "affected_versions": [item['version']],
+                "tags": ["vulnerability", advisory['id']] + advisory['aliases']
+            })
+        return findings
+
+    def match(self, items, hostname=None, scan_time=None):
+        """Vulnerability findings for a whole package inventory"""
+        findings = []
+        for item in items:
+            findings.extend(self.match_package(item, hostname, scan_time))
+        return findings
@@ -0,0 +1,155 @@
+import json
+import zlib
+import types
+from datetime import datetime
+from itertools import islice
+
+# (output column, osquery source column) pairs, matching format_process_data / format_network_data
+PROCESS_COLUMNS = [
+    ('pid', 'pid'),
+    ('name', 'name'),
+    ('path', 'path'),
+    ('command', 'cmdline'),
+    ('state', 'state'),
+    ('parent_pid', 'parent'),
+    ('user_id', 'uid'),
+    ('start_time', 'start_time')
+]
+
+NETWORK_COLUMNS = [
+    ('process_name', 'name'),
+    ('process_path', 'path'),
+    ('local_port', 'port'),
+    ('local_address', 'address'),
+    ('protocol', 'protocol')
+]
+
+# Columns whose values repeat across rows and are sent as indexes into a per-batch dictionary
+DICTIONARY_COLUMNS = {'name', 'path', 'command', 'state', 'process_name', 'process_path', 'local_address', 'protocol'}
+
+WIRE_FORMATS = ('json', 'compact', 'msgpack')
+
+# Characters of encoded JSON handed to zlib at a time by serialize_gzip
+COMPRESS_BLOCK_SIZE = 64 * 1024
+
+# List elements encoded per call by iter_json; large enough to keep the work in the C encoder
+ENCODE_BATCH_SIZE = 256
+
+# zlib's default level: level 9 costs several times the CPU for a few percent smaller uploads
+GZIP_LEVEL = 6
+
+
+def encode_columns(row_type, rows, columns):
+    """Encode raw osquery rows as one columnar batch in a single pass.
+
+    The batch carries one timestamp, a column header and one array per row.
+    Repeated strings in dictionary columns are replaced with indexes into
+    ``dictionary[column]``.
+    """
+    names = [name for name, _ in columns]
+    sources = [source for _, source in columns]
+    encoded_columns = [i for i, name in enumerate(names) if name in DICTIONARY_COLUMNS]
+    lookups = {i: {} for i in encoded_columns}
+
+    encoded_rows = []
+    for row in rows or []:
+        values = [row.get(source) for source in sources]
+        for i in encoded_columns:
+            value = values[i]
+            if value is not None:
+                lookup = lookups[i]
+                index = lookup.get(value)
+                if index is None:
+                    index = lookup[value] = len(lookup)
+                values[i] = index
+        encoded_rows.append(values)
+
+    return {
+        'type': row_type,
+        'timestamp': datetime.utcnow().isoformat(),
+        'columns': names,
+        'dictionary': {names[i]: list(lookups[i]) for i in encoded_columns},
+        'rows': encoded_rows
+    }
+
+
+def decode_columns(batch):
+    """Expand a columnar batch back into the row dicts format_*_data produces"""
+    names = batch['columns']
+    dictionaries = [batch['dictionary'].get(name) for name in names]
+    decoded = []
+    for values in batch['rows']:
+        data = {}
+        for name, dictionary, value in zip(names, dictionaries, values):
+            data[name] = dictionary[value] if dictionary is not None and value is not None else value
+        decoded.append({'type': batch['type'], 'timestamp': batch['timestamp'], 'data': data})
+    return decoded
+
+
+def serialize(body, wire_format='json'):
+    """Serialize an upload body, returning (bytes, content type)"""
+    if wire_format == 'msgpack':
+        import msgpack
+        return msgpack.packb(body, use_bin_type=True), 'application/msgpack'
+    return json.dumps(body, separators=(',', ':')).encode('utf-8'), 'application/json'
+
+
+def iter_json(body, default=None):
+    """Encode ``body`` as compact JSON in pieces, a batch of list elements at a time.
+
+    Dicts are walked key by key and lists (or generators, such as the
+    formatted rows from OSQueryManager.stream_query) ENCODE_BATCH_SIZE
+    elements at a time, so only one batch is ever encoded in memory at once.
+    """
+    return _iter_json(body, json.JSONEncoder(separators=(',', ':'), default=default).encode)
+
+
+def _iter_json(body, encode):
+    if isinstance(body, dict):
+        yield '{'
+        for index, (key, value) in enumerate(body.items()):
+            yield (',' if index else '') + encode(str(key)) + ':'
+            yield from _iter_json(value, encode)
+        yield '}'
+    elif isinstance(body, (list, tuple, types.GeneratorType)):
+        yield '['
+        items = iter(body)
+        separator = ''
+        while True:
+            batch = list(islice(items, ENCODE_BATCH_SIZE))
+            if not batch:
+                break
+            # The batch is encoded as one list and its brackets dropped
+            yield separator + encode(batch)[1:-1]
+            separator = ','
+        yield ']'
+    else:
+        yield encode(body)
+
+
+def serialize_gzip(body, wire_format='json'):
+    """Serialize and gzip an upload body, returning (compressed bytes, content type).
+
+    JSON is compressed as it is encoded, so the uncompressed document is
+    never held in memory.
+    """
+    if wire_format == 'msgpack':
+        import gzip
+        body, content_type = serialize(body, wire_format)
+        return gzip.compress(body, GZIP_LEVEL), content_type
+
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    compressed = []
+    pending = []
+    pending_size = 0
+    for piece in iter_json(body):
+        pending.append(piece)
+        pending_size += len(piece)
+        # Hand zlib large blocks; compressing every row separately is several times slower
+        if pending_size >= COMPRESS_BLOCK_SIZE:
+            compressed.append(compressor.compress(''.join(pending).encode('utf-8')))
+            pending = []
+            pending_size = 0
+    compressed.append(compressor.compress(''.join(pending).encode('utf-8')))
+    compressed.append(compressor.flush())
+    return b''.join(compressed), 'application/json'